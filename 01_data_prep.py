@@ -1,31 +1,107 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from coerce import coercion_report, load_token_cache, save_token_cache, to_bin, to_num
+from ingest import (
+    CACHE_DIR,
+    SRC_XLSX,
+    arrow_frame,
+    column_signature,
+    iter_workbook_chunks,
+    read_workbook,
+    row_fingerprints,
+    scan_workbook,
+    write_dataset,
+)
+from loader import save_csv, save_csv_dtypes
+from rowagg import row_max, row_mean, row_sum
+from schema import apply_schema
+from segments import (
+    SEGMENTS,
+    SEQUENCES,
+    WALLS,
+    load_segment_tensor,
+    open_segment_tensor,
+    save_segment_tensor,
+    segment_column,
+    segment_tensor,
+    wall_severe,
+)
 
 # plan 0: load data
-SRC_XLSX = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/Database 6.12 clean LB.xlsx"
 OUT_PARQUET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
+OUT_SEGMENTS = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/segments.npy"
+OUT_DATASET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean_dataset"
+OUT_FEATURE_CACHE = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/features_cache.parquet"
+OUT_COERCION = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/coercion_report.csv"
 OUT_CSV = "/workspace/clean.csv"
-
-
-def to_num(series: pd.Series) -> pd.Series:
-    return pd.to_numeric(series, errors="coerce")
-
-
-def to_bin(series: pd.Series) -> pd.Series:
-    s = series if isinstance(series, pd.Series) else pd.Series(series)
-    if s.dtype == object:
-        s = s.str.strip().str.lower()
-        s = s.replace({
-            "yes": 1,
-            "y": 1,
-            "true": 1,
-            "1": 1,
-            "no": 0,
-            "n": 0,
-            "false": 0,
-            "0": 0,
-        })
-    return pd.to_numeric(s, errors="coerce").fillna(0).astype(int)
+TOKEN_CACHE_PATH = os.path.join(CACHE_DIR, "token_map.json")
+
+
+PRE_DX_COL = "Pre-MR diagnosis/suspected_simplified (1=infiltrative,2=valvulopathy,3=HOCM,4=myopericarditis,5=ischemia,6=other unexplained CMP,7=Othe, 8= VT)"
+POST_DX_COL = "Post-MR diagnosis/suspected_simplified (1=infiltrative,2=valvulopathy,3=HOCM,4=myopericarditis,5=ischemia,6=other unexplained CMP,7=Othe, 8= VT)"
+
+# raw workbook columns read by build_features (keys for incremental rebuilds)
+FEATURE_INPUTS = [
+    "Age",
+    "Sex (1-M)",
+    "Height cm",
+    "Weight Kg",
+    "BMI",
+    "HF (1=Y)",
+    "HTN (1=Y)",
+    "CAD",
+    "MI (Y=1)",
+    "VT/VF",
+    "Vfib (1=Y)",
+    "VT (1=Y)",
+    "Afib (1=Y)",
+    "CKD (1=Y)",
+    PRE_DX_COL,
+    POST_DX_COL,
+    "Type of Device (ICD =1 PPM = 2 CRT = 3)",
+    "ICD indication (Primary prevention = 1, secodary prevention =2)",
+    "PPM indications (CHB = 1, SND = 2, Other = 3)",
+    "MR Conditional ",
+    "Position in body (left chest = 1, right chest = 2, leadless = 3, 4=subC)",
+    "Position (L chest=1, other=2)",
+    "Manufacturer (1=Boston,2=MDT,3=Bio,4=StJude,5=other)",
+    "Atrial Lead Yes/No",
+    "Ventricular lead Yes/No",
+    "LV lead Yes/No",
+    "SubQ lead - (0=no,1=yes,3=other (leadless)",
+    "Rotation. 0 = normal, 1 rotated.",
+    "CXR- PPM to cardiac silhouette - shortest (mm)",
+    "PPM to LV Apex",
+    "Widest Chest Transverse Diameter",
+    "Any artefact (grade 3 or above)",
+    "Any artefact (grade 3 or above).1",
+    "Any artefact (grade 3 or above).2",
+    "Artefact ratio (biventricular)",
+    "Artefact ratio (biventricular).1",
+    "Artefact ratio (biventricular).2",
+    "Cause of Artifact (1=IPG, 2=Lead, 3=Both, 0=None)",
+    "Cause of Artifact (1=IPG, 2=Lead, 3=Both, 0=None).1",
+    "Cause of Artifact (1=IPG, 2=Lead, 3=Both, 0=None).2",
+    "RV Artefact cause (Lead alone=1, lead and device=2, neither=3,IPG=4)",
+    "RV Artefact cause (Lead alone=1, lead and device=2, neither=3, IPG=4)",
+    "RV Artefact cause (Lead alone=1, lead and device=2, neither=3, IPG=4).1",
+    "TFE (exact sequence listed)",
+    "CINE_SSFP (exact sequence listed)",
+    "VIAB (exact sequence listed)",
+    "Non-diagnostic",
+    "Did MRI provide additional information to the existing diagnosis? (ie quantity of iron, location of scar, etc) ",
+    " Was the pre-MRI (tentative) diagnosis confirmed?",
+    "Was patient management altered as a result of the scan data?",
+] + [segment_column(seq, seg) for seq in SEQUENCES for seg in SEGMENTS]
 
 
 def safe_divide(num: pd.Series, den: pd.Series) -> pd.Series:
@@ -34,7 +110,7 @@ def safe_divide(num: pd.Series, den: pd.Series) -> pd.Series:
     return num / den.replace(0, np.nan)
 
 
-def build_features(df: pd.DataFrame) -> pd.DataFrame:
+def build_features(df: pd.DataFrame, grades: np.ndarray = None) -> pd.DataFrame:
     # plan 1.1: basic & disease phenotype
     df["age"] = to_num(df.get("Age"))
     df["sex_male"] = to_bin(df.get("Sex (1-M)", 0))
@@ -56,10 +132,8 @@ def build_features(df: pd.DataFrame) -> pd.DataFrame:
     for new, old in comorb_cols.items():
         df[new] = to_bin(df.get(old, 0))
 
-    pre_col = "Pre-MR diagnosis/suspected_simplified (1=infiltrative,2=valvulopathy,3=HOCM,4=myopericarditis,5=ischemia,6=other unexplained CMP,7=Othe, 8= VT)"
-    post_col = "Post-MR diagnosis/suspected_simplified (1=infiltrative,2=valvulopathy,3=HOCM,4=myopericarditis,5=ischemia,6=other unexplained CMP,7=Othe, 8= VT)"
-    df["pre_dx_cat"] = to_num(df.get(pre_col))
-    df["post_dx_cat"] = to_num(df.get(post_col))
+    df["pre_dx_cat"] = to_num(df.get(PRE_DX_COL))
+    df["post_dx_cat"] = to_num(df.get(POST_DX_COL))
     dx_map = {
         1: "infiltrative",
         2: "valvular",
@@ -109,9 +183,7 @@ def build_features(df: pd.DataFrame) -> pd.DataFrame:
     subq_raw = df.get("SubQ lead - (0=no,1=yes,3=other (leadless)")
     df["subq_lead"] = (to_num(subq_raw) == 1).fillna(0).astype(int) if subq_raw is not None else 0
 
-    df["n_leads"] = (
-        df[["atrial_lead", "ventricular_lead", "lv_lead", "subq_lead"]].sum(axis=1)
-    )
+    df["n_leads"] = row_sum(df, ["atrial_lead", "ventricular_lead", "lv_lead", "subq_lead"])
     df["has_LV"] = df["lv_lead"]
     df["has_SQ"] = df["subq_lead"]
 
@@ -125,55 +197,38 @@ def build_features(df: pd.DataFrame) -> pd.DataFrame:
 
     # plan 1.4: sequences & artefact
     seqs = [
-        {"name": "TFE", "sfx": "", "any": "Any artefact (grade 3 or above)", "ratio": "Artefact ratio (biventricular)"},
-        {"name": "CINE", "sfx": ".1", "any": "Any artefact (grade 3 or above).1", "ratio": "Artefact ratio (biventricular).1"},
-        {"name": "VIAB", "sfx": ".2", "any": "Any artefact (grade 3 or above).2", "ratio": "Artefact ratio (biventricular).2"},
+        {"name": "TFE", "any": "Any artefact (grade 3 or above)", "ratio": "Artefact ratio (biventricular)"},
+        {"name": "CINE", "any": "Any artefact (grade 3 or above).1", "ratio": "Artefact ratio (biventricular).1"},
+        {"name": "VIAB", "any": "Any artefact (grade 3 or above).2", "ratio": "Artefact ratio (biventricular).2"},
     ]
 
-    def region_cols(sfx: str) -> dict:
-        return {
-            "lateral": [f"B_Anterolateral{sfx}", f"B_Inferolateral{sfx}", f"M_Anterolateral{sfx}", f"M_Inferolateral{sfx}", f"A_Lateral{sfx}"],
-            "septal": [f"B_Inferoseptal{sfx}", f"B_Anteroseptal{sfx}", f"M_Inferoseptal{sfx}", f"M_Anteroseptal{sfx}", f"A_Septal{sfx}"],
-            "anterior": [f"B_Anterior{sfx}", f"M_Anterior{sfx}", f"A_Anterior{sfx}"],
-            "inferior": [f"B_Inferior{sfx}", f"M_Inferior{sfx}", f"A_Inferior{sfx}"],
-        }
+    # segment walls come from the (patients x sequence x segment) grade tensor
+    if grades is None:
+        grades = segment_tensor(df)
+    severe = wall_severe(grades)
+    any_art = np.column_stack([
+        to_num(df[info["any"]]).to_numpy(dtype=float, na_value=np.nan) if info["any"] in df.columns else np.full(len(df), np.nan)
+        for info in seqs
+    ]) >= 1
 
     ratio_cols = []
-    wall_any_severe_cols = {"lateral": [], "septal": [], "anterior": [], "inferior": []}
     for info in seqs:
-        name, sfx = info["name"], info["sfx"]
-        any_col, ratio_col = info["any"], info["ratio"]
-        df[f"severe_art_{name}"] = (to_num(df.get(any_col)) >= 1).fillna(0).astype(int)
-        df[f"ratio_{name}"] = to_num(df.get(ratio_col))
+        name = info["name"]
+        q = SEQUENCES.index(name)
+        df[f"severe_art_{name}"] = any_art[:, q].astype(int)
+        df[f"ratio_{name}"] = to_num(df.get(info["ratio"]))
         ratio_cols.append(f"ratio_{name}")
+        for w, wall in enumerate(WALLS):
+            df[f"{wall}_severe_{name}"] = severe[:, q, w].astype(int)
+            df[f"lv_{wall}_clean_{name}"] = (~severe[:, q, w]).astype(int)
 
-        walls = region_cols(sfx)
-        for wall, cols in walls.items():
-            existing = [c for c in cols if c in df.columns]
-            if existing:
-                sev_any = (pd.concat([to_num(df[c]) for c in existing], axis=1) >= 3).any(axis=1).astype(int)
-            else:
-                sev_any = pd.Series(0, index=df.index)
-            df[f"{wall}_severe_{name}"] = sev_any
-            df[f"lv_{wall}_clean_{name}"] = (1 - sev_any).astype(int)
-            wall_any_severe_cols[wall].append(f"{wall}_severe_{name}")
-
-    df["artifact_burden"] = df[ratio_cols].apply(lambda r: r.dropna().mean(), axis=1)
-    df["max_ratio"] = df[ratio_cols].max(axis=1, skipna=True)
-
-    for wall, cols in wall_any_severe_cols.items():
-        if cols:
-            any_severe = (df[cols].max(axis=1) >= 1).astype(int)
-            df[f"lv_{wall}_clean"] = (1 - any_severe).astype(int)
-        else:
-            df[f"lv_{wall}_clean"] = np.nan
-
-    df["lv_visibility_score"] = df[[
-        "lv_lateral_clean",
-        "lv_septal_clean",
-        "lv_anterior_clean",
-        "lv_inferior_clean",
-    ]].sum(axis=1, min_count=1)
+    df["artifact_burden"] = row_mean(df, ratio_cols)
+    df["max_ratio"] = row_max(df, ratio_cols)
+
+    wall_clean = ~severe.any(axis=1)
+    for w, wall in enumerate(WALLS):
+        df[f"lv_{wall}_clean"] = wall_clean[:, w].astype(int)
+    df["lv_visibility_score"] = row_sum(wall_clean.astype(np.int8))
 
     # cause of artefact (binaryization)
     cause_cols = [
@@ -221,14 +276,157 @@ def build_features(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def main() -> None:
-    df = pd.read_excel(SRC_XLSX, engine="openpyxl")
-    df = build_features(df)
+def build_features_streaming(
+    src: str = SRC_XLSX,
+    out_dir: str = OUT_DATASET,
+    out_csv: str = OUT_CSV,
+    out_segments: str = OUT_SEGMENTS,
+    chunksize: int = 2000,
+    out_parquet: str = OUT_PARQUET,
+) -> None:
+    # peak memory ~ one block of rows; rows are the same as the in-memory path.
+    # clean.parquet (what loader.load_clean reads) is assembled part by part so
+    # it always matches the segment tensor written alongside it
+    scan = scan_workbook(src)
+    tensor = open_segment_tensor(out_segments, scan["n_rows"])
+
+    def transform(chunk: pd.DataFrame) -> pd.DataFrame:
+        grades = segment_tensor(chunk)
+        tensor[chunk.index[0]:chunk.index[0] + len(chunk)] = grades
+        return apply_schema(build_features(chunk, grades=grades))
+
+    schema = write_dataset(iter_workbook_chunks(src, chunksize, scan), out_dir, transform=transform)
+    tensor.flush()
+    parts = sorted(f for f in os.listdir(out_dir) if f.startswith("part-"))
+    writer = pq.ParquetWriter(out_parquet, schema) if parts else None
     try:
-        df.to_parquet(OUT_PARQUET, index=False)
-    except Exception:
-        pass
-    df.to_csv(OUT_CSV, index=False)
+        for k, f in enumerate(parts):
+            table = pq.read_table(os.path.join(out_dir, f))
+            writer.write_table(table.select(schema.names))
+            chunk = table.to_pandas()
+            chunk.to_csv(out_csv, index=False, mode="w" if k == 0 else "a", header=k == 0)
+    finally:
+        if writer is not None:
+            writer.close()
+    if parts:
+        save_csv_dtypes(chunk.dtypes, out_csv)
+
+
+def _feature_code_version() -> str:
+    # any edit to the feature code invalidates cached rows
+    h = hashlib.sha256()
+    for fn in (build_features, segment_tensor, row_mean, to_bin):
+        with open(inspect.getsourcefile(fn), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _load_feature_cache(path: str, signature: dict):
+    if not os.path.exists(path):
+        return None
+    table = pq.read_table(path)
+    meta = json.loads((table.schema.metadata or {}).get(b"cied_feature_signature", b"{}"))
+    if meta != signature:
+        return None
+    cached = table.to_pandas()
+    # Arrow nulls come back as None in object columns; build_features leaves NaN
+    for c in cached.columns[cached.dtypes == object]:
+        cached[c] = cached[c].where(cached[c].notna(), np.nan)
+    return cached
+
+
+def _save_feature_cache(path: str, derived: pd.DataFrame, hashes: pd.Series, signature: dict) -> None:
+    table = pa.Table.from_pandas(derived.assign(_row_hash=hashes.to_numpy()), preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[b"cied_feature_signature"] = json.dumps(signature).encode()
+    pq.write_table(table.replace_schema_metadata(meta), path)
+
+
+def build_features_incremental(
+    df: pd.DataFrame,
+    cache_path: str = OUT_FEATURE_CACHE,
+    segments_path: str = OUT_SEGMENTS,
+    full: bool = False,
+) -> tuple:
+    # rows are matched on a fingerprint of their build_features inputs; only rows
+    # with an unseen fingerprint are recomputed, the rest reuse cached features
+    raw_cols = list(df.columns)
+    hashes = row_fingerprints(df, FEATURE_INPUTS)
+    signature = {"code": _feature_code_version(), "columns": column_signature(df, FEATURE_INPUTS)}
+    prev = None if full or not os.path.exists(segments_path) else _load_feature_cache(cache_path, signature)
+
+    if prev is None:
+        grades = segment_tensor(df)
+        out = build_features(df, grades=grades)
+        stats = {"added": len(out), "changed": 0, "unchanged": 0, "removed": 0, "recomputed": len(out), "full_rebuild": True}
+    else:
+        prev_hash = prev.pop("_row_hash").to_numpy()
+        prev_grades, _ = load_segment_tensor(segments_path, mmap=False)
+        first = ~pd.Index(prev_hash).duplicated()
+        pos = pd.Index(prev_hash[first]).get_indexer(hashes.to_numpy())
+        reuse = pos >= 0
+        src = np.flatnonzero(first)[pos[reuse]]
+
+        # counted on content, not position, so inserted or reordered rows are
+        # unchanged; an unseen row pairs with a vanished one as "changed"
+        # while both exist, the surplus is added (or removed)
+        fresh = int((~reuse).sum())
+        gone = int((~pd.Index(prev_hash).isin(hashes.to_numpy())).sum())
+        changed = min(fresh, gone)
+        stats = {
+            "added": fresh - changed,
+            "changed": changed,
+            "unchanged": int(reuse.sum()),
+            "removed": gone - changed,
+            "recomputed": fresh,
+            "full_rebuild": False,
+        }
+
+        delta_raw = df.loc[~reuse].copy()
+        delta_grades = segment_tensor(delta_raw)
+        delta = build_features(delta_raw, grades=delta_grades)[list(prev.columns)]
+        kept = prev.iloc[src].set_axis(df.index[reuse])
+        feats = pd.concat([kept, delta]).loc[df.index]
+        out = pd.concat([df, feats], axis=1)
+
+        grades = np.empty((len(df),) + prev_grades.shape[1:], dtype=prev_grades.dtype)
+        grades[reuse] = prev_grades[src]
+        grades[~reuse] = delta_grades
+
+    derived = out[[c for c in out.columns if c not in raw_cols]]
+    _save_feature_cache(cache_path, derived, hashes, signature)
+    return out, grades, stats
+
+
+def write_coercion_report() -> None:
+    # token map and coercion report, shared by the eager and streaming paths
+    save_token_cache(TOKEN_CACHE_PATH)
+    report = coercion_report()
+    report.to_csv(OUT_COERCION, index=False)
+    if len(report):
+        print(f"{report['n'].sum()} values in {report['column'].nunique()} columns were not a clean 0/1 (see {OUT_COERCION})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--force-reingest", action="store_true", help="re-parse the workbook instead of using the ingest cache")
+    parser.add_argument("--stream", action="store_true", help="build features block-wise into a partitioned Parquet dataset")
+    parser.add_argument("--chunksize", type=int, default=2000)
+    parser.add_argument("--incremental", action="store_true", help="recompute features only for new or changed rows")
+    args = parser.parse_args()
+    load_token_cache(TOKEN_CACHE_PATH)
+    if args.stream:
+        build_features_streaming(SRC_XLSX, OUT_DATASET, OUT_CSV, OUT_SEGMENTS, chunksize=args.chunksize, out_parquet=OUT_PARQUET)
+        write_coercion_report()
+        return
+    df = read_workbook(SRC_XLSX, force=args.force_reingest)
+    df, grades, stats = build_features_incremental(df, OUT_FEATURE_CACHE, OUT_SEGMENTS, full=not args.incremental)
+    df = apply_schema(df)
+    print("rows added={added} changed={changed} unchanged={unchanged} removed={removed} recomputed={recomputed}".format(**stats))
+    write_coercion_report()
+    save_segment_tensor(OUT_SEGMENTS, grades)
+    pq.write_table(arrow_frame(df), OUT_PARQUET)
+    save_csv(df, OUT_CSV)
 
 
 if __name__ == "__main__":
@@ -1,46 +1,19 @@
-import os
 import pandas as pd
 
+from loader import load_clean
+from schema import TABLE1_COLS
+
 # plan 3.1: descriptive tables by device groups (Table 1/2)
-IN_PARQUET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
-IN_CSV = "/workspace/clean.csv"
 OUT1 = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/table1_by_device.xlsx"
 OUT2 = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/table2_outcomes_by_device.xlsx"
 
-
-def load_clean() -> pd.DataFrame:
-    if os.path.exists(IN_PARQUET):
-        return pd.read_parquet(IN_PARQUET)
-    return pd.read_csv(IN_CSV)
+TABLE2_OUTCOMES = ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic", "Confirmed"]
 
 
 def make_table1(df: pd.DataFrame) -> pd.DataFrame:
     # minimal: descriptive stats by device_cat
-    cols = [
-        "age",
-        "sex_male",
-        "bmi",
-        "hf",
-        "htn",
-        "cad",
-        "mi",
-        "afib",
-        "ckd",
-        "mr_conditional",
-        "n_leads",
-        "left_vs_other",
-        "manufacturer_other",
-        "norm_dist_card_sil",
-        "norm_dist_LV_apex",
-        "rotation",
-        "has_TFE",
-        "has_CINE",
-        "has_VIAB",
-        "artifact_burden",
-        "lv_visibility_score",
-    ]
-    available = [c for c in cols if c in df.columns]
-    g = df.groupby("device_cat")[available]
+    available = [c for c in TABLE1_COLS if c in df.columns]
+    g = df.groupby("device_cat", observed=True)[available]
     desc = g.agg(["count", "mean", "std", "min", "max"])
     desc.columns = ["_".join([c for c in col if c]) for col in desc.columns.to_flat_index()]
     return desc.reset_index()
@@ -48,10 +21,9 @@ def make_table1(df: pd.DataFrame) -> pd.DataFrame:
 
 def make_table2(df: pd.DataFrame) -> pd.DataFrame:
     # outcomes incidence by device
-    outcomes = ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic", "Confirmed"]
-    outcomes = [c for c in outcomes if c in df.columns]
-    counts = df.groupby("device_cat")[outcomes].sum(min_count=1)
-    denoms = df.groupby("device_cat")[outcomes].count()
+    outcomes = [c for c in TABLE2_OUTCOMES if c in df.columns]
+    counts = df.groupby("device_cat", observed=True)[outcomes].sum(min_count=1)
+    denoms = df.groupby("device_cat", observed=True)[outcomes].count()
     rates = (counts / denoms * 100).round(1)
     out = pd.DataFrame(index=counts.index)
     for c in outcomes:
@@ -60,7 +32,7 @@ def make_table2(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def main() -> None:
-    df = load_clean()
+    df = load_clean(columns=["device_cat"] + TABLE1_COLS + TABLE2_OUTCOMES)
     t1 = make_table1(df)
     t2 = make_table2(df)
     with pd.ExcelWriter(OUT1, engine="openpyxl") as w:
@@ -1,20 +1,34 @@
+import argparse
 import os
 import itertools
+import time
+from functools import partial
 import pandas as pd
 import numpy as np
-import statsmodels.formula.api as smf
 import statsmodels.api as sm
 
+from counterfactual import Counterfactual
+from glm import MAXITER, logit_cov, result_diagnostics, separating_terms, separation_diagnostics, summary_table
+from grid import error_reason, run_grid
+from imputation import apply_delta, impute, pool_frames
+from loader import load_clean
+from margins import average_marginal_effects
+from model_cache import CACHE_DIR, glm_fit
+from modeling import ModelFrames
+from results import dose_rows, quarantine_row, summary_rows, write, write_diagnostics
+
 # plan 3.2: main effects models (logit/probit)
-IN_PARQUET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
-IN_CSV = "/workspace/clean.csv"
+# Each cell is its own statsmodels fit (model_cache.glm_fit), not a batched
+# glm.fit_logit_batch like 05/06: margins and Counterfactual need the
+# statsmodels result (formula, design info, predict). Covariance and fit
+# status still come from the shared glm helpers (logit_cov,
+# result_diagnostics), so 03 and 05/06 agree on both.
 OUT_DIR = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/"
-
-
-def load_clean() -> pd.DataFrame:
-    if os.path.exists(IN_PARQUET):
-        return pd.read_parquet(IN_PARQUET)
-    return pd.read_csv(IN_CSV)
+OUTCOMES = ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic"]
+METRICS = ["artifact_burden", "max_ratio"]
+DEVICES = ["PPM", "ICD", "CRT"]
+DOSE_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+DOSE_CURVE_POINTS = 101
 
 
 def build_formula(outcome: str, artifact_metric: str = "artifact_burden") -> str:
@@ -42,64 +56,172 @@ def build_formula(outcome: str, artifact_metric: str = "artifact_burden") -> str
     return f"{outcome} ~ {rhs}"
 
 
-def fit_glm(df: pd.DataFrame, formula: str):
-    # drop rows with any missing vars in formula
-    model_df = df.copy()
-    # naive parse of variables used in formula
-    tokens = (
-        formula.replace("~", "+")
-        .replace("*", "+")
-        .replace(":", "+")
-        .replace("C(", "C_")
-        .replace(")", "")
-        .replace(" ", "")
-        .split("+")
-    )
-    vars_used = [t for t in tokens if t and t != "1" and not t.startswith("C_")]
-    model_df = model_df.dropna(subset=vars_used)
-    model = smf.glm(formula=formula, data=model_df, family=sm.families.Binomial())
-    res = model.fit(cov_type="HC3")
-    return res, model_df
-
-
-def run_main_models(df: pd.DataFrame) -> None:
-    outcomes = ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic"]
-    for y in outcomes:
-        for metric in ["artifact_burden", "max_ratio"]:
-            formula = build_formula(y, artifact_metric=metric)
-            try:
-                res, used = fit_glm(df, formula)
-            except Exception as e:
-                print(f"Model failed for {y} with {metric}: {e}")
-                continue
-            coefs = res.summary2().tables[1]
-            coefs.to_csv(os.path.join(OUT_DIR, f"model_{y}_{metric}_coefs.csv"))
-            # marginal effects (robust)
-            try:
-                me = res.get_margeff(at="overall").summary_frame()
-                me.to_csv(os.path.join(OUT_DIR, f"model_{y}_{metric}_margins.csv"))
-            except Exception as e:
-                print(f"Margins failed for {y} with {metric}: {e}")
-            # device x artifact marginal effects grid for plotting
-            try:
-                q = used[metric].quantile([0.1, 0.25, 0.5, 0.75, 0.9]).rename("q").reset_index()
-                grid = []
-                for dev in ["PPM", "ICD", "CRT"]:
-                    for _, row in q.iterrows():
-                        val = float(row[metric])
-                        pred_df = used.copy()
-                        pred_df[metric] = val
-                        pred_df["device_cat"] = dev
-                        p = res.predict(pred_df).mean()
-                        grid.append({"device_cat": dev, "metric": metric, "q": row["index"], "value": val, "mean_prob": p, "outcome": y})
-                pd.DataFrame(grid).to_csv(os.path.join(OUT_DIR, f"model_{y}_{metric}_dose_response.csv"), index=False)
-            except Exception as e:
-                print(f"Dose-response grid failed for {y} with {metric}: {e}")
+def dose_grid(metric: str, values: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame({"device_cat": np.repeat(DEVICES, len(values)), metric: np.tile(values, len(DEVICES))})
+
+
+def fit_glm(df: pd.DataFrame, formula: str, frames: ModelFrames = None, cache_dir: str = None, maxiter: int = MAXITER):
+    # complete cases over the formula's variables only; a specification that
+    # separating_terms flags is not fitted (res is None) -> (res, frame, separating)
+    model_df = (frames or ModelFrames(df)).get(formula)
+    separating = separating_terms(formula, model_df)
+    if separating:
+        return None, model_df, separating
+    res = glm_fit(formula, model_df, sm.families.Binomial(), cov_type="HC3", cache_dir=cache_dir, maxiter=maxiter)
+    return res, model_df, separating
+
+
+def fit_cell(df: pd.DataFrame, cell: tuple, cache_dir: str = None, maxiter: int = MAXITER) -> dict:
+    # one grid cell: coefficients, margins and the dose-response grid; a fit
+    # whose diagnostics are not "ok" returns only its diagnostics
+    y, metric = cell
+    t0 = time.time()
+    formula = build_formula(y, artifact_metric=metric)
+    res, used, separating = fit_glm(df, formula, cache_dir=cache_dir, maxiter=maxiter)
+    if res is None:
+        diag = separation_diagnostics(separating, time.time() - t0)
+    else:
+        diag = result_diagnostics(res, time.time() - t0, separating)
+    if diag["status"] != "ok":
+        return {"diagnostics": diag, "notes": []}
+    # coefficients, margins and dose-response bands all use glm.logit_cov HC3
+    cov = logit_cov(res, "HC3")
+    out = {"diagnostics": diag, "coefs": summary_table(res.params, cov), "notes": []}
+    # average marginal effects (robust), per variable through the interactions
+    try:
+        out["margins"] = average_marginal_effects(res, used, cov=cov)
+    except Exception as e:
+        out["notes"].append(f"Margins failed for {y} with {metric}: {e}")
+    # device x artifact marginal effects grid for plotting
+    try:
+        cf = Counterfactual(res, used, ["device_cat", metric], cov=cov)
+        q = used[metric].quantile(DOSE_QUANTILES)
+        grid = cf.mean_predictions(dose_grid(metric, q.to_numpy()))
+        grid.insert(1, "q", np.tile(q.index.to_numpy(), len(DEVICES)))
+        out["dose_response"] = grid.rename(columns={metric: "value"}).assign(metric=metric, outcome=y)
+        lo, hi = used[metric].quantile([0.01, 0.99])
+        curve = cf.mean_predictions(dose_grid(metric, np.linspace(lo, hi, DOSE_CURVE_POINTS)))
+        out["dose_curve"] = curve.rename(columns={metric: "value"}).assign(metric=metric, outcome=y)
+    except Exception as e:
+        out["notes"].append(f"Dose-response grid failed for {y} with {metric}: {e}")
+    return out
+
+
+def run_main_models(df: pd.DataFrame, workers: int = None, cache_dir: str = None, csv: bool = False, maxiter: int = MAXITER, fit_seconds: float = None) -> None:
+    # fit_seconds: wall-clock budget per grid cell; failed, separated,
+    # unconverged and over-budget cells go to the quarantine and the rest of
+    # the grid is written as usual
+    cells = list(itertools.product(OUTCOMES, METRICS))
+    rows, diags = [], []
+    fn = partial(fit_cell, cache_dir=cache_dir, maxiter=maxiter)
+    for (y, metric), out, err in run_grid(df, cells, fn, workers=workers, timeout=fit_seconds):
+        keys = {"variant": "main", "outcome": y, "metric": metric}
+        if err is not None:
+            status, detail = error_reason(err)
+            print(f"Model quarantined for {y} with {metric} ({status}): {detail}")
+            diags.append(quarantine_row(status, detail, **keys))
+            continue
+        diags.append(pd.DataFrame([out["diagnostics"]]).assign(**keys))
+        if "coefs" not in out:
+            print(f"Model quarantined for {y} with {metric} ({out['diagnostics']['status']}): {out['diagnostics']['detail']}")
+            continue
+        for note in out["notes"]:
+            print(note)
+        rows.append(summary_rows(out["coefs"], "coef", **keys))
+        if "margins" in out:
+            rows.append(summary_rows(out["margins"], "margin", **keys))
+        for kind in ("dose_response", "dose_curve"):
+            if kind in out:
+                rows.append(dose_rows(out[kind], kind, **keys))
+        if csv:
+            # optional per-model CSV view of the same results
+            out["coefs"].to_csv(os.path.join(OUT_DIR, f"model_{y}_{metric}_coefs.csv"))
+            for kind in ("margins", "dose_response", "dose_curve"):
+                if kind in out:
+                    out[kind].to_csv(os.path.join(OUT_DIR, f"model_{y}_{metric}_{kind}.csv"), index=kind == "margins")
+    if rows:
+        write(rows, "03_models_main")
+    write_diagnostics(diags, "03_models_main")
+
+
+def fit_imputed_cell(df: pd.DataFrame, cell: tuple, cache_dir: str = None, maxiter: int = MAXITER) -> dict:
+    # cell = (outcome, metric, imputation index, imputation delta)
+    y, metric, _, delta = cell
+    return fit_cell(apply_delta(df, delta), (y, metric), cache_dir=cache_dir, maxiter=maxiter)
+
+
+def pool_dose(frames: list) -> pd.DataFrame:
+    # Rubin-pooled dose-response grid; grid values are averaged because the
+    # metric's quantiles move with the imputed cells
+    pooled = pool_frames(frames, "mean_prob", "se")
+    first = frames[0]
+    out = first[[c for c in ("device_cat", "q") if c in first.columns]].copy()
+    out["value"] = np.mean([f["value"].to_numpy() for f in frames], axis=0)
+    out["mean_prob"], out["se"], out["lower"], out["upper"] = pooled["estimate"], pooled["se"], pooled["ci_low"], pooled["ci_high"]
+    return out.assign(metric=first["metric"].iloc[0], outcome=first["outcome"].iloc[0])
+
+
+def run_imputed_models(df: pd.DataFrame, m: int, seed: int = 0, workers: int = None, cache_dir: str = None, csv: bool = False, maxiter: int = MAXITER, fit_seconds: float = None) -> None:
+    # every grid cell fitted on each of m imputed datasets, pooled by Rubin's
+    # rules over the imputations whose fit is "ok"
+    imps = impute(df, m, seed=seed, workers=workers)
+    print(imps.summary().to_string(index=False))
+    cells = [(y, metric, i, imps.delta(i)) for y, metric in itertools.product(OUTCOMES, METRICS) for i in range(m)]
+    fits, diags = {}, []
+    fn = partial(fit_imputed_cell, cache_dir=cache_dir, maxiter=maxiter)
+    for (y, metric, i, _), out, err in run_grid(df, cells, fn, workers=workers, timeout=fit_seconds):
+        keys = {"variant": f"mi:{i}", "outcome": y, "metric": metric}
+        if err is not None:
+            status, detail = error_reason(err)
+            print(f"Model quarantined for {y} with {metric} (imputation {i}, {status}): {detail}")
+            diags.append(quarantine_row(status, detail, **keys))
+            continue
+        diags.append(pd.DataFrame([out["diagnostics"]]).assign(**keys))
+        if "coefs" not in out:
+            print(f"Model quarantined for {y} with {metric} (imputation {i}, {out['diagnostics']['status']}): {out['diagnostics']['detail']}")
+            continue
+        for note in out["notes"]:
+            print(f"{note} (imputation {i})")
+        fits.setdefault((y, metric), []).append(out)
+    rows = []
+    for (y, metric), outs in fits.items():
+        keys = {"variant": "mi", "outcome": y, "metric": metric}
+        pooled = {"coefs": pool_frames([o["coefs"] for o in outs], "Coef.", "Std.Err.")}
+        margins = [o["margins"] for o in outs if "margins" in o]
+        if margins:
+            pooled["margins"] = pool_frames(margins, "dy/dx", "Std. Err.")
+        rows.append(summary_rows(pooled["coefs"], "coef", **keys))
+        if "margins" in pooled:
+            rows.append(summary_rows(pooled["margins"], "margin", **keys))
+        for kind in ("dose_response", "dose_curve"):
+            frames = [o[kind] for o in outs if kind in o]
+            if frames:
+                pooled[kind] = pool_dose(frames)
+                rows.append(dose_rows(pooled[kind], kind, **keys))
+        if csv:
+            for kind, table in pooled.items():
+                table.to_csv(os.path.join(OUT_DIR, f"model_{y}_{metric}_{kind}_mi.csv"), index=kind in ("coefs", "margins"))
+    if rows:
+        write(rows, "03_models_main", replace=False)
+    write_diagnostics(diags, "03_models_main", replace=False)
 
 
 def main() -> None:
-    df = load_clean()
-    run_main_models(df)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=None, help="grid worker processes (default: one per cell, up to the CPU count)")
+    ap.add_argument("--no-cache", action="store_true", help="refit every model instead of reusing cached fits")
+    ap.add_argument("--csv", action="store_true", help="also write the per-model CSVs to OUT_DIR")
+    ap.add_argument("--impute", type=int, default=0, help="also fit on M multiply-imputed datasets and pool (0 = complete cases only)")
+    ap.add_argument("--seed", type=int, default=20240501)
+    ap.add_argument("--maxiter", type=int, default=MAXITER, help="IRLS iteration budget per fit")
+    ap.add_argument("--fit-seconds", type=float, default=None, help="wall-clock budget per fit; cells over it are quarantined")
+    args = ap.parse_args()
+    df = load_clean(formula=[build_formula(y, m) for y in OUTCOMES for m in METRICS])
+    cache_dir = None if args.no_cache else CACHE_DIR
+    budget = {"maxiter": args.maxiter, "fit_seconds": args.fit_seconds}
+    run_main_models(df, workers=args.workers, cache_dir=cache_dir, csv=args.csv, **budget)
+    if args.impute > 0:
+        run_imputed_models(df, args.impute, seed=args.seed, workers=args.workers, cache_dir=cache_dir, csv=args.csv, **budget)
 
 
 if __name__ == "__main__":
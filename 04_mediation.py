@@ -1,59 +1,137 @@
-import os
+import argparse
+import time
+
 import pandas as pd
 import numpy as np
 import statsmodels.formula.api as smf
 import statsmodels.api as sm
 
+from glm import logit_cov
+from imputation import impute, rubin
+from loader import load_clean
+from mediation import ALL_CONTRASTS, CONTRASTS, QUANTITIES, bootstrap, design, effects_frame, simulate, simulation_frame
+from model_cache import CACHE_DIR, glm_fit
+from results import write
+
 # plan 3.3: simple mediation (device -> artifact_burden -> dx_change)
-IN_PARQUET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
-IN_CSV = "/workspace/clean.csv"
 OUT = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/mediation_results.csv"
+OUT_BOOT = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/mediation_bootstrap.csv"
+OUT_SIM = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/mediation_simulation.csv"
+OUT_MI = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/mediation_mi.csv"
+MEDIATORS = ["artifact_burden", "max_ratio", "lv_visibility_score"]
+MI_SIMS = 1000
+
+
+def mediator_formula(mediator: str) -> str:
+    return f"{mediator} ~ C(device_cat) + left_vs_other + norm_dist_card_sil + norm_dist_LV_apex + n_leads + mr_conditional + age + sex_male + hf + htn + cad + mi + afib + ckd"
+
+
+def outcome_formula(outcome: str, mediator: str) -> str:
+    return f"{outcome} ~ C(device_cat) + {mediator} + age + sex_male + hf + htn + cad + mi + afib + ckd + C(pre_dx_cat)"
+
+
+def mediation_spec(mediator: str, outcome: str, contrasts: list = CONTRASTS) -> dict:
+    return {"mediator": mediator, "outcome": outcome, "m_formula": mediator_formula(mediator), "y_formula": outcome_formula(outcome, mediator), "contrasts": contrasts}
+
+
+def fit_mediation(df: pd.DataFrame, mediator: str, outcome: str, contrasts: list = CONTRASTS, cache_dir: str = None) -> tuple:
+    # mediator OLS and outcome logit, both HC3 (statsmodels' own HC3 for the
+    # OLS; glm.logit_cov for the logit)
+    # -> (design, Bm, cov_m, By, cov_y), coefficients ordered like the design columns
+    spec = mediation_spec(mediator, outcome, contrasts)
+    fit_df = df.dropna(subset=[mediator, outcome])
+    m_res = smf.ols(spec["m_formula"], data=fit_df).fit(cov_type="HC3")
+    y_res = glm_fit(spec["y_formula"], fit_df, sm.families.Binomial(), cov_type="HC3", cache_dir=cache_dir)
+    d = design(df, spec)
+    out = [d]
+    y_cov = pd.DataFrame(logit_cov(y_res, "HC3"), index=y_res.params.index, columns=y_res.params.index)
+    for res, cov, names in ((m_res, m_res.cov_params(), d.m_names), (y_res, y_cov, d.y_names)):
+        params, cov = res.params.reindex(names), cov.reindex(index=names, columns=names)
+        if params.isna().any():
+            raise ValueError("fitted terms do not match the mediation design columns")
+        out += [params.to_numpy(), cov.to_numpy()]
+    return tuple(out)
 
 
-def load_clean() -> pd.DataFrame:
-    if os.path.exists(IN_PARQUET):
-        return pd.read_parquet(IN_PARQUET)
-    return pd.read_csv(IN_CSV)
-
-
-def mediation_acme_ade(df: pd.DataFrame, mediator: str = "artifact_burden", outcome: str = "dx_change") -> pd.DataFrame:
-    # mediator model
-    m_formula = f"{mediator} ~ C(device_cat) + left_vs_other + norm_dist_card_sil + norm_dist_LV_apex + n_leads + mr_conditional + age + sex_male + hf + htn + cad + mi + afib + ckd"
-    m_res = smf.ols(m_formula, data=df.dropna(subset=[mediator, outcome])).fit(cov_type="HC3")
-
-    # outcome model
-    y_formula = f"{outcome} ~ C(device_cat) + {mediator} + age + sex_male + hf + htn + cad + mi + afib + ckd + C(pre_dx_cat)"
-    y_model = smf.glm(y_formula, data=df.dropna(subset=[mediator, outcome]), family=sm.families.Binomial())
-    y_res = y_model.fit(cov_type="HC3")
-
-    # compute ACME/ADE via parametric g-formula at contrasting devices (ICD vs PPM, CRT vs PPM)
-    results = []
-    for comp in [("ICD", "PPM"), ("CRT", "PPM")]:
-        a1, a0 = comp
-        df_a0 = df.copy()
-        df_a1 = df.copy()
-        df_a0["device_cat"] = a0
-        df_a1["device_cat"] = a1
-        # predicted mediator
-        m_a0 = m_res.predict(df_a0)
-        m_a1 = m_res.predict(df_a1)
-        # natural indirect: E[Y(a1, M(a1)) - Y(a1, M(a0))]
-        y_a1_m_a1 = y_res.predict(df_a1.assign(**{mediator: m_a1}))
-        y_a1_m_a0 = y_res.predict(df_a1.assign(**{mediator: m_a0}))
-        acme = float((y_a1_m_a1 - y_a1_m_a0).mean())
-        # natural direct: E[Y(a1, M(a0)) - Y(a0, M(a0))]
-        y_a0_m_a0 = y_res.predict(df_a0.assign(**{mediator: m_a0}))
-        ade = float((y_a1_m_a0 - y_a0_m_a0).mean())
-        total = float((y_a1_m_a1 - y_a0_m_a0).mean())
-        prop = acme / total if total != 0 else np.nan
-        results.append({"contrast": f"{a1} vs {a0}", "ACME": acme, "ADE": ade, "Total": total, "PropMediated": prop})
-    return pd.DataFrame(results)
+def mediation_acme_ade(df: pd.DataFrame, mediator: str = "artifact_burden", outcome: str = "dx_change", cache_dir: str = None) -> pd.DataFrame:
+    # ACME/ADE via parametric g-formula at contrasting devices (ICD vs PPM, CRT vs PPM):
+    #   ACME = E[Y(a1, M(a1)) - Y(a1, M(a0))], ADE = E[Y(a1, M(a0)) - Y(a0, M(a0))]
+    # counterfactual predictions come from the cached design matrices
+    d, Bm, _, By, _ = fit_mediation(df, mediator, outcome, cache_dir=cache_dir)
+    theta = d.effects(Bm[:, None], By[:, None], np.ones((d.n, 1)))[..., 0]
+    return effects_frame(d, theta)
+
+
+def simulate_mediation(df: pd.DataFrame, mediator: str, outcome: str, n_sims: int, seed: int = 0, cache_dir: str = None) -> pd.DataFrame:
+    # quasi-Bayesian intervals for every device contrast from coefficient
+    # draws around the HC3 fits; no refitting
+    d, Bm, cov_m, By, cov_y = fit_mediation(df, mediator, outcome, ALL_CONTRASTS, cache_dir)
+    theta = d.effects(Bm[:, None], By[:, None], np.ones((d.n, 1)))[..., 0]
+    sims = simulate(d, Bm, cov_m, By, cov_y, n_sims, seed=seed)
+    return simulation_frame(d, theta, sims).assign(mediator=mediator)
+
+
+def imputed_mediation(df: pd.DataFrame, mediator: str, outcome: str, m: int, n_sims: int = MI_SIMS, seed: int = 0, workers: int = None, cache_dir: str = None) -> pd.DataFrame:
+    # point estimates per imputed dataset, pooled by Rubin's rules with the
+    # within-imputation variance taken from quasi-Bayesian draws
+    imps = impute(df, m, seed=seed, workers=workers)
+    est, var = [], []
+    for i in range(m):
+        d, Bm, cov_m, By, cov_y = fit_mediation(imps.complete(i), mediator, outcome, cache_dir=cache_dir)
+        est.append(d.effects(Bm[:, None], By[:, None], np.ones((d.n, 1)))[..., 0])
+        var.append(np.nanvar(simulate(d, Bm, cov_m, By, cov_y, n_sims, seed=seed + i), axis=-1, ddof=1))
+    pooled = rubin(np.array(est), np.array(var))
+    rows = []
+    for i, (a1, a0) in enumerate(d.contrasts):
+        for j, q in enumerate(QUANTITIES):
+            rows.append({"contrast": f"{a1} vs {a0}", "quantity": q, **{k: v[i, j] for k, v in pooled.items()}, "m": m})
+    return pd.DataFrame(rows)
 
 
 def main() -> None:
-    df = load_clean()
-    out = mediation_acme_ade(df, mediator="artifact_burden", outcome="dx_change")
+    ap = argparse.ArgumentParser(description="g-formula mediation of device effects through artifact burden")
+    ap.add_argument("--bootstrap", type=int, default=0, help="number of bootstrap replicates (0 = point estimates only)")
+    ap.add_argument("--simulate", type=int, default=0, help="number of quasi-Bayesian coefficient draws per mediator (0 = off)")
+    ap.add_argument("--mediators", nargs="+", default=MEDIATORS, help="mediators for the simulation mode")
+    ap.add_argument("--impute", type=int, default=0, help="also estimate on M multiply-imputed datasets and pool (0 = off)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=20240501)
+    ap.add_argument("--no-cache", action="store_true")
+    args = ap.parse_args()
+
+    mediator, outcome = "artifact_burden", "dx_change"
+    mediators = list(dict.fromkeys([mediator] + (args.mediators if args.simulate > 0 else [])))
+    df = load_clean(formula=[mediator_formula(m) for m in mediators] + [outcome_formula(outcome, m) for m in mediators])
+    cache_dir = None if args.no_cache else CACHE_DIR
+    out = mediation_acme_ade(df, mediator=mediator, outcome=outcome, cache_dir=cache_dir)
     out.to_csv(OUT, index=False)
+    rows = [out.melt(id_vars="contrast", var_name="term", value_name="estimate").assign(variant="g_formula")]
+
+    if args.bootstrap > 0:
+        t0 = time.time()
+        boot = bootstrap(df, mediation_spec(mediator, outcome), args.bootstrap, seed=args.seed, workers=args.workers)
+        print(f"{args.bootstrap} bootstrap replicates in {time.time() - t0:.1f}s")
+        boot.to_csv(OUT_BOOT, index=False)
+        base = boot.rename(columns={"quantity": "term"})[["contrast", "term", "estimate", "se"]]
+        rows.append(base.assign(ci_low=boot["pct_low"], ci_high=boot["pct_high"], variant="bootstrap_percentile"))
+        rows.append(base.assign(ci_low=boot["bca_low"], ci_high=boot["bca_high"], variant="bootstrap_bca"))
+
+    if args.impute > 0:
+        mi = imputed_mediation(df, mediator, outcome, args.impute, seed=args.seed, workers=args.workers, cache_dir=cache_dir)
+        mi.to_csv(OUT_MI, index=False)
+        rows.append(mi.rename(columns={"quantity": "term"})[["contrast", "term", "estimate", "se", "p", "ci_low", "ci_high"]].assign(variant="mi_rubin"))
+
+    rows = [r.assign(metric=mediator) for r in rows]
+
+    if args.simulate > 0:
+        t0 = time.time()
+        sim = pd.concat([simulate_mediation(df, m, outcome, args.simulate, seed=args.seed, cache_dir=cache_dir) for m in args.mediators], ignore_index=True)
+        print(f"{args.simulate} simulation draws x {len(args.mediators)} mediators in {time.time() - t0:.1f}s")
+        sim.to_csv(OUT_SIM, index=False)
+        sim = sim.rename(columns={"quantity": "term", "mediator": "metric"})
+        rows.append(sim[["metric", "contrast", "term", "estimate", "se", "ci_low", "ci_high"]].assign(variant="quasi_bayes"))
+
+    write([r.assign(kind="mediation", outcome=outcome) for r in rows], "04_mediation")
 
 
 if __name__ == "__main__":
@@ -1,43 +1,139 @@
-import os
+import argparse
+from functools import partial
+
 import pandas as pd
-import statsmodels.formula.api as smf
-import statsmodels.api as sm
+
+from glm import MAXITER, fit_logit_batch
+from grid import error_reason, run_grid
+from imputation import apply_delta, impute, pool_frames
+from loader import load_clean
+from model_cache import CACHE_DIR
+from permutation import permutation_test
+from results import quarantine_row, write, write_diagnostics
 
 # plan 3.4: heterogeneity (stratified by device)
-IN_PARQUET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
-IN_CSV = "/workspace/clean.csv"
 OUT = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/heterogeneity_models.csv"
+OUT_ITER = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/heterogeneity_iterations.csv"
+OUT_MI = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/heterogeneity_models_mi.csv"
+OUT_PERM = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/heterogeneity_permutation.csv"
+OUTCOMES = ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic"]
+# strata with fewer rows are quarantined as "too_small" without a fit
+MIN_ROWS = 20
+RHS = "artifact_burden + max_ratio + lv_visibility_score + age + sex_male + hf + htn + cad + mi + afib + ckd + C(pre_dx_cat) + has_TFE + has_CINE + has_VIAB"
 
 
-def load_clean() -> pd.DataFrame:
-    if os.path.exists(IN_PARQUET):
-        return pd.read_parquet(IN_PARQUET)
-    return pd.read_csv(IN_CSV)
+def build_formula(outcome: str) -> str:
+    return f"{outcome} ~ {RHS}"
 
 
-def stratified_models(df: pd.DataFrame) -> pd.DataFrame:
-    rows = []
+def stratified_models(df: pd.DataFrame, cache_dir: str = None, maxiter: int = MAXITER, fit_seconds: float = None) -> tuple:
+    # strata are warm-started from the pooled fit of the same specification;
+    # returns (coefficient rows, diagnostics: IRLS log plus quarantined fits).
+    # Only outcomes whose fit status is "ok" contribute coefficient rows.
+    rows, iters = [], []
+    budget = {"maxiter": maxiter, "time_budget": fit_seconds}
+    try:
+        pooled = fit_logit_batch(df, OUTCOMES, RHS, cache_dir=cache_dir, **budget)
+        iters.append(pooled.iterations().assign(device_cat="pooled"))
+    except Exception as e:
+        pooled = None
+        iters += [quarantine_row("error", str(e), outcome=outcome, device_cat="pooled") for outcome in OUTCOMES]
     for dev in ["PPM", "ICD", "CRT"]:
-        sdf = df[df["device_cat"] == dev].copy()
-        if len(sdf) < 20:
+        sdf = df[df["device_cat"] == dev]
+        if len(sdf) < MIN_ROWS:
+            iters += [quarantine_row("too_small", f"{len(sdf)} rows", outcome=outcome, device_cat=dev) for outcome in OUTCOMES]
+            continue
+        # the four outcomes share one design matrix and one batched IRLS fit
+        try:
+            fit = fit_logit_batch(sdf, OUTCOMES, RHS, parent=pooled, cache_dir=cache_dir, **budget)
+        except Exception as e:
+            iters += [quarantine_row("error", str(e), outcome=outcome, device_cat=dev) for outcome in OUTCOMES]
+            continue
+        iters.append(fit.iterations().assign(device_cat=dev))
+        for outcome in fit.ok():
+            for idx, r in fit.summary(outcome).iterrows():
+                rows.append({"device_cat": dev, "outcome": outcome, "term": idx, "coef": r["Coef."], "se": r["Std.Err."], "p": r["P>|z|"]})
+    return pd.DataFrame(rows, columns=["device_cat", "outcome", "term", "coef", "se", "p"]), pd.concat(iters, ignore_index=True)
+
+
+def stratified_imputed_cell(df: pd.DataFrame, cell: tuple, cache_dir: str = None, **budget) -> tuple:
+    # cell = (imputation index, imputation delta)
+    _, delta = cell
+    return stratified_models(apply_delta(df, delta), cache_dir=cache_dir, **budget)
+
+
+def imputed_stratified_models(df: pd.DataFrame, m: int, seed: int = 0, workers: int = None, cache_dir: str = None, **budget) -> tuple:
+    # stratified fits on each of m imputed datasets (one grid cell each),
+    # pooled by Rubin's rules. A term quarantined in any imputation is not
+    # pooled: Rubin's rules need all m. -> (pooled rows, per-imputation diagnostics)
+    imps = impute(df, m, seed=seed, workers=workers)
+    key = ["device_cat", "outcome", "term"]
+    fits, diags = [], []
+    fn = partial(stratified_imputed_cell, cache_dir=cache_dir, **budget)
+    for (i, _), out, err in run_grid(df, [(i, imps.delta(i)) for i in range(m)], fn, workers=workers):
+        variant = f"stratified_mi:{i}"
+        if err is not None:
+            status, detail = error_reason(err)
+            diags += [quarantine_row(status, detail, variant=variant, outcome=outcome) for outcome in OUTCOMES]
             continue
-        for outcome in ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic"]:
-            formula = f"{outcome} ~ artifact_burden + max_ratio + lv_visibility_score + age + sex_male + hf + htn + cad + mi + afib + ckd + C(pre_dx_cat) + has_TFE + has_CINE + has_VIAB"
-            try:
-                res = smf.glm(formula, data=sdf.dropna(), family=sm.families.Binomial()).fit(cov_type="HC3")
-                for idx, r in res.summary2().tables[1].iterrows():
-                    rows.append({"device_cat": dev, "outcome": outcome, "term": idx, "coef": r["Coef."], "se": r["Std.Err."], "p": r["P>|z|"]})
-            except Exception as e:
-                rows.append({"device_cat": dev, "outcome": outcome, "term": "ERROR", "coef": None, "se": None, "p": None})
-    return pd.DataFrame(rows)
+        rows, diag = out
+        fits.append(rows.set_index(key))
+        diags.append(diag.assign(variant=variant))
+    if not fits:
+        print(f"All {m} imputed stratified fits failed; nothing to pool")
+        return pd.DataFrame(columns=key + ["coef", "se", "p"]), pd.concat(diags, ignore_index=True)
+    counts = pd.concat([f.index.to_frame(index=False) for f in fits]).value_counts(sort=False)
+    dropped = counts[counts < m]
+    if len(dropped):
+        print(f"Not pooled (fitted in fewer than {m} imputations):\n{dropped.rename('fits').reset_index().to_string(index=False)}")
+    pooled = pool_frames([f.reindex(counts.index[counts == m]) for f in fits], "coef", "se")
+    return pooled.rename(columns={"estimate": "coef"}).reset_index(), pd.concat(diags, ignore_index=True)
+
+
+def device_permutation(df: pd.DataFrame, n_perm: int, seed: int = 0, workers: int = None) -> pd.DataFrame:
+    # randomization p-values for ICD/CRT vs PPM on every outcome, labels
+    # permuted within pre_dx_cat; does not rely on per-stratum HC3 asymptotics
+    spec = {"outcomes": OUTCOMES, "rhs": RHS, "label_col": "device_cat", "strata_col": "pre_dx_cat", "reference": "PPM"}
+    return permutation_test(df, spec, n_perm, seed=seed, workers=workers)
 
 
 def main() -> None:
-    df = load_clean()
-    out = stratified_models(df)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--permutations", type=int, default=0, help="device-label permutations (0 = off)")
+    ap.add_argument("--impute", type=int, default=0, help="also fit on M multiply-imputed datasets and pool (0 = off)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=20240501)
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--maxiter", type=int, default=MAXITER, help="IRLS iteration budget per fit")
+    ap.add_argument("--fit-seconds", type=float, default=None, help="IRLS wall-clock budget per batched fit")
+    args = ap.parse_args()
+
+    df = load_clean(columns=["device_cat"], formula=[build_formula(y) for y in OUTCOMES])
+    cache_dir = None if args.no_cache else CACHE_DIR
+    budget = {"maxiter": args.maxiter, "fit_seconds": args.fit_seconds}
+    out, iters = stratified_models(df, cache_dir=cache_dir, **budget)
     out.to_csv(OUT, index=False)
+    rows = [out.rename(columns={"coef": "estimate"}).assign(kind="coef", variant="stratified")]
+    iters.to_csv(OUT_ITER, index=False)
+    diags = [iters.assign(variant="stratified")]
+    failed = iters[iters["status"] != "ok"]
+    if len(failed):
+        print(f"Quarantined fits:\n{failed[['device_cat', 'outcome', 'status', 'detail']].to_string(index=False)}")
+
+    if args.impute > 0:
+        mi, mi_diags = imputed_stratified_models(df, args.impute, seed=args.seed, workers=args.workers, cache_dir=cache_dir, **budget)
+        mi.to_csv(OUT_MI, index=False)
+        rows.append(mi.rename(columns={"coef": "estimate"}).assign(kind="coef", variant="stratified_mi"))
+        diags.append(mi_diags)
+
+    if args.permutations > 0:
+        perm = device_permutation(df, args.permutations, seed=args.seed, workers=args.workers)
+        perm.to_csv(OUT_PERM, index=False)
+        perm = perm.rename(columns={"statistic": "estimate", "p_perm": "p"})
+        rows.append(perm[["outcome", "contrast", "estimate", "p"]].assign(kind="permutation", variant="score_within_pre_dx", term="device_cat"))
+    write(rows, "05_heterogeneity")
+    write_diagnostics(diags, "05_heterogeneity")
 
 
 if __name__ == "__main__":
     main()
-
@@ -1,47 +1,104 @@
+import argparse
 import os
+import time
+from functools import partial
 import pandas as pd
-import statsmodels.formula.api as smf
 import statsmodels.api as sm
 
+from glm import MAXITER, BatchLogit, fit_logit_batch, logit_cov, result_diagnostics, separating_terms, separation_diagnostics, summary_table
+from grid import error_reason, run_grid
+from loader import load_clean
+from model_cache import CACHE_DIR, glm_fit
+from modeling import model_frame
+from results import quarantine_row, summary_rows, write, write_diagnostics
+
 # plan 3.5 and 4: sensitivity analyses
-IN_PARQUET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
-IN_CSV = "/workspace/clean.csv"
 OUT_DIR = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/"
+OUTCOMES = ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic"]
+METRICS = ["max_ratio", "severe_art_TFE", "severe_art_CINE", "severe_art_VIAB"]
+PARENT_METRIC = "artifact_burden"
+FORMULA_CC = "dx_change ~ C(device_cat) + mr_conditional + artifact_burden + age + sex_male"
+
 
+def build_formula(outcome: str, metric: str) -> str:
+    return f"{outcome} ~ C(device_cat) + mr_conditional + {metric} + lv_visibility_score + age + sex_male + hf + htn + cad + mi + afib + ckd + C(pre_dx_cat) + has_TFE + has_CINE + has_VIAB + C(device_cat):{metric} + C(device_cat):mr_conditional"
 
-def load_clean() -> pd.DataFrame:
-    if os.path.exists(IN_PARQUET):
-        return pd.read_parquet(IN_PARQUET)
-    return pd.read_csv(IN_CSV)
 
+def fit_cell(df: pd.DataFrame, metric: str, parent: BatchLogit = None, cache_dir: str = None, maxiter: int = MAXITER, fit_seconds: float = None) -> dict:
+    # all outcomes for one metric share a design matrix: one batched fit,
+    # warm-started from the main specification; tables only for "ok" outcomes
+    fit = fit_logit_batch(df, OUTCOMES, build_formula(OUTCOMES[0], metric), parent=parent, cache_dir=cache_dir, maxiter=maxiter, time_budget=fit_seconds)
+    return {"tables": {y: fit.summary(y) for y in fit.ok()}, "iterations": fit.iterations()}
 
-def run_sensitivity(df: pd.DataFrame) -> None:
-    # alt artifact metrics
-    outcomes = ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic"]
-    metrics = ["max_ratio", "severe_art_TFE", "severe_art_CINE", "severe_art_VIAB"]
-    for y in outcomes:
-        for m in metrics:
-            if m not in df.columns:
-                continue
-            formula = f"{y} ~ C(device_cat) + mr_conditional + {m} + lv_visibility_score + age + sex_male + hf + htn + cad + mi + afib + ckd + C(pre_dx_cat) + has_TFE + has_CINE + has_VIAB + C(device_cat):{m} + C(device_cat):mr_conditional"
-            try:
-                res = smf.glm(formula, data=df.dropna(), family=sm.families.Binomial()).fit(cov_type="HC3")
-                res.summary2().tables[1].to_csv(os.path.join(OUT_DIR, f"sens_{y}_{m}.csv"))
-            except Exception as e:
-                print(f"Sensitivity failed for {y} with {m}: {e}")
+
+def run_sensitivity(df: pd.DataFrame, workers: int = None, cache_dir: str = None, csv: bool = False, maxiter: int = MAXITER, fit_seconds: float = None) -> None:
+    # alt artifact metrics, siblings of the main (artifact_burden) specification.
+    # fit_seconds bounds each batched IRLS; the grid cell as a whole gets twice
+    # that (design and sandwich included) before it is cut off and quarantined
+    budget = {"maxiter": maxiter, "fit_seconds": fit_seconds}
+    try:
+        parent = fit_logit_batch(df, OUTCOMES, build_formula(OUTCOMES[0], PARENT_METRIC), cache_dir=cache_dir, maxiter=maxiter, time_budget=fit_seconds)
+        iters = [parent.iterations().assign(metric=PARENT_METRIC)]
+    except Exception as e:
+        print(f"Parent fit failed, siblings start cold: {e}")
+        parent, iters = None, [quarantine_row("error", str(e), outcome=y, metric=PARENT_METRIC) for y in OUTCOMES]
+    cells = [m for m in METRICS if m in df.columns]
+    rows = []
+    timeout = None if fit_seconds is None else 2 * fit_seconds
+    for m, out, err in run_grid(df, cells, partial(fit_cell, parent=parent, cache_dir=cache_dir, **budget), workers=workers, timeout=timeout):
+        if err is not None:
+            status, detail = error_reason(err)
+            print(f"Sensitivity quarantined for {m} ({status}): {detail}")
+            iters += [quarantine_row(status, detail, outcome=y, metric=m) for y in OUTCOMES]
+            continue
+        for y, table in out["tables"].items():
+            rows.append(summary_rows(table, "coef", variant="alt_metric", outcome=y, metric=m))
+            if csv:
+                table.to_csv(os.path.join(OUT_DIR, f"sens_{y}_{m}.csv"))
+        iters.append(out["iterations"].assign(metric=m))
+    iters = pd.concat(iters, ignore_index=True).assign(variant="alt_metric")
+    iters.to_csv(os.path.join(OUT_DIR, "sens_iterations.csv"), index=False)
+    diags = [iters]
 
     # exclude non-diagnostic vs penalty in UtilityScore
+    keys = {"variant": "complete_case", "outcome": "dx_change", "metric": "artifact_burden"}
     try:
+        t0 = time.time()
         df_cc = df[df["NonDiagnostic"] == 0]
-        res_cc = smf.glm("dx_change ~ C(device_cat) + mr_conditional + artifact_burden + age + sex_male", data=df_cc.dropna(), family=sm.families.Binomial()).fit(cov_type="HC3")
-        res_cc.summary2().tables[1].to_csv(os.path.join(OUT_DIR, "sens_dx_change_complete_case.csv"))
-    except Exception:
-        pass
+        frame_cc = model_frame(df_cc, FORMULA_CC)
+        # separated specifications are quarantined without a fit, as in 03
+        separating = separating_terms(FORMULA_CC, frame_cc)
+        if separating:
+            diag = separation_diagnostics(separating, time.time() - t0)
+        else:
+            res_cc = glm_fit(FORMULA_CC, frame_cc, sm.families.Binomial(), cov_type="HC3", cache_dir=cache_dir, maxiter=maxiter)
+            diag = result_diagnostics(res_cc, time.time() - t0, separating)
+        diags.append(pd.DataFrame([diag]).assign(**keys))
+        if diag["status"] != "ok":
+            print(f"Complete-case sensitivity quarantined ({diag['status']}): {diag['detail']}")
+        else:
+            table = summary_table(res_cc.params, logit_cov(res_cc, "HC3"))
+            rows.append(summary_rows(table, "coef", **keys))
+            if csv:
+                table.to_csv(os.path.join(OUT_DIR, "sens_dx_change_complete_case.csv"))
+    except Exception as e:
+        print(f"Complete-case sensitivity quarantined (error): {e}")
+        diags.append(quarantine_row("error", str(e), **keys))
+    if rows:
+        write(rows, "06_sensitivity")
+    write_diagnostics(diags, "06_sensitivity")
 
 
 def main() -> None:
-    df = load_clean()
-    run_sensitivity(df)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=None, help="grid worker processes (default: one per cell, up to the CPU count)")
+    ap.add_argument("--no-cache", action="store_true", help="refit every model instead of reusing cached fits")
+    ap.add_argument("--csv", action="store_true", help="also write the per-model CSVs to OUT_DIR")
+    ap.add_argument("--maxiter", type=int, default=MAXITER, help="IRLS iteration budget per fit")
+    ap.add_argument("--fit-seconds", type=float, default=None, help="IRLS wall-clock budget per batched fit")
+    args = ap.parse_args()
+    df = load_clean(columns=["NonDiagnostic"], formula=[build_formula(y, m) for y in OUTCOMES for m in [PARENT_METRIC] + METRICS] + [FORMULA_CC])
+    run_sensitivity(df, workers=args.workers, cache_dir=None if args.no_cache else CACHE_DIR, csv=args.csv, maxiter=args.maxiter, fit_seconds=args.fit_seconds)
 
 
 if __name__ == "__main__":
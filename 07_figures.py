@@ -4,18 +4,12 @@ import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+from loader import load_clean
+
 # plan 5: key figures (minimal placeholders)
-IN_PARQUET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
-IN_CSV = "/workspace/clean.csv"
 OUT_DIR = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/figs"
 
 
-def load_clean() -> pd.DataFrame:
-    if os.path.exists(IN_PARQUET):
-        return pd.read_parquet(IN_PARQUET)
-    return pd.read_csv(IN_CSV)
-
-
 def ensure_dir(path: str) -> None:
     if not os.path.exists(path):
         os.makedirs(path, exist_ok=True)
@@ -25,9 +19,9 @@ def dose_response(df: pd.DataFrame) -> None:
     ensure_dir(OUT_DIR)
     df = df.copy()
     df["artifact_q"] = pd.qcut(df["artifact_burden"], 5, duplicates="drop")
-    p = df.groupby(["device_cat", "artifact_q"])['dx_change'].mean().reset_index()
+    p = df.groupby(["device_cat", "artifact_q"], observed=True)['dx_change'].mean().reset_index()
     plt.figure(figsize=(6, 4))
-    for dev, sub in p.groupby("device_cat"):
+    for dev, sub in p.groupby("device_cat", observed=True):
         x = sub["artifact_q"].astype(str)
         y = sub["dx_change"]
         plt.plot(x, y, marker='o', label=dev)
@@ -49,7 +43,7 @@ def ridgeline_placeholder(df: pd.DataFrame) -> None:
 
 
 def main() -> None:
-    df = load_clean()
+    df = load_clean(columns=["device_cat", "artifact_burden", "dx_change", "ratio_TFE"])
     if "artifact_burden" in df.columns and "dx_change" in df.columns:
         dose_response(df)
     if "ratio_TFE" in df.columns:
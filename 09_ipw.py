@@ -0,0 +1,57 @@
+import argparse
+import time
+
+from ipw import design, ipw_effects
+from loader import load_clean
+from results import write
+from schema import TABLE1_COLS
+
+# plan 3.5: weighted device comparison (IPW / overlap weights)
+OUT_DIR = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/"
+OUTCOMES = ["dx_change", "MgmtChange", "AddInfo", "NonDiagnostic"]
+# pre-implant patient characteristics from build_features; device and imaging
+# features are downstream of the device choice and stay out of the propensity model
+PS_RHS = "age + sex_male + bmi + hf + htn + cad + mi + afib + ckd + C(pre_dx_cat)"
+
+
+def ipw_spec() -> dict:
+    return {"ps_rhs": PS_RHS, "outcomes": OUTCOMES, "treatment": "device_cat", "reference": "PPM", "balance_cols": TABLE1_COLS}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bootstrap", type=int, default=1000, help="bootstrap replicates for the weighted estimates (0 = point estimates only)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--seed", type=int, default=20240501)
+    ap.add_argument("--csv", action="store_true", help="also write the balance, weight and effect tables as CSVs")
+    args = ap.parse_args()
+
+    df = load_clean(columns=["device_cat"] + OUTCOMES + TABLE1_COLS, formula=PS_RHS)
+    spec = ipw_spec()
+    d = design(df, spec)
+    balance = d.balance()
+    weights = d.weight_summary()
+    print(weights.to_string(index=False))
+    worst = balance.groupby("estimand")[["smd_unweighted", "smd_weighted"]].agg(lambda s: s.abs().max())
+    print(f"max |SMD| over Table 1 variables:\n{worst.to_string()}")
+
+    t0 = time.time()
+    effects = ipw_effects(df, spec, args.bootstrap, seed=args.seed, workers=args.workers)
+    print(f"weighted effects with {args.bootstrap} bootstrap replicates in {time.time() - t0:.1f}s")
+
+    rows = [
+        effects.rename(columns={"estimand": "variant", "effect": "term"}).assign(kind="ipw"),
+        balance.melt(id_vars=["variable", "contrast", "estimand"], var_name="weighting", value_name="value")
+        .assign(term=lambda t: t["variable"] + ":" + t["weighting"])
+        .rename(columns={"estimand": "variant"})[["variant", "contrast", "term", "value"]]
+        .assign(kind="balance"),
+    ]
+    write(rows, "09_ipw")
+    if args.csv:
+        balance.to_csv(OUT_DIR + "ipw_balance.csv", index=False)
+        weights.to_csv(OUT_DIR + "ipw_weights.csv", index=False)
+        effects.to_csv(OUT_DIR + "ipw_effects.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
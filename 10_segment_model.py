@@ -0,0 +1,37 @@
+import argparse
+import time
+
+from loader import load_clean
+from results import summary_rows, write
+from segment_model import SegmentDesign, fit_segment_logit, segment_summary
+from segments import SEGMENTS, SEQUENCES, SEVERE_GRADE, load_segment_tensor
+
+# plan 3.6: segment-level model of severe artifact (grade >= 3), clustered on patient
+SEGMENTS_NPY = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/segments.npy"
+OUT = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/segment_model_coefs.csv"
+# patient-level terms; segment and sequence enter as one-hot blocks
+RHS = "C(device_cat) + norm_dist_LV_apex + n_leads + left_vs_other"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threshold", type=int, default=SEVERE_GRADE, help="grade counted as severe artifact")
+    ap.add_argument("--csv", action="store_true")
+    args = ap.parse_args()
+
+    # the tensor's patient axis follows the clean dataset's row order
+    grades, meta = load_segment_tensor(SEGMENTS_NPY)
+    if meta["segments"] != list(SEGMENTS) or meta["sequences"] != list(SEQUENCES):
+        raise ValueError(f"{SEGMENTS_NPY} was written with a different segment layout; rerun 01_data_prep")
+    patients = load_clean(columns=["device_cat"], formula="~" + RHS)
+    t0 = time.time()
+    fit = fit_segment_logit(SegmentDesign(grades, patients, RHS, threshold=args.threshold))
+    print(f"{fit['nobs']} graded segments from {fit['n_clusters']} patients, {fit['n_iter']} iterations, converged={fit['converged']} ({time.time() - t0:.1f}s)")
+    table = segment_summary(fit)
+    write(summary_rows(table, "coef", variant="segment_cluster", outcome=f"segment_grade_ge{args.threshold}"), "10_segment_model")
+    if args.csv:
+        table.to_csv(OUT)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
+import sys
+
 import pandas as pd
 from tableone import TableOne
 from scipy.stats import shapiro
 
-# Load the Excel file
-df = pd.read_excel(
-    "/home/sunx/data/aiiih/projects/sunx/projects/CIED/Database 6.12 clean LB.xlsx",
-    engine="openpyxl",
-)
+from ingest import SRC_XLSX, read_workbook
+
+# Load the Excel file (cached snapshot unless --force-reingest)
+df = read_workbook(SRC_XLSX, force="--force-reingest" in sys.argv)
 
 # Rename columns
 column_rename_map = {
@@ -1,25 +1,22 @@
+import sys
+
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
+
+from coerce import to_bin as coerce_bin, to_num
+from ingest import SRC_XLSX, arrow_frame, read_workbook
+from loader import save_csv
+from rowagg import row_max, row_mean, row_sum
+from schema import apply_schema
 
 # plan 0: load data
-df = pd.read_excel(
-    "/home/sunx/data/aiiih/projects/sunx/projects/CIED/Database 6.12 clean LB.xlsx",
-    engine="openpyxl",
-)
+df = read_workbook(SRC_XLSX, force="--force-reingest" in sys.argv)
 
 # helpers
-def to_num(series):
-    return pd.to_numeric(series, errors="coerce")
-
 def to_bin(series):
     s = series if isinstance(series, pd.Series) else pd.Series(series, index=df.index)
-    if s.dtype == object:
-        s = s.str.strip().str.lower()
-        s = s.replace({
-            "yes": 1, "y": 1, "true": 1, "1": 1,
-            "no": 0, "n": 0, "false": 0, "0": 0,
-        })
-    return pd.to_numeric(s, errors="coerce").fillna(0).astype(int)
+    return coerce_bin(s)
 
 def safe_divide(num, den):
     num = to_num(num)
@@ -107,9 +104,7 @@ df["lv_lead"] = to_bin(df.get("LV lead Yes/No", 0))
 subq_raw = df.get("SubQ lead - (0=no,1=yes,3=other (leadless)")
 df["subq_lead"] = (to_num(subq_raw) == 1).fillna(0).astype(int) if subq_raw is not None else 0
 
-df["n_leads"] = (
-    df[["atrial_lead", "ventricular_lead", "lv_lead", "subq_lead"]].sum(axis=1)
-)
+df["n_leads"] = row_sum(df, ["atrial_lead", "ventricular_lead", "lv_lead", "subq_lead"])
 df["has_LV"] = df["lv_lead"]
 df["has_SQ"] = df["subq_lead"]
 
@@ -161,8 +156,8 @@ for info in seqs:
         wall_any_severe_cols[wall].append(f"{wall}_severe_{name}")
 
 # global artefact burden
-df["artifact_burden"] = df[ratio_cols].apply(lambda r: r.dropna().mean(), axis=1)
-df["max_ratio"] = df[ratio_cols].max(axis=1, skipna=True)
+df["artifact_burden"] = row_mean(df, ratio_cols)
+df["max_ratio"] = row_max(df, ratio_cols)
 
 # global LV visibility
 for wall, cols in wall_any_severe_cols.items():
@@ -172,9 +167,9 @@ for wall, cols in wall_any_severe_cols.items():
     else:
         df[f"lv_{wall}_clean"] = np.nan
 
-df["lv_visibility_score"] = df[[
+df["lv_visibility_score"] = row_sum(df, [
     "lv_lateral_clean", "lv_septal_clean", "lv_anterior_clean", "lv_inferior_clean"
-]].sum(axis=1, min_count=1)
+], min_count=1)
 
 # cause of artefact (binaryization)
 # explicit mapping due to dataset suffix inconsistencies for RV cause
@@ -229,9 +224,7 @@ df["UtilityScore"] = (
 )
 
 # plan 6: save clean dataset
+df = apply_schema(df)
 out_parquet = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
-try:
-    df.to_parquet(out_parquet, index=False)
-except Exception:
-    pass
-df.to_csv("/workspace/clean.csv", index=False)
+pq.write_table(arrow_frame(df), out_parquet)
+save_csv(df, "/workspace/clean.csv")
@@ -0,0 +1,108 @@
+import json
+import os
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+# plan 1.0: factorized coercion for free-text yes/no and numeric columns.
+# Each object column is factorized once; only its few distinct tokens go through
+# the string/lookup path and the codes are broadcast back.
+BIN_TOKENS = {
+    "yes": 1,
+    "y": 1,
+    "true": 1,
+    "1": 1,
+    "no": 0,
+    "n": 0,
+    "false": 0,
+    "0": 0,
+}
+
+# raw token -> resolved code (NaN = unmapped); shared across columns and, via
+# load/save_token_cache, across runs
+TOKEN_CACHE: dict = {}
+# column -> Counter of (token, reason) for values that were not a clean 0/1
+UNMAPPED: dict = defaultdict(Counter)
+
+
+def _resolve_tokens(tokens: list) -> np.ndarray:
+    todo = [t for t in tokens if t not in TOKEN_CACHE]
+    if todo:
+        # same semantics as .str.strip().str.lower().replace(BIN_TOKENS) + to_numeric
+        cleaned = [BIN_TOKENS.get(t.strip().lower(), t.strip().lower()) for t in todo]
+        codes = pd.to_numeric(pd.Series(cleaned, dtype=object), errors="coerce").to_numpy(dtype=float)
+        TOKEN_CACHE.update(zip(todo, codes))
+    return np.array([TOKEN_CACHE[t] for t in tokens], dtype=float)
+
+
+def _record(name, token, reason: str, n: int) -> None:
+    UNMAPPED[str(name)][(repr(token), reason)] += int(n)
+
+
+def to_num(series: pd.Series) -> pd.Series:
+    if not isinstance(series, pd.Series) or series.dtype != object:
+        return pd.to_numeric(series, errors="coerce")
+    codes, uniques = pd.factorize(series)
+    values = pd.to_numeric(pd.Series(uniques, dtype=object), errors="coerce").to_numpy()
+    if (codes < 0).any():
+        values = np.append(values.astype(float), np.nan)
+    return pd.Series(values[codes], index=series.index, name=series.name)
+
+
+def to_bin(series: pd.Series) -> pd.Series:
+    s = series if isinstance(series, pd.Series) else pd.Series(series)
+    if s.dtype != object:
+        return pd.to_numeric(s, errors="coerce").fillna(0).astype(int)
+
+    codes, uniques = pd.factorize(s)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    is_text = np.array([isinstance(u, str) for u in uniques], dtype=bool)
+    mapped = np.full(len(uniques), np.nan)
+    if is_text.any():
+        mapped[is_text] = _resolve_tokens([u for u, t in zip(uniques, is_text) if t])
+
+    for u, t, m, n in zip(uniques, is_text, mapped, counts):
+        if not t:
+            # .str accessors turn non-text cells of an object column into NaN -> 0;
+            # only worth flagging when the cell did not already mean 0
+            if not (isinstance(u, (int, float, np.number)) and u == 0):
+                _record(s.name, u, "non-text", n)
+        elif np.isnan(m):
+            _record(s.name, u, "unparsed", n)
+        elif m not in (0, 1):
+            _record(s.name, u, "non-binary", n)
+
+    if not len(uniques):
+        # all-missing column (e.g. a small incremental delta): nothing to index into
+        return pd.Series(0, index=s.index, name=s.name)
+    out = np.where(codes >= 0, mapped[np.maximum(codes, 0)], np.nan)
+    return pd.Series(out, index=s.index, name=s.name).fillna(0).astype(int)
+
+
+def coercion_report() -> pd.DataFrame:
+    rows = [
+        {"column": col, "token": token, "reason": reason, "n": n}
+        for col, counter in UNMAPPED.items()
+        for (token, reason), n in counter.items()
+    ]
+    return pd.DataFrame(rows, columns=["column", "token", "reason", "n"])
+
+
+def reset_report() -> None:
+    UNMAPPED.clear()
+
+
+def load_token_cache(path: str) -> None:
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        TOKEN_CACHE.update({k: (np.nan if v is None else v) for k, v in json.load(f).items()})
+
+
+def save_token_cache(path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({k: (None if np.isnan(v) else float(v)) for k, v in TOKEN_CACHE.items()}, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
@@ -0,0 +1,152 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+from patsy import NAAction
+from patsy.categorical import categorical_to_int
+from scipy import stats
+
+from loader import code_columns
+
+# plan 3.2b: counterfactual mean predictions at the design-matrix level
+# (design built once, overridden columns rebuilt per grid point, delta-method bands)
+
+CHUNK_ROWS = 100_000
+
+
+def _factor_values(info, data) -> np.ndarray:
+    # patsy's per-factor evaluation: integer level codes for categoricals,
+    # an (n, k) float block for numericals
+    values = info.factor.eval(info.state, data)
+    if info.type == "categorical":
+        return np.asarray(categorical_to_int(values, info.categories, NAAction(), origin=info.factor))
+    values = np.asarray(values, dtype=float)
+    return values.reshape(len(values), -1)
+
+
+def _factor_column(info, contrast, values: np.ndarray, col: int) -> np.ndarray:
+    if info.type == "categorical":
+        return contrast.matrix[values, col]
+    return values[:, col]
+
+
+def delta_se(grad: np.ndarray, cov: np.ndarray) -> np.ndarray:
+    # row-wise sqrt(g' V g) for a stack of gradients
+    return np.sqrt(np.einsum("gp,pq,gq->g", grad, cov, grad))
+
+
+def design_info(res):
+    # patsy DesignInfo of a formula-fitted model (model_spec on statsmodels >= 0.15)
+    data = res.model.data
+    di = getattr(data, "design_info", None)
+    return di if di is not None else data.model_spec
+
+
+class Counterfactual:
+    # Mean predicted response over the estimation sample with some variables
+    # set to fixed values, for every row of a grid of such settings.
+    #
+    # The linear predictor splits into columns that do not involve the
+    # overridden variables (taken from the fitted exog as is) and columns that
+    # do; each of the latter is c_j(g) * r_ij, with c from the grid point and r
+    # from the row, so a whole grid is a single (G x J) @ (J x n) product.
+
+    def __init__(self, res, data: pd.DataFrame, overrides: list, cov: np.ndarray = None):
+        # cov: covariance for the delta-method bands (default res.cov_params())
+        model = res.model
+        di = design_info(res)
+        labels = getattr(model.data, "row_labels", None)
+        self.data = data if labels is None else data.loc[labels]
+        self.overrides = list(overrides)
+        self.link = model.family.link
+        self.params = res.params.to_numpy()
+        self.cov = np.asarray(res.cov_params() if cov is None else cov)
+        self.exog = exog = np.asarray(model.exog)
+
+        touched = {}
+        for factor, info in di.factor_infos.items():
+            names = set(code_columns(factor.code))
+            hit = names & set(self.overrides)
+            if hit and not names <= set(self.overrides):
+                raise NotImplementedError(f"factor {factor.name()} mixes overridden and row-level variables")
+            touched[factor] = bool(hit)
+
+        # per varying column: [(factor, contrast, column index), ...] split by side
+        fixed, self._varying = [], []
+        row_values = {}
+        for term, subterms in di.term_codings.items():
+            col = di.term_slices[term].start
+            for st in subterms:
+                widths = [
+                    st.contrast_matrices[f].matrix.shape[1] if f in st.contrast_matrices else di.factor_infos[f].num_columns
+                    for f in st.factors
+                ]
+                for combo in itertools.product(*[range(w) for w in reversed(widths)]):
+                    parts = list(zip(st.factors, combo[::-1]))
+                    if not any(touched[f] for f, _ in parts):
+                        fixed.append(col)
+                    else:
+                        self._varying.append((col, [(f, st.contrast_matrices.get(f), k) for f, k in parts]))
+                        for f, _ in parts:
+                            if not touched[f] and f not in row_values:
+                                row_values[f] = _factor_values(di.factor_infos[f], self.data)
+                    col += 1
+
+        self._di = di
+        self.fixed_idx = np.array(fixed, dtype=int)
+        self.var_idx = np.array([c for c, _ in self._varying], dtype=int)
+        self.X_fixed = exog[:, self.fixed_idx]
+        # row side of each varying column (n x J)
+        self.R = np.ones((len(self.data), len(self._varying)))
+        for j, (_, parts) in enumerate(self._varying):
+            for f, contrast, k in parts:
+                if not touched[f]:
+                    self.R[:, j] *= _factor_column(di.factor_infos[f], contrast, row_values[f], k)
+        self._touched = touched
+        self.eta_fixed = self.X_fixed @ self.params[self.fixed_idx]
+
+    def grid_columns(self, grid: pd.DataFrame) -> np.ndarray:
+        # grid side of each varying column (G x J)
+        grid_values = {
+            f: _factor_values(self._di.factor_infos[f], grid) for f, hit in self._touched.items() if hit
+        }
+        C = np.ones((len(grid), len(self._varying)))
+        for j, (_, parts) in enumerate(self._varying):
+            for f, contrast, k in parts:
+                if self._touched[f]:
+                    C[:, j] *= _factor_column(self._di.factor_infos[f], contrast, grid_values[f], k)
+        return C
+
+    def mean_and_grad(self, grid: pd.DataFrame, chunksize: int = CHUNK_ROWS):
+        # mean response per grid row (G,) and its gradient wrt the params (G x p)
+        C = self.grid_columns(grid)
+        Cb = C * self.params[self.var_idx]
+        n = len(self.data)
+        G, p = len(grid), len(self.params)
+        mean = np.zeros(G)
+        g_fixed = np.zeros((G, len(self.fixed_idx)))
+        g_var = np.zeros((G, len(self.var_idx)))
+        for start in range(0, n, chunksize):
+            sl = slice(start, start + chunksize)
+            eta = self.eta_fixed[sl][None, :] + Cb @ self.R[sl].T
+            mean += self.link.inverse(eta).sum(axis=1)
+            w = self.link.inverse_deriv(eta)
+            g_fixed += w @ self.X_fixed[sl]
+            g_var += w @ self.R[sl]
+        grad = np.zeros((G, p))
+        grad[:, self.fixed_idx] = g_fixed / n
+        grad[:, self.var_idx] = C * g_var / n
+        return mean / n, grad
+
+    def mean_predictions(self, grid: pd.DataFrame, alpha: float = 0.05, chunksize: int = CHUNK_ROWS) -> pd.DataFrame:
+        # grid: one row per setting, columns = the overridden variables
+        grid = grid.reset_index(drop=True)
+        mean, grad = self.mean_and_grad(grid, chunksize)
+        se = delta_se(grad, self.cov)
+        z = stats.norm.ppf(1 - alpha / 2)
+        out = grid.copy()
+        out["mean_prob"] = mean
+        out["se"] = se
+        out["lower"] = np.clip(mean - z * se, 0, 1)
+        out["upper"] = np.clip(mean + z * se, 0, 1)
+        return out
@@ -0,0 +1,461 @@
+import time
+
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import linalg, sparse, stats
+
+import model_cache
+from loader import formula_columns
+from modeling import ModelFrames
+
+# plan 6.4: batched logistic GLM (one design matrix, a block of binary outcomes)
+
+# same layout as statsmodels' summary2().tables[1]
+SUMMARY_COLUMNS = ["Coef.", "Std.Err.", "z", "P>|z|", "[0.025", "0.975]"]
+
+MAXITER = 100
+TOL = 1e-8
+CHUNK_ROWS = 65_536
+COV_TYPES = ("HC0", "HC1", "HC2", "HC3", "cluster")
+# designs with a larger share of non-zeros are densified after building
+SPARSE_DENSITY = 0.25
+# a fit whose largest |eta| is past this (probability within ~1e-13 of 0 or
+# 1) is separated, converged or not; IRLS stops an unconverged one once it
+# is past this and still growing, further iterations would only burn time
+SEPARATION_ETA = 30.0
+# per-outcome fit status; anything but "ok" is quarantined by the scripts
+FIT_STATUSES = ("ok", "separation", "nonconverged", "timeout", "error", "too_small")
+
+
+def _expit(eta: np.ndarray) -> np.ndarray:
+    return 0.5 * (1 + np.tanh(0.5 * eta))
+
+
+def _deviance(Y: np.ndarray, mu: np.ndarray, fw: np.ndarray) -> np.ndarray:
+    mu = np.clip(mu, 1e-300, 1 - 1e-16)
+    ll = np.where(Y > 0, np.log(mu), np.log1p(-mu))
+    return -2 * np.where(fw > 0, fw * ll, 0).sum(axis=0)
+
+
+def _scale_rows(X, v: np.ndarray):
+    # diag(v) X for a dense or CSR X
+    return X.multiply(v[:, None]).tocsr() if sparse.issparse(X) else X * v[:, None]
+
+
+def _dense(M) -> np.ndarray:
+    return M.toarray() if sparse.issparse(M) else np.asarray(M)
+
+
+def design_matrix(rhs: str, frame: pd.DataFrame, chunksize: int = CHUNK_ROWS, sparse_density: float = SPARSE_DENSITY) -> tuple:
+    # patsy design built in row blocks, each block stored as CSR, so the dense
+    # temporary is one block wide; one-hot and interaction columns are mostly
+    # zeros. The result is densified when its share of non-zeros exceeds
+    # sparse_density. -> (X, column names)
+    def blocks():
+        return (frame.iloc[i:i + chunksize] for i in range(0, len(frame), chunksize))
+
+    builder = patsy.incr_dbuilder(rhs, blocks, eval_env=patsy.EvalEnvironment.capture(0), NA_action="raise")
+    X = sparse.vstack([sparse.csr_matrix(np.asarray(patsy.build_design_matrices([builder], b, NA_action="raise")[0])) for b in blocks()], format="csr")
+    if X.nnz > sparse_density * X.shape[0] * X.shape[1]:
+        X = X.toarray()
+    return X, list(builder.column_names)
+
+
+def gram(w: np.ndarray, X, chunksize: int = CHUNK_ROWS) -> np.ndarray:
+    # stacked X' diag(w_k) X for every column of w -> (K, p, p), in row chunks
+    # so the (K, p, chunk) temporary stays bounded; a CSR X costs one sparse
+    # product per column, proportional to its non-zeros
+    out = np.zeros((w.shape[1], X.shape[1], X.shape[1]))
+    if sparse.issparse(X):
+        for k in range(w.shape[1]):
+            out[k] = _dense(X.T @ _scale_rows(X, w[:, k]))
+        return out
+    for start in range(0, X.shape[0], chunksize):
+        Xc = X[start:start + chunksize]
+        out += (Xc.T[None] * w[start:start + chunksize].T[:, None, :]) @ Xc
+    return out
+
+
+def batched_solve(A: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # batched (K, p, p) @ x = (K, p); rank-deficient blocks fall back to pinv
+    try:
+        return np.linalg.solve(A, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum("kij,kj->ki", np.linalg.pinv(A), b)
+
+
+def irls_logit(X, Y: np.ndarray, mask: np.ndarray = None, start: np.ndarray = None, maxiter: int = MAXITER, tol: float = TOL, weights: np.ndarray = None,
+               eta_max: float = None, deadline: float = None):
+    # IRLS for K logistic regressions sharing X (n x p, dense or CSR); Y and mask are n x K,
+    # rows outside an outcome's mask get zero weight. Same start (mu=(y+.5)/2,
+    # or eta = X @ start given p x K start params) and deviance criterion as
+    # statsmodels' GLM, so the iterates match it. weights (n x K) are
+    # frequency weights, e.g. bootstrap counts.
+    # eta_max: stop an unconverged outcome once its largest fitted |eta|
+    # exceeds it and grew over the last iteration, see SEPARATION_ETA;
+    # deadline: time.monotonic() after which no further iteration starts.
+    n, p = X.shape
+    Y = np.asarray(Y, dtype=float).reshape(n, -1)
+    mask = np.ones(Y.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool).reshape(Y.shape)
+    Y = np.where(mask, Y, 0.0)
+    fw = mask.astype(float) if weights is None else np.where(mask, np.asarray(weights, dtype=float).reshape(Y.shape), 0.0)
+    K = Y.shape[1]
+    if start is None:
+        mu = (Y + 0.5) / 2
+        eta = np.log(mu / (1 - mu))
+        params = np.zeros((p, K))
+    else:
+        params = np.array(start, dtype=float).reshape(p, K)
+        eta = X @ params
+        mu = _expit(eta)
+    dev = _deviance(Y, mu, fw)
+    n_iter = np.zeros(K, dtype=int)
+    converged = np.zeros(K, dtype=bool)
+    # a non-finite deviance (e.g. a bad start) stops that outcome unconverged
+    failed = ~np.isfinite(dev)
+    eta_top = np.where(mask, np.abs(eta), 0.0).max(axis=0)
+    for it in range(maxiter):
+        active = ~(converged | failed)
+        if not active.any() or (deadline is not None and time.monotonic() > deadline):
+            break
+        a = np.flatnonzero(active)
+        var = mu[:, a] * (1 - mu[:, a])
+        w = fw[:, a] * var
+        z = eta[:, a] + (Y[:, a] - mu[:, a]) / np.where(var > 0, var, 1.0)
+        params[:, a] = batched_solve(gram(w, X), (X.T @ (w * z)).T).T
+        eta[:, a] = X @ params[:, a]
+        mu[:, a] = _expit(eta[:, a])
+        new_dev = _deviance(Y[:, a], mu[:, a], fw[:, a])
+        n_iter[a] = it + 1
+        converged[a] = np.abs(new_dev - dev[a]) <= tol
+        failed[a] = ~np.isfinite(new_dev)
+        if eta_max is not None:
+            top = np.where(mask[:, a], np.abs(eta[:, a]), 0.0).max(axis=0)
+            failed[a] |= ~converged[a] & (top > eta_max) & (top > eta_top[a])
+            eta_top[a] = top
+        dev[a] = new_dev
+    return params, n_iter, converged
+
+
+def separating_columns(X, Y: np.ndarray, mask: np.ndarray = None) -> np.ndarray:
+    # (p, K) flags for 0/1 design columns whose rows with a 1 all share the
+    # same outcome (within the outcome's mask): that coefficient has no finite
+    # MLE (quasi-complete separation), typically a sparse level or
+    # interaction dummy. A flagged all-ones intercept means the outcome is
+    # constant. Costs two X' products, no fit, so it runs before IRLS; any
+    # flag makes the fit's status "separation" (see fit_status).
+    n = X.shape[0]
+    Y = np.asarray(Y, dtype=float).reshape(n, -1)
+    M = np.ones(Y.shape) if mask is None else np.asarray(mask, dtype=float).reshape(Y.shape)
+    sq = X.multiply(X) - X if sparse.issparse(X) else X * X - X
+    binary = np.asarray(abs(sq).sum(axis=0)).ravel() == 0
+    n1 = _dense(X.T @ M)
+    s1 = _dense(X.T @ (M * np.where(M > 0, Y, 0.0)))
+    return binary[:, None] & (n1 > 0) & ((s1 == 0) | (s1 == n1))
+
+
+def separation_detail(y: np.ndarray, names: list, flags: np.ndarray) -> str:
+    # one outcome's separating_columns flags as text ("" when none)
+    if len(y) and len(np.unique(y)) == 1:
+        return f"constant outcome ({y[0]:g})"
+    return ", ".join(n for n, f in zip(names, flags) if f)
+
+
+def separating_terms(formula: str, frame: pd.DataFrame) -> str:
+    # separation_detail for a single-outcome "y ~ rhs" on its complete-case frame
+    lhs, rhs = (s.strip() for s in formula.split("~", 1))
+    X, names = design_matrix(rhs, frame)
+    y = frame[lhs].to_numpy(dtype=float)
+    return separation_detail(y, names, separating_columns(X, y)[:, 0])
+
+
+def fit_diagnostics(X, Y: np.ndarray, mask: np.ndarray, params: np.ndarray) -> dict:
+    # per outcome: max |score| = max |X'(y - mu)| over the masked rows,
+    # condition number of the information X'WX, and max fitted |eta|
+    n = X.shape[0]
+    Y = np.asarray(Y, dtype=float).reshape(n, -1)
+    mask = np.ones(Y.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool).reshape(Y.shape)
+    params = np.asarray(params, dtype=float).reshape(X.shape[1], -1)
+    eta = X @ params
+    mu = _expit(eta)
+    score = _dense(X.T @ np.where(mask, Y - mu, 0.0))
+    with np.errstate(invalid="ignore", over="ignore"):
+        cond = np.linalg.cond(gram(np.where(mask, mu * (1 - mu), 0.0), X))
+    return {
+        "max_grad": np.abs(score).max(axis=0),
+        "cond": cond,
+        "max_abs_eta": np.where(mask, np.abs(eta), 0.0).max(axis=0),
+    }
+
+
+def fit_status(converged: np.ndarray, max_abs_eta: np.ndarray, separating=None, timed_out: bool = False) -> np.ndarray:
+    # separation when |eta| passed SEPARATION_ETA or separating_columns
+    # flagged a term (separating: per-outcome separation_detail strings),
+    # converged or not: those coefficients and their SEs are artefacts of
+    # where IRLS stopped. Otherwise ok if converged, else timeout or
+    # nonconverged.
+    converged, max_abs_eta = np.asarray(converged, dtype=bool), np.asarray(max_abs_eta, dtype=float)
+    status = np.where(converged, "ok", "timeout" if timed_out else "nonconverged").astype(object)
+    flagged = np.zeros(len(status), dtype=bool) if separating is None else np.array([bool(s) for s in separating])
+    status[flagged | (max_abs_eta > SEPARATION_ETA)] = "separation"
+    return status
+
+
+def status_detail(status: str, max_abs_eta: float, n_iter, separating: str = "") -> str:
+    # one-line reason for a quarantined fit
+    if status == "separation":
+        return f"separated by {separating}" if separating else f"|eta| {max_abs_eta:.3g} after {n_iter} iterations"
+    if status in ("nonconverged", "timeout"):
+        return f"{n_iter} iterations"
+    return ""
+
+
+def separation_diagnostics(separating: str, seconds: float = None) -> dict:
+    # result_diagnostics layout for a fit skipped because separating_terms
+    # flagged it before IRLS
+    return {
+        "status": "separation", "detail": status_detail("separation", np.nan, 0, separating), "separating": separating,
+        "n_iter": 0, "converged": False, "max_grad": np.nan, "cond": np.nan, "max_abs_eta": np.nan, "seconds": seconds,
+    }
+
+
+def array_chunks(X, Y: np.ndarray, mask: np.ndarray = None, groups: np.ndarray = None, chunksize: int = CHUNK_ROWS):
+    # re-iterable source of (X, Y, mask, groups) row blocks over in-memory
+    # arrays; out-of-core callers supply their own callable with the same shape
+    n = X.shape[0]
+    Y = np.asarray(Y, dtype=float).reshape(n, -1)
+    mask = np.ones(Y.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool).reshape(Y.shape)
+
+    def chunks():
+        for start in range(0, n, chunksize):
+            sl = slice(start, start + chunksize)
+            yield X[sl], Y[sl], mask[sl], None if groups is None else groups[sl]
+
+    return chunks
+
+
+def _leverage(L: np.ndarray, X: np.ndarray, w: np.ndarray) -> np.ndarray:
+    # h_ik = w_ik x_i' A_k^-1 x_i = |L_k^-1 sqrt(w_ik) x_i|^2, O(rows * p^2)
+    h = np.empty(w.shape)
+    for k in range(w.shape[1]):
+        V = linalg.solve_triangular(L[k], _dense(_scale_rows(X, np.sqrt(w[:, k]))).T, lower=True)
+        h[:, k] = np.einsum("ij,ij->j", V, V)
+    return h
+
+
+def robust_cov(chunks, params: np.ndarray, cov_type: str = "HC0") -> np.ndarray:
+    # (K, p, p) sandwich A^-1 M A^-1 accumulated over row blocks; only p x p
+    # state is held, so `chunks` (see array_chunks) may stream from disk.
+    #   HC0: M = sum e^2 x x'           HC1: HC0 * n / (n - p)
+    #   HC2: e^2 / (1 - h)              HC3: e^2 / (1 - h)^2
+    #   cluster: M = sum_g s_g s_g', s_g = sum_{i in g} e_i x_i, with the
+    #   G/(G-1) * (n-1)/(n-p) correction statsmodels applies
+    # where h is the GLM leverage w_i x_i' A^-1 x_i from a Cholesky factor of
+    # A = X'WX (the R of a thin QR of the weighted design), never an n x n hat.
+    if cov_type not in COV_TYPES:
+        raise ValueError(f"cov_type must be one of {COV_TYPES}")
+    K, p = params.shape[1], params.shape[0]
+    A = np.zeros((K, p, p))
+    nobs = np.zeros(K)
+    n_groups = 0
+    for X, Y, mask, groups in chunks():
+        mu = _expit(X @ params)
+        A += gram(np.where(mask, mu * (1 - mu), 0.0), X)
+        nobs += mask.sum(axis=0)
+        if cov_type == "cluster":
+            n_groups = max(n_groups, int(groups.max()) + 1)
+    L = np.linalg.cholesky(A)
+    bread = np.stack([linalg.cho_solve((L[k], True), np.eye(p)) for k in range(K)])
+
+    meat = np.zeros((K, p, p))
+    if cov_type == "cluster":
+        scores = np.zeros((K, n_groups, p))
+        seen = np.zeros((K, n_groups), dtype=bool)
+    for X, Y, mask, groups in chunks():
+        mu = _expit(X @ params)
+        e = np.where(mask, Y - mu, 0.0)
+        if cov_type == "cluster":
+            onehot = sparse.csr_matrix((np.ones(X.shape[0]), (groups, np.arange(X.shape[0]))), shape=(n_groups, X.shape[0]))
+            for k in range(K):
+                scores[k] += _dense(onehot @ _scale_rows(X, e[:, k]))
+                seen[k, groups[mask[:, k]]] = True
+            continue
+        scale = e * e
+        if cov_type in ("HC2", "HC3"):
+            h = _leverage(L, X, np.where(mask, mu * (1 - mu), 0.0))
+            scale = scale / (1 - h) ** (1 if cov_type == "HC2" else 2)
+        meat += gram(scale, X)
+    if cov_type == "cluster":
+        meat = np.einsum("kgi,kgj->kij", scores, scores)
+        G = seen.sum(axis=1)
+        meat *= (G / (G - 1) * (nobs - 1) / (nobs - p))[:, None, None]
+    elif cov_type == "HC1":
+        meat *= (nobs / (nobs - p))[:, None, None]
+    return bread @ meat @ bread
+
+
+def logit_cov(res, cov_type: str = "HC3") -> np.ndarray:
+    # robust_cov for a fitted statsmodels logit GLM (e.g. model_cache.glm_fit).
+    # statsmodels' GLMResults has no leverage-corrected cov_HCx: any
+    # cov_type="HC0".."HC3" falls back to HC0, so res.cov_params() and
+    # summary2() of an "HC3" fit are HC0. Scripts take the HC3 they report
+    # from here.
+    params = np.asarray(res.params, dtype=float)[:, None]
+    return robust_cov(array_chunks(np.asarray(res.model.exog), res.model.endog), params, cov_type)[0]
+
+
+def summary_table(params: pd.Series, cov: np.ndarray, alpha: float = 0.05) -> pd.DataFrame:
+    se = np.sqrt(np.diag(cov))
+    z = params.to_numpy() / se
+    crit = stats.norm.ppf(1 - alpha / 2)
+    table = np.column_stack([params, se, z, 2 * stats.norm.sf(np.abs(z)), params - crit * se, params + crit * se])
+    return pd.DataFrame(table, index=params.index, columns=SUMMARY_COLUMNS)
+
+
+DIAGNOSTIC_COLUMNS = ["status", "detail", "separating", "max_grad", "cond", "max_abs_eta", "seconds"]
+
+
+def result_diagnostics(res, seconds: float = None, separating: str = "") -> dict:
+    # status and diagnostics of a fitted statsmodels logit GLM (see
+    # model_cache.glm_fit), in the layout of BatchLogit.iterations();
+    # separating: separating_terms of its formula
+    d = {k: v[0] for k, v in fit_diagnostics(res.model.exog, res.model.endog, None, res.params.to_numpy()).items()}
+    status = fit_status([res.converged], [d["max_abs_eta"]], [separating])[0]
+    n_iter = getattr(res, "n_iter", None)
+    detail = status_detail(status, d["max_abs_eta"], n_iter, separating)
+    return {"status": status, "detail": detail, "separating": separating, "n_iter": n_iter, "converged": bool(res.converged), **d, "seconds": seconds}
+
+
+class BatchLogit:
+    # per-outcome results of one batched fit
+    # diag: per-outcome frame of DIAGNOSTIC_COLUMNS (None on fits cached before
+    # diagnostics were recorded)
+    diag = None
+
+    def __init__(self, outcomes: list, names: list, params: np.ndarray, cov: np.ndarray, nobs: np.ndarray, n_iter: np.ndarray, converged: np.ndarray, warm: np.ndarray = None,
+                 diag: pd.DataFrame = None):
+        self.outcomes = list(outcomes)
+        self.names = list(names)
+        self.params = pd.DataFrame(params, index=names, columns=outcomes)
+        self.cov = dict(zip(outcomes, cov))
+        self.nobs = dict(zip(outcomes, nobs))
+        self.n_iter = dict(zip(outcomes, n_iter))
+        self.converged = dict(zip(outcomes, converged))
+        self.warm = dict(zip(outcomes, np.zeros(len(outcomes), dtype=bool) if warm is None else warm))
+        self.diag = diag
+
+    def cov_params(self, outcome: str) -> pd.DataFrame:
+        return pd.DataFrame(self.cov[outcome], index=self.names, columns=self.names)
+
+    def summary(self, outcome: str, alpha: float = 0.05) -> pd.DataFrame:
+        return summary_table(self.params[outcome], self.cov[outcome], alpha)
+
+    def status(self, outcome: str) -> str:
+        if self.diag is None:
+            return "ok" if self.converged[outcome] else "nonconverged"
+        return self.diag.loc[outcome, "status"]
+
+    def ok(self) -> list:
+        # outcomes with usable estimates; the rest belong in the quarantine
+        return [y for y in self.outcomes if self.status(y) == "ok"]
+
+    def iterations(self) -> pd.DataFrame:
+        # IRLS log with the convergence diagnostics, one row per outcome
+        out = pd.DataFrame({
+            "outcome": self.outcomes,
+            "n_iter": [self.n_iter[y] for y in self.outcomes],
+            "converged": [self.converged[y] for y in self.outcomes],
+            "warm_start": [self.warm[y] for y in self.outcomes],
+        })
+        if self.diag is not None:
+            out = out.join(self.diag[DIAGNOSTIC_COLUMNS], on="outcome")
+        else:
+            out["status"] = [self.status(y) for y in self.outcomes]
+        return out
+
+    def start_params(self, names: list, outcomes: list) -> np.ndarray:
+        # p x K start values for a sibling specification: coefficients of
+        # shared design columns carry over, new columns start at zero
+        out = self.params.reindex(index=names, columns=outcomes).fillna(0.0)
+        return out.to_numpy()
+
+
+def warm_irls_logit(X: np.ndarray, Y: np.ndarray, mask: np.ndarray, start: np.ndarray, **kw):
+    # IRLS from parent params; outcomes that fail to converge (or leave
+    # non-finite params) are refit from the default cold start. n_iter counts
+    # both attempts for those. kw: maxiter / eta_max / deadline for irls_logit.
+    params, n_iter, converged = irls_logit(X, Y, mask, start=start, **kw)
+    warm = converged & np.isfinite(params).all(axis=0)
+    if not warm.all():
+        cold = np.flatnonzero(~warm)
+        p_cold, it_cold, conv_cold = irls_logit(X, Y[:, cold], mask[:, cold], **kw)
+        params[:, cold] = p_cold
+        n_iter[cold] += it_cold
+        converged[cold] = conv_cold
+    return params, n_iter, converged, warm
+
+
+def fit_logit_batch(df: pd.DataFrame, outcomes: list, rhs: str, frames: ModelFrames = None, cov_type: str = "HC0", groups: str = None, parent: BatchLogit = None, cache_dir: str = None,
+                    maxiter: int = MAXITER, time_budget: float = None) -> BatchLogit:
+    # rhs: right-hand side shared by every outcome ("a + C(b) + ..." or a full
+    # "y ~ ..." formula whose left side is ignored). The design matrix is built
+    # once over rows complete on the RHS; each outcome then uses the rows where
+    # it is observed, i.e. the same sample as a per-outcome complete-case fit.
+    # cov_type: see robust_cov; the default HC0 matches smf.glm's "HC3"
+    # (see logit_cov). groups names the cluster column for cov_type="cluster".
+    # parent: a fitted sibling specification whose params warm-start IRLS.
+    # cache_dir: memoize the fit on disk (see model_cache).
+    # maxiter / time_budget (seconds of IRLS): per-fit budget. Outcomes that
+    # are separated (see fit_status), run out of iterations or out of time
+    # keep NaN covariances. Each outcome's status and diagnostics, including the 0/1
+    # columns that separate it, are in .diag (see FIT_STATUSES); only fits
+    # whose status does not depend on the budget are cached.
+    rhs = rhs.split("~", 1)[1] if "~" in rhs else rhs
+    frames = frames or ModelFrames(df)
+    x_cols = formula_columns("~" + rhs)
+    keep = frames.mask(x_cols + ([groups] if groups else []))
+    frame = df.loc[keep, list(dict.fromkeys(x_cols + list(outcomes) + ([groups] if groups else [])))]
+
+    def fit() -> BatchLogit:
+        t0 = time.monotonic()
+        deadline = None if time_budget is None else t0 + time_budget
+        Xv, names = design_matrix(rhs, frame[x_cols])
+        Y = frame[outcomes]
+        mask = Y.notna().to_numpy()
+        Yv = Y.to_numpy(dtype=float, na_value=0.0)
+        codes = pd.factorize(frame[groups])[0] if groups else None
+        K, p = len(outcomes), Xv.shape[1]
+        sep = separating_columns(Xv, Yv, mask)
+        separating = [separation_detail(Yv[mask[:, k], k], names, sep[:, k]) for k in range(K)]
+        kw = {"maxiter": maxiter, "eta_max": SEPARATION_ETA, "deadline": deadline}
+        if parent is None:
+            params, n_iter, converged = irls_logit(Xv, Yv, mask, **kw)
+            warm = None
+        else:
+            start = parent.start_params(names, outcomes)
+            params, n_iter, converged, warm = warm_irls_logit(Xv, Yv, mask, start, **kw)
+        diag = fit_diagnostics(Xv, Yv, mask, params)
+        status = fit_status(converged, diag["max_abs_eta"], separating, deadline is not None and time.monotonic() > deadline)
+        detail = [status_detail(*a) for a in zip(status, diag["max_abs_eta"], n_iter, separating)]
+        cov = np.full((K, p, p), np.nan)
+        ok = np.flatnonzero(status == "ok")
+        if len(ok):
+            cov[ok] = robust_cov(array_chunks(Xv, Yv[:, ok], mask[:, ok], codes), params[:, ok], cov_type)
+        table = pd.DataFrame({"status": status, "detail": detail, "separating": separating, **diag, "seconds": time.monotonic() - t0}, index=pd.Index(outcomes, name="outcome"))
+        return BatchLogit(outcomes, names, params, cov, mask.sum(axis=0), n_iter, converged, warm, table)
+
+    def budget_free(fit: BatchLogit) -> bool:
+        return fit.diag is None or fit.diag["status"].isin(["ok", "separation"]).all()
+
+    label = f"{cov_type}:{groups}" if groups else cov_type
+    if maxiter != MAXITER:
+        label += f":maxiter={maxiter}"
+    res = model_cache.memoize(f"{' + '.join(outcomes)} ~ {rhs.strip()}", "Binomial(Logit)", label, frame, fit, cache_dir, keep=budget_free)
+    if res.diag is not None:
+        # entries cached while converged separated fits still passed as "ok"
+        for y in res.diag.index[res.diag["status"] == "ok"]:
+            d = res.diag.loc[y]
+            if fit_status([True], [d["max_abs_eta"]], [d["separating"]])[0] == "separation":
+                res.diag.loc[y, ["status", "detail"]] = ["separation", status_detail("separation", d["max_abs_eta"], res.n_iter[y], d["separating"])]
+    return res
@@ -0,0 +1,119 @@
+import multiprocessing as mp
+import os
+import signal
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+
+# plan 6.3: model-grid runner (independent fits fanned out over a process pool)
+
+# one BLAS thread per worker; the grid itself is the parallelism
+_THREAD_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+_FRAME = None
+
+
+def default_workers(n_cells: int) -> int:
+    return max(1, min(n_cells, os.cpu_count() or 1))
+
+
+def write_shared_frame(df: pd.DataFrame, path: str) -> None:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_shared_frame(path: str) -> pd.DataFrame:
+    # memory-mapped Arrow IPC: workers share the page cache instead of each
+    # unpickling its own copy; split_blocks keeps numeric columns zero-copy
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _init_worker(path: str) -> None:
+    global _FRAME
+    _FRAME = read_shared_frame(path)
+
+
+class CellTimeout(Exception):
+    pass
+
+
+def _alarm(signum, frame):
+    raise CellTimeout("cell exceeded its wall-clock budget")
+
+
+def _run_cell(fn, cell, timeout: float = None):
+    # timeout: per-cell wall-clock budget in seconds, enforced with SIGALRM
+    # (POSIX, main thread only: pool workers and a serial caller run cells
+    # there); the alarm is raised between bytecodes, so a long BLAS call
+    # finishes first. A cell over budget is reported like any failed cell.
+    timed = timeout is not None and hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+    if timed:
+        previous = signal.signal(signal.SIGALRM, _alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return cell, fn(_FRAME, cell), None
+    except Exception:
+        return cell, None, traceback.format_exc(limit=3)
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+def error_reason(error: str) -> tuple:
+    # (reason, detail) from a cell's error text: "timeout" for a CellTimeout,
+    # else "error" with the last traceback line
+    last = error.strip().splitlines()[-1] if error and error.strip() else ""
+    name, _, detail = last.partition(": ")
+    if name.rsplit(".", 1)[-1] == "CellTimeout":
+        return "timeout", detail
+    return "error", last
+
+
+def _collect(cell, future):
+    # a worker that dies outright (e.g. OOM) surfaces here rather than in _run_cell
+    try:
+        return future.result()
+    except Exception as e:
+        return cell, None, f"{type(e).__name__}: {e}"
+
+
+def run_grid(df: pd.DataFrame, cells: list, fn, workers: int = None, tmp_dir: str = None, timeout: float = None) -> list:
+    # fn(df, cell) -> result, must be a module-level (picklable) function.
+    # Returns [(cell, result, error)] in the order of `cells`; a failing cell
+    # (or one over its `timeout` seconds) carries its traceback in `error` and
+    # does not stop the others.
+    global _FRAME
+    cells = list(cells)
+    workers = default_workers(len(cells)) if workers is None else workers
+    if workers <= 1 or len(cells) <= 1:
+        _FRAME = df
+        try:
+            return [_run_cell(fn, c, timeout) for c in cells]
+        finally:
+            _FRAME = None
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        path = os.path.join(tmp, "frame.arrow")
+        write_shared_frame(df, path)
+        saved = {v: os.environ.get(v) for v in _THREAD_VARS}
+        os.environ.update({v: "1" for v in _THREAD_VARS})
+        try:
+            # spawn so the thread limits apply before numpy loads in the worker
+            ctx = mp.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(path,)) as pool:
+                futures = [pool.submit(_run_cell, fn, c, timeout) for c in cells]
+                return [_collect(c, f) for c, f in zip(cells, futures)]
+        finally:
+            for v, val in saved.items():
+                if val is None:
+                    os.environ.pop(v, None)
+                else:
+                    os.environ[v] = val
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from grid import run_grid
+
+# plan 3.0b: multiple imputation by chained equations in front of the model
+# scripts. Every numeric column with missing cells is imputed by predictive
+# mean matching (linear model on all other columns, parameters drawn from
+# their posterior, donor drawn among the K closest observed predictions),
+# cycling N_ITER times per chain; chains run in parallel grid workers.
+# Imputed datasets are kept as deltas: per column, the positions of the
+# missing cells and an M x n_missing block of values.
+
+N_ITER = 10
+DONORS = 5
+
+
+def _design(Z: np.ndarray, j: int, dummies: np.ndarray) -> np.ndarray:
+    return np.column_stack([np.ones(len(Z)), np.delete(Z, j, axis=1), dummies])
+
+
+def _pmm(X: np.ndarray, y: np.ndarray, obs: np.ndarray, rng: np.random.Generator, k: int = DONORS) -> np.ndarray:
+    # one Bayesian PMM draw for the rows ~obs
+    Xo, yo = X[obs], y[obs]
+    # SVD of Xo: pinv(Xo'Xo) = V S^-2 V', so collinear predictors just drop
+    # their null directions instead of breaking a Cholesky factor
+    U, s, Vt = np.linalg.svd(Xo, full_matrices=False)
+    keep = s > s.max(initial=0.0) * max(Xo.shape) * np.finfo(float).eps
+    U, s, Vt = U[:, keep], s[keep], Vt[keep]
+    beta = Vt.T @ ((U.T @ yo) / s)
+    dof = max(len(yo) - len(s), 1)
+    sigma = np.sqrt(((yo - Xo @ beta) ** 2).sum() / rng.chisquare(dof))
+    beta_star = beta + sigma * (Vt.T @ (rng.standard_normal(len(s)) / s))
+    pred_obs = Xo @ beta
+    pred_mis = X[~obs] @ beta_star
+    # k nearest observed predictions from a 2k window around each insertion point
+    order = np.argsort(pred_obs)
+    sorted_pred = pred_obs[order]
+    at = np.searchsorted(sorted_pred, pred_mis)
+    window = np.clip(at[:, None] + np.arange(-k, k)[None, :], 0, len(order) - 1)
+    dist = np.abs(sorted_pred[window] - pred_mis[:, None])
+    nearest = np.take_along_axis(window, np.argsort(dist, axis=1)[:, :k], axis=1)
+    pick = nearest[np.arange(len(pred_mis)), rng.integers(0, k, len(pred_mis))]
+    return yo[order[pick]]
+
+
+def impute_chain(df: pd.DataFrame, cell: tuple) -> dict:
+    # one chained-equations run: cell = (columns, seed, n_iter) ->
+    # {column: values at its missing positions}
+    columns, seed, n_iter = cell
+    rng = np.random.default_rng(seed)
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c]) and not isinstance(df[c].dtype, pd.CategoricalDtype)]
+    other = [c for c in df.columns if c not in numeric and df[c].notna().all()]
+    dummies = pd.get_dummies(df[other].astype(str), drop_first=True, dtype=float).to_numpy() if other else np.empty((len(df), 0))
+    Z = df[numeric].to_numpy(dtype=float)
+    miss = np.isnan(Z)
+    # predictors with missing cells that are not imputed are mean-filled
+    for j in range(Z.shape[1]):
+        if miss[:, j].any():
+            obs = Z[~miss[:, j], j]
+            Z[miss[:, j], j] = rng.choice(obs, miss[:, j].sum()) if numeric[j] in columns else obs.mean()
+    targets = [numeric.index(c) for c in columns if miss[:, numeric.index(c)].any()]
+    for _ in range(n_iter):
+        for j in targets:
+            Z[miss[:, j], j] = _pmm(_design(Z, j, dummies), Z[:, j], ~miss[:, j], rng)
+    return {numeric[j]: Z[miss[:, j], j] for j in targets}
+
+
+class Imputations:
+    # base frame (with its missing cells) plus per-column deltas
+
+    def __init__(self, df: pd.DataFrame, rows: dict, values: dict):
+        self.df = df
+        self.rows = rows
+        self.values = values
+
+    @property
+    def m(self) -> int:
+        return len(next(iter(self.values.values()))) if self.values else 0
+
+    def delta(self, i: int) -> dict:
+        # {column: (positions, values)} for imputation i; small enough to ship
+        # with a grid cell
+        return {c: (self.rows[c], self.values[c][i]) for c in self.rows}
+
+    def complete(self, i: int) -> pd.DataFrame:
+        return apply_delta(self.df, self.delta(i))
+
+    def summary(self) -> pd.DataFrame:
+        rows = []
+        for c, v in self.values.items():
+            observed = self.df[c].dropna()
+            rows.append({"column": c, "n_missing": v.shape[1], "observed_mean": observed.mean(), "imputed_mean": v.mean(), "between_sd": v.mean(axis=1).std(ddof=1) if len(v) > 1 else np.nan})
+        return pd.DataFrame(rows)
+
+
+def apply_delta(df: pd.DataFrame, delta: dict) -> pd.DataFrame:
+    # shallow copy with the imputed columns replaced; other columns are shared
+    out = df.copy(deep=False)
+    for c, (rows, values) in delta.items():
+        col = out[c].to_numpy(copy=True)
+        col[rows] = values
+        out[c] = col
+    return out
+
+
+def impute(df: pd.DataFrame, m: int, columns: list = None, n_iter: int = N_ITER, seed: int = 0, workers: int = None) -> Imputations:
+    # m chains from independent SeedSequence children; columns defaults to
+    # every numeric column with missing cells
+    if columns is None:
+        columns = [c for c in df.columns if df[c].isna().any() and pd.api.types.is_numeric_dtype(df[c]) and not isinstance(df[c].dtype, pd.CategoricalDtype)]
+    skipped = [c for c in df.columns if df[c].isna().any() and c not in columns]
+    if skipped:
+        print(f"Not imputed (left to complete-case handling): {', '.join(skipped)}")
+    seeds = np.random.SeedSequence(seed).spawn(m)
+    draws = []
+    for _, out, err in run_grid(df, [(list(columns), s, n_iter) for s in seeds], impute_chain, workers=workers):
+        if err is not None:
+            raise RuntimeError(f"Imputation chain failed: {err}")
+        draws.append(out)
+    rows = {c: np.flatnonzero(df[c].isna().to_numpy()) for c in draws[0]}
+    values = {c: np.vstack([d[c] for d in draws]) for c in draws[0]}
+    return Imputations(df, rows, values)
+
+
+def rubin(est: np.ndarray, var: np.ndarray, alpha: float = 0.05) -> dict:
+    # Rubin's rules over the first axis (imputations) of est and within-
+    # imputation var; t reference with the Barnard-Rubin degrees of freedom
+    # (complete-data df taken as infinite)
+    est, var = np.asarray(est, dtype=float), np.asarray(var, dtype=float)
+    m = est.shape[0]
+    q = est.mean(axis=0)
+    w = var.mean(axis=0)
+    b = est.var(axis=0, ddof=1) if m > 1 else np.zeros_like(q)
+    t = w + (1 + 1 / m) * b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        lam = (1 + 1 / m) * b / t
+        dof = np.where(lam > 0, (m - 1) / lam ** 2, np.inf)
+        se = np.sqrt(t)
+        stat = q / se
+    crit = stats.t.ppf(1 - alpha / 2, dof)
+    return {"estimate": q, "se": se, "t": stat, "p": 2 * stats.t.sf(np.abs(stat), dof), "ci_low": q - crit * se, "ci_high": q + crit * se, "df": dof, "fmi": lam}
+
+
+def pool_frames(frames: list, est: str, se: str, alpha: float = 0.05) -> pd.DataFrame:
+    # pool same-shaped per-imputation tables (coefficients, margins, ...) on
+    # their estimate/SE columns -> estimate, se, t, p, ci_low, ci_high, df, fmi
+    index = frames[0].index
+    frames = [f.reindex(index) for f in frames]
+    pooled = rubin(np.array([f[est].to_numpy(dtype=float) for f in frames]), np.array([f[se].to_numpy(dtype=float) ** 2 for f in frames]), alpha)
+    return pd.DataFrame(pooled, index=index).assign(m=len(frames))
@@ -0,0 +1,428 @@
+import argparse
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+
+# plan 0: shared ingest layer (content-addressed Parquet snapshot of the raw sheet)
+SRC_XLSX = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/Database 6.12 clean LB.xlsx"
+CACHE_DIR = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/.ingest_cache"
+MANIFEST = "manifest.json"
+SPLIT_SEP = "\x1f"
+SPLIT_KEY = b"cied_split_columns"
+# pandas' default na_values and true/false tokens, as pd.read_excel applies them
+NA_TOKENS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+BOOL_TOKENS = {"True": True, "TRUE": True, "true": True, "False": False, "FALSE": False, "false": False}
+
+
+def file_digest(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def workbook_fingerprint(path: str, digest: bool = True) -> dict:
+    st = os.stat(path)
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if digest:
+        fp["sha256"] = file_digest(path)
+    return fp
+
+
+def _load_manifest(cache_dir: str) -> dict:
+    path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(cache_dir: str, manifest: dict) -> None:
+    path = os.path.join(cache_dir, MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _snapshot_path(cache_dir: str, sha256: str) -> str:
+    return os.path.join(cache_dir, f"{sha256}.parquet")
+
+
+def _cell_kind(v) -> str:
+    if isinstance(v, bool):
+        return "bool"
+    if isinstance(v, (int, float)):
+        return "num"
+    return "str"
+
+
+def encode_sheet(df: pd.DataFrame) -> tuple:
+    # Arrow needs one type per column. Mixed object columns (e.g. 1 / "yes" / None)
+    # are split into typed parts so decode_sheet() restores the exact Python
+    # objects openpyxl produced and the downstream coercions see the same input.
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    split = {}
+    for c in list(df.columns):
+        if df[c].dtype != object:
+            continue
+        try:
+            pa.array(df[c], from_pandas=True)
+            continue
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        col = df[c]
+        kinds = col.map(lambda v: None if pd.isna(v) else _cell_kind(v))
+        present = sorted(k for k in kinds.dropna().unique() if k != "str")
+        for k in present:
+            part = col.where(kinds == k)
+            df[f"{c}{SPLIT_SEP}{k}"] = part.astype("float64") if k == "num" else part.astype("boolean")
+        df[c] = col.where(kinds == "str").map(lambda v: v if pd.isna(v) else str(v)).astype(object)
+        split[c] = present
+    return df, split
+
+
+def decode_sheet(df: pd.DataFrame, split: dict) -> pd.DataFrame:
+    for c, kinds in split.items():
+        col = df[c].astype(object).where(df[c].notna(), np.nan)
+        for k in kinds:
+            part = df.pop(f"{c}{SPLIT_SEP}{k}")
+            mask = part.notna().to_numpy()
+            if k == "num":
+                vals = [int(v) if float(v).is_integer() else float(v) for v in part[mask]]
+            else:
+                vals = [bool(v) for v in part[mask]]
+            col[mask] = pd.Series(vals, index=col.index[mask], dtype=object)
+        df[c] = col
+    return df
+
+
+def _write_snapshot(df: pd.DataFrame, path: str) -> dict:
+    encoded, split = encode_sheet(df)
+    table = pa.Table.from_pandas(encoded, preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[SPLIT_KEY] = json.dumps(split).encode()
+    tmp = path + ".tmp"
+    pq.write_table(table.replace_schema_metadata(meta), tmp)
+    os.replace(tmp, path)
+    return split
+
+
+def read_snapshot(path: str) -> pd.DataFrame:
+    table = pq.read_table(path)
+    split = json.loads((table.schema.metadata or {}).get(SPLIT_KEY, b"{}"))
+    return decode_sheet(table.to_pandas(), split)
+
+
+def _drop_snapshot(cache_dir: str, manifest: dict, sha256: str) -> None:
+    # snapshots are shared by content; keep one while any source still points at it
+    snap = _snapshot_path(cache_dir, sha256)
+    if os.path.exists(snap) and not any(e["sha256"] == sha256 for e in manifest.values()):
+        os.remove(snap)
+
+
+def invalidate(path: str = SRC_XLSX, cache_dir: str = CACHE_DIR) -> bool:
+    manifest = _load_manifest(cache_dir)
+    entry = manifest.pop(os.path.abspath(path), None)
+    if entry is None:
+        return False
+    _drop_snapshot(cache_dir, manifest, entry["sha256"])
+    _save_manifest(cache_dir, manifest)
+    return True
+
+
+def read_workbook(path: str = SRC_XLSX, cache_dir: str = CACHE_DIR, force: bool = False) -> pd.DataFrame:
+    key = os.path.abspath(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = _load_manifest(cache_dir)
+    entry = manifest.get(key)
+
+    if not force and entry is not None:
+        fp = workbook_fingerprint(path, digest=False)
+        snap = _snapshot_path(cache_dir, entry["sha256"])
+        if os.path.exists(snap):
+            if fp["size"] == entry["size"] and fp["mtime_ns"] == entry["mtime_ns"]:
+                return read_snapshot(snap)
+            # touched but possibly unchanged: the content digest decides
+            if fp["size"] == entry["size"] and file_digest(path) == entry["sha256"]:
+                entry.update(fp)
+                _save_manifest(cache_dir, manifest)
+                return read_snapshot(snap)
+
+    fp = workbook_fingerprint(path)
+    df = pd.read_excel(path, engine="openpyxl")
+    df.columns = [str(c) for c in df.columns]
+    split = _write_snapshot(df, _snapshot_path(cache_dir, fp["sha256"]))
+    manifest[key] = {**fp, "n_rows": len(df), "split_columns": sorted(split)}
+    _save_manifest(cache_dir, manifest)
+    if entry is not None and entry["sha256"] != fp["sha256"]:
+        # the workbook changed: its previous snapshot is superseded
+        _drop_snapshot(cache_dir, manifest, entry["sha256"])
+    return df
+
+
+# plan 0c: per-row fingerprints over the raw inputs of build_features
+def _typed_token(v) -> str:
+    # object cells hash with their Python type: to_bin treats 1 and "1" differently
+    return "" if pd.isna(v) else f"{type(v).__name__}:{v}"
+
+
+def row_fingerprints(df: pd.DataFrame, cols: list) -> pd.Series:
+    present = [c for c in cols if c in df.columns]
+    frame = df[present].copy()
+    for c in present:
+        if frame[c].dtype == object:
+            frame[c] = frame[c].map(_typed_token)
+    return pd.util.hash_pandas_object(frame, index=False).rename("row_hash")
+
+
+def column_signature(df: pd.DataFrame, cols: list) -> dict:
+    # column-level coercions (e.g. to_bin on an object column) depend on the dtype of
+    # the whole column, so any dtype change invalidates every cached row
+    return {c: str(df[c].dtype) if c in df.columns else None for c in cols}
+
+
+# plan 0b: streaming ingest (openpyxl read-only row blocks -> partitioned Parquet dataset)
+def _convert_cell(cell):
+    # mirrors pandas' openpyxl reader so blocks parse like pd.read_excel
+    if cell.value is None:
+        return ""
+    if cell.data_type == "e":
+        return np.nan
+    if cell.data_type == "n":
+        val = int(cell.value)
+        if val == cell.value:
+            return val
+        return float(cell.value)
+    return cell.value
+
+
+def _sheet_rows(path: str):
+    wb = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = wb.worksheets[0]
+        sheet.reset_dimensions()
+        for row in sheet.rows:
+            converted = [_convert_cell(cell) for cell in row]
+            while converted and converted[-1] == "":
+                converted.pop()
+            yield converted
+    finally:
+        wb.close()
+
+
+def _value_kind(v) -> str:
+    if isinstance(v, str):
+        if v in NA_TOKENS:
+            return "na"
+        for kind, cast in (("intstr", int), ("floatstr", float)):
+            try:
+                cast(v)
+                return kind
+            except ValueError:
+                pass
+        return "str"
+    if isinstance(v, float) and np.isnan(v):
+        return "na"
+    return type(v).__name__
+
+
+def _header_names(header: list) -> list:
+    # pandas' header handling: blanks become "Unnamed: i", later duplicates get
+    # .1, .2 ... skipping names already taken; named columns are mangled first
+    names = [f"Unnamed: {i}" if c == "" else c for i, c in enumerate(header)]
+    unnamed = [i for i, c in enumerate(header) if c == ""]
+    counts = defaultdict(int)
+    for i in [i for i in range(len(names)) if i not in unnamed] + unnamed:
+        col = old = names[i]
+        cur = counts[col]
+        while cur > 0:
+            counts[old] = cur + 1
+            col = f"{old}.{cur}"
+            cur = cur + 1 if col in names else counts[col]
+        names[i] = col
+        counts[col] = cur + 1
+    return names
+
+
+def _sanitize(col: np.ndarray) -> np.ndarray:
+    # NA tokens -> NaN; equal cells collapse onto the first one seen, as in
+    # pandas (so a 0 after a False reads back as False)
+    memo = {}
+    for i, v in enumerate(col):
+        col[i] = np.nan if isinstance(v, str) and v in NA_TOKENS else memo.setdefault(v, v)
+    return col
+
+
+def _infer_column(col: np.ndarray):
+    # numeric, then bool, else object -- the order pd.read_excel tries them in
+    col = col.copy()
+    for i, v in enumerate(col):
+        if isinstance(v, str) and v in NA_TOKENS:
+            col[i] = np.nan
+    try:
+        return pd.to_numeric(col)
+    except (ValueError, TypeError):
+        pass
+    col = _sanitize(col)
+    if not all(isinstance(v, bool) or (isinstance(v, str) and v in BOOL_TOKENS) or pd.isna(v) for v in col):
+        return col
+    out = np.array([v if isinstance(v, bool) else BOOL_TOKENS.get(v, np.nan) for v in col], dtype=object)
+    return out if pd.isna(out).any() else out.astype(bool)
+
+
+def parse_rows(rows: list, names: list, as_object=()) -> pd.DataFrame:
+    # pd.read_excel's cell parsing for rows already converted by _convert_cell;
+    # columns in as_object skip inference, like dtype=object
+    data = np.empty((len(rows), len(names)), dtype=object)
+    for i, row in enumerate(rows):
+        data[i, :] = row
+    cols = {}
+    for j, name in enumerate(names):
+        if name in as_object:
+            cols[name] = pd.Series(_sanitize(data[:, j].copy()), dtype=object)
+        else:
+            cols[name] = _infer_column(data[:, j])
+    return pd.DataFrame(cols)
+
+
+def scan_workbook(path: str) -> dict:
+    # pass 1: bounded-memory scan for the sheet shape plus one representative
+    # value per kind and column, enough to reproduce whole-sheet dtype inference
+    header, width, last_data = None, 0, -1
+    min_len, blank_pending, inner_blank = None, False, False
+    samples = {}
+    for i, row in enumerate(_sheet_rows(path)):
+        width = max(width, len(row))
+        if i == 0:
+            header = row
+            continue
+        if not row:
+            blank_pending = True
+            continue
+        inner_blank = inner_blank or blank_pending
+        blank_pending = False
+        last_data = i
+        min_len = len(row) if min_len is None else min(min_len, len(row))
+        for j, v in enumerate(row):
+            samples.setdefault(j, {}).setdefault(_value_kind(v), v)
+    header = (header or []) + [""] * (width - len(header or []))
+    names = _header_names(header)
+    dtypes = {}
+    for j, name in enumerate(names):
+        reps = list(samples.get(j, {}).values())
+        if inner_blank or min_len is None or j >= min_len:
+            # short rows are padded with "" just like pandas does
+            reps.append("")
+        dtypes[name] = parse_rows([[v] for v in reps], [name])[name].dtype
+    return {"names": names, "dtypes": dtypes, "n_rows": max(last_data, 0), "width": width}
+
+
+def iter_workbook_chunks(path: str, chunksize: int = 2000, scan: dict = None):
+    scan = scan or scan_workbook(path)
+    names, dtypes, width = scan["names"], scan["dtypes"], scan["width"]
+    obj_cols = {c: object for c, t in dtypes.items() if t == object}
+    block, start = [], 0
+
+    def parse(rows: list, start: int) -> pd.DataFrame:
+        rows = [r + [""] * (width - len(r)) for r in rows]
+        chunk = parse_rows(rows, names, as_object=obj_cols)
+        for c, t in dtypes.items():
+            if t != object and chunk[c].dtype != t:
+                chunk[c] = chunk[c].astype(t)
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        return chunk
+
+    for i, row in enumerate(_sheet_rows(path)):
+        if i == 0:
+            continue
+        if i > scan["n_rows"]:
+            break
+        block.append(row)
+        if len(block) >= chunksize:
+            yield parse(block, start)
+            start += len(block)
+            block = []
+    if block:
+        yield parse(block, start)
+
+
+def arrow_frame(df: pd.DataFrame) -> pa.Table:
+    # one Arrow type per column; mixed object columns are written as text
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype != object:
+            continue
+        try:
+            pa.array(df[c], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[c] = df[c].map(lambda v: v if pd.isna(v) else str(v)).astype(object)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _widen(types: list) -> pa.DataType:
+    types = {t for t in types if not pa.types.is_null(t)}
+    if not types:
+        return pa.null()
+    if len(types) == 1:
+        return types.pop()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return pa.string()
+
+
+def write_dataset(chunks, out_dir: str, transform=None) -> pa.Schema:
+    os.makedirs(out_dir, exist_ok=True)
+    for f in os.listdir(out_dir):
+        if f.startswith("part-") and f.endswith(".parquet"):
+            os.remove(os.path.join(out_dir, f))
+    parts, schemas = [], []
+    for k, chunk in enumerate(chunks):
+        if transform is not None:
+            chunk = transform(chunk)
+        table = arrow_frame(chunk)
+        path = os.path.join(out_dir, f"part-{k:05d}.parquet")
+        pq.write_table(table, path)
+        parts.append(path)
+        schemas.append(table.schema)
+    if not schemas:
+        return pa.schema([])
+    # per-chunk inference can disagree (int vs float, all-null vs text);
+    # rewrite only the parts that differ from the widened common schema
+    names = schemas[0].names
+    common = pa.schema([(n, _widen([s.field(n).type for s in schemas])) for n in names])
+    for path, schema in zip(parts, schemas):
+        if not schema.remove_metadata().equals(common):
+            table = pq.read_table(path).select(names)
+            pq.write_table(table.cast(common), path)
+    return common
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Snapshot the source workbook into the ingest cache.")
+    parser.add_argument("--src", default=SRC_XLSX)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--force-reingest", action="store_true", help="ignore any cached snapshot and re-parse the workbook")
+    parser.add_argument("--invalidate", action="store_true", help="drop the cached snapshot for --src and exit")
+    args = parser.parse_args()
+    if args.invalidate:
+        print("invalidated" if invalidate(args.src, args.cache_dir) else "no cached snapshot")
+        return
+    df = read_workbook(args.src, args.cache_dir, force=args.force_reingest)
+    print(f"{len(df)} rows x {df.shape[1]} columns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+import patsy
+
+from glm import MAXITER, batched_solve, gram, irls_logit
+from grid import run_grid
+from loader import formula_columns
+from modeling import ModelFrames
+
+# plan 3.5: inverse-probability / overlap weighting for the three-level device
+# treatment. Propensities come from a multinomial logit; each column of a
+# frequency-weight matrix (bootstrap counts) is one batched fit, so bootstrap
+# replicates re-estimate the propensity model without a Python-level loop.
+
+ESTIMANDS = ("ate", "overlap")
+BLOCK = 64
+CLIP = 1e-8
+
+# per-process memo {spec: (frame, design)}, hit only for the very same frame
+_DESIGNS = {}
+
+
+def _expit(eta: np.ndarray) -> np.ndarray:
+    return 0.5 * (1 + np.tanh(0.5 * eta))
+
+
+def _softmax(eta: np.ndarray) -> np.ndarray:
+    # (..., n, J) linear predictors of the non-reference levels -> (..., n, J + 1)
+    full = np.concatenate([np.zeros(eta.shape[:-1] + (1,)), eta], axis=-1)
+    full = np.exp(full - full.max(axis=-1, keepdims=True))
+    return full / full.sum(axis=-1, keepdims=True)
+
+
+def multinomial_logit(X: np.ndarray, T: np.ndarray, n_levels: int, weights: np.ndarray = None, maxiter: int = MAXITER, tol: float = 1e-8) -> tuple:
+    # Newton-Raphson for a multinomial logit (level 0 = reference), batched
+    # over the B columns of the n x B frequency-weight matrix
+    # -> (params (B, p, J), n_iter, converged)
+    n, p = X.shape
+    J = n_levels - 1
+    W = np.ones((n, 1)) if weights is None else np.asarray(weights, dtype=float).reshape(n, -1)
+    B = W.shape[1]
+    Yd = (T[:, None] == np.arange(1, n_levels)[None, :]).astype(float)
+    params = np.zeros((B, p, J))
+    ll = np.full(B, -np.inf)
+    converged = np.zeros(B, dtype=bool)
+    n_iter = 0
+    for n_iter in range(1, maxiter + 1):
+        P = _softmax(X @ params)[..., 1:]
+        R = W.T[:, :, None] * (Yd[None] - P)
+        grad = X.T @ R
+        H = np.empty((B, J, p, J, p))
+        for j in range(J):
+            for k in range(j, J):
+                w = W * (P[..., j] * ((j == k) - P[..., k])).T
+                H[:, j, :, k, :] = gram(w, X)
+                H[:, k, :, j, :] = H[:, j, :, k, :].transpose(0, 2, 1)
+        step = batched_solve(H.reshape(B, J * p, J * p), grad.transpose(0, 2, 1).reshape(B, J * p))
+        params = params + step.reshape(B, J, p).transpose(0, 2, 1)
+        P = _softmax(X @ params)
+        T_prob = np.take_along_axis(P, np.broadcast_to(T[None, :, None], (B, n, 1)), axis=-1)[..., 0]
+        new_ll = (W.T * np.log(np.clip(T_prob, CLIP, 1))).sum(axis=1)
+        converged = np.abs(new_ll - ll) <= tol * (1 + np.abs(new_ll))
+        ll = new_ll
+        if converged.all():
+            break
+    return params, n_iter, converged
+
+
+def balancing_weights(E: np.ndarray, T: np.ndarray, estimand: str = "ate") -> np.ndarray:
+    # E: (B, n, G) propensities -> (n, B) weights for the observed levels.
+    #   ate:     1 / e_T(x)
+    #   overlap: h(x) / e_T(x) with h(x) = 1 / sum_g 1 / e_g(x) (generalized
+    #            overlap weights, Li & Li 2019)
+    E = np.clip(E, CLIP, 1)
+    e_t = np.take_along_axis(E, np.broadcast_to(T[None, :, None], E.shape[:2] + (1,)), axis=-1)[..., 0]
+    w = 1 / e_t
+    if estimand == "overlap":
+        w = w / (1 / E).sum(axis=-1)
+    elif estimand != "ate":
+        raise ValueError(f"unknown estimand {estimand!r}; expected one of {ESTIMANDS}")
+    return w.T
+
+
+def smd_table(C: np.ndarray, names: list, T: np.ndarray, levels: list, weights: np.ndarray = None) -> pd.DataFrame:
+    # standardized mean differences for every covariate column of C (NaN =
+    # missing) and every pair of levels; the denominator is the unweighted
+    # pooled SD so weighted and unweighted SMDs are on the same scale
+    obs = ~np.isnan(C)
+    Cz = np.where(obs, C, 0.0)
+    w = np.ones(len(T)) if weights is None else weights
+    mean, var, wmean = {}, {}, {}
+    for g in range(len(levels)):
+        D = (T == g)[:, None] & obs
+        n = D.sum(axis=0)
+        mean[g] = (D * Cz).sum(axis=0) / n
+        var[g] = (D * (Cz - mean[g]) ** 2).sum(axis=0) / np.maximum(n - 1, 1)
+        Dw = D * w[:, None]
+        wmean[g] = (Dw * Cz).sum(axis=0) / Dw.sum(axis=0)
+    rows = []
+    for a in range(len(levels)):
+        for b in range(a + 1, len(levels)):
+            sd = np.sqrt((var[a] + var[b]) / 2)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                raw = (mean[b] - mean[a]) / sd
+                adj = (wmean[b] - wmean[a]) / sd
+            contrast = f"{levels[b]} vs {levels[a]}"
+            rows += [{"variable": v, "contrast": contrast, "smd_unweighted": r, "smd_weighted": s} for v, r, s in zip(names, raw, adj)]
+    return pd.DataFrame(rows)
+
+
+class IPWDesign:
+    # propensity design (rows complete on the propensity covariates and the
+    # treatment), saturated device design for the weighted outcome models, and
+    # the balance covariates, all built once
+
+    def __init__(self, df: pd.DataFrame, ps_rhs: str, outcomes: list, treatment: str = "device_cat", reference: str = "PPM", balance_cols: list = None):
+        ps_rhs = ps_rhs.split("~", 1)[1] if "~" in ps_rhs else ps_rhs
+        x_cols = formula_columns("~" + ps_rhs)
+        keep = ModelFrames(df).mask(x_cols + [treatment])
+        balance_cols = [c for c in (balance_cols or []) if c in df.columns]
+        frame = df.loc[keep, list(dict.fromkeys(x_cols + [treatment] + list(outcomes) + balance_cols))]
+        self.X = patsy.dmatrix(ps_rhs, frame[x_cols], return_type="dataframe", NA_action="raise").to_numpy(dtype=float)
+        found = [str(v) for v in pd.unique(frame[treatment])]
+        self.levels = [reference] + sorted(v for v in found if v != reference)
+        self.T = pd.Categorical(frame[treatment].astype(str), categories=self.levels).codes.astype(int)
+        self.D = np.column_stack([np.ones(len(self.T))] + [(self.T == g).astype(float) for g in range(1, len(self.levels))])
+        Y = frame[outcomes]
+        self.mask = Y.notna().to_numpy()
+        self.Y = Y.to_numpy(dtype=float, na_value=0.0)
+        self.outcomes = list(outcomes)
+        self.balance_cols = balance_cols
+        self.C = frame[balance_cols].to_numpy(dtype=float) if balance_cols else np.empty((len(frame), 0))
+        self._unit = None
+
+    @property
+    def n(self) -> int:
+        return len(self.T)
+
+    def weights(self, W: np.ndarray) -> dict:
+        # {estimand: (n, B) balancing weights} from the propensity fits on W
+        params, _, converged = multinomial_logit(self.X, self.T, len(self.levels), W)
+        if not converged.all():
+            print(f"Propensity model did not converge in {(~converged).sum()} of {len(converged)} fits")
+        E = _softmax(self.X @ params)
+        return {e: balancing_weights(E, self.T, e) for e in ESTIMANDS}
+
+    def unit_weights(self) -> dict:
+        # full-sample weights (W = 1), fitted once and shared by the point
+        # estimates, balance() and weight_summary()
+        if self._unit is None:
+            self._unit = self.weights(np.ones((self.n, 1)))
+        return self._unit
+
+    def effects(self, W: np.ndarray, weights: dict = None) -> dict:
+        # {estimand: (B, K, G + G - 1 + G - 1)} weighted risks per level, then
+        # risk differences and log odds ratios vs the reference, from the
+        # weighted saturated logit outcome ~ C(treatment); weights defaults to
+        # a propensity refit on W
+        B, K, G = W.shape[1], len(self.outcomes), len(self.levels)
+        out = {}
+        for e, w in (weights or self.weights(W)).items():
+            fw = np.repeat(W * w, K, axis=1)
+            params, _, _ = irls_logit(self.D, np.tile(self.Y, B), np.tile(self.mask, B), weights=fw)
+            params = params.T.reshape(B, K, G)
+            eta = np.concatenate([params[..., :1], params[..., :1] + params[..., 1:]], axis=-1)
+            risk = _expit(eta)
+            out[e] = np.concatenate([risk, risk[..., 1:] - risk[..., :1], params[..., 1:]], axis=-1)
+        return out
+
+    @property
+    def effect_names(self) -> list:
+        ref = self.levels[0]
+        return ([("risk", g) for g in self.levels] + [("risk_difference", f"{g} vs {ref}") for g in self.levels[1:]]
+                + [("log_odds_ratio", f"{g} vs {ref}") for g in self.levels[1:]])
+
+    def balance(self) -> pd.DataFrame:
+        w = self.unit_weights()
+        tables = [smd_table(self.C, self.balance_cols, self.T, self.levels, w[e][:, 0]).assign(estimand=e) for e in ESTIMANDS]
+        return pd.concat(tables, ignore_index=True)
+
+    def weight_summary(self) -> pd.DataFrame:
+        # effective sample size (Kish) and largest normalized weight per level
+        rows = []
+        for e, w in self.unit_weights().items():
+            w = w[:, 0]
+            for g, level in enumerate(self.levels):
+                wg = w[self.T == g]
+                rows.append({"estimand": e, "device_cat": level, "n": len(wg), "ess": wg.sum() ** 2 / (wg ** 2).sum(), "max_weight_share": wg.max() / wg.sum()})
+        return pd.DataFrame(rows)
+
+
+def design(df: pd.DataFrame, spec: dict) -> IPWDesign:
+    key = repr(sorted(spec.items()))
+    entry = _DESIGNS.get(key)
+    if entry is None or entry[0] is not df:
+        _DESIGNS.clear()
+        entry = _DESIGNS[key] = (df, IPWDesign(df, **spec))
+    return entry[1]
+
+
+def bootstrap_block(df: pd.DataFrame, cell: tuple) -> dict:
+    # one block of replicates with its own RNG stream: cell = (spec, seed, k)
+    spec, seed, k = cell
+    d = design(df, spec)
+    W = np.random.default_rng(seed).multinomial(d.n, np.full(d.n, 1.0 / d.n), size=k).T.astype(float)
+    return d.effects(W)
+
+
+def ipw_effects(df: pd.DataFrame, spec: dict, n_boot: int = 0, seed: int = 0, workers: int = None, alpha: float = 0.05) -> pd.DataFrame:
+    # point estimates for every estimand x outcome x effect, with bootstrap SE
+    # and percentile bounds when n_boot > 0 (identical for any worker count)
+    d = design(df, spec)
+    point = d.effects(np.ones((d.n, 1)), d.unit_weights())
+    boot = {e: [] for e in ESTIMANDS}
+    if n_boot > 0:
+        sizes = [min(BLOCK, n_boot - lo) for lo in range(0, n_boot, BLOCK)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        for (_, _, k), out, err in run_grid(df, [(spec, s, k) for s, k in zip(seeds, sizes)], bootstrap_block, workers=workers):
+            if err is not None:
+                print(f"Bootstrap block of {k} replicates failed: {err}")
+                continue
+            for e in ESTIMANDS:
+                boot[e].append(out[e])
+        ran = sum(len(b) for b in boot[ESTIMANDS[0]])
+        if ran == 0:
+            raise RuntimeError(f"All {len(sizes)} bootstrap blocks failed; 0 of {n_boot} replicates ran")
+        if ran < n_boot:
+            print(f"Bootstrap ran {ran} of {n_boot} replicates")
+    rows = []
+    for e in ESTIMANDS:
+        draws = np.concatenate(boot[e], axis=0) if boot[e] else None
+        for k, outcome in enumerate(d.outcomes):
+            for j, (effect, contrast) in enumerate(d.effect_names):
+                row = {"estimand": e, "outcome": outcome, "effect": effect, "contrast": contrast, "estimate": point[e][0, k, j]}
+                if draws is not None:
+                    x = draws[:, k, j]
+                    row.update(se=np.nanstd(x, ddof=1), ci_low=np.nanquantile(x, alpha / 2), ci_high=np.nanquantile(x, 1 - alpha / 2), n_boot=int(np.isfinite(x).sum()))
+                rows.append(row)
+    return pd.DataFrame(rows)
@@ -0,0 +1,124 @@
+import ast
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from patsy import ModelDesc
+
+from schema import clean_dtypes
+
+# plan 6.2: one loader for the clean dataset (column projection + filter pushdown)
+IN_PARQUET = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/clean.parquet"
+IN_CSV = "/workspace/clean.csv"
+
+_OPS = {
+    "==": lambda s, v: s == v,
+    "=": lambda s, v: s == v,
+    "!=": lambda s, v: s != v,
+    "<": lambda s, v: s < v,
+    "<=": lambda s, v: s <= v,
+    ">": lambda s, v: s > v,
+    ">=": lambda s, v: s >= v,
+    "in": lambda s, v: s.isin(v),
+    "not in": lambda s, v: ~s.isin(v),
+}
+
+
+def formula_columns(formula, lhs: bool = True, rhs: bool = True) -> list:
+    # data columns referenced by one or more patsy formulas, in first-seen order
+    formulas = [formula] if isinstance(formula, str) else list(formula)
+    cols = []
+    for f in formulas:
+        desc = ModelDesc.from_formula(f)
+        for term in (desc.lhs_termlist if lhs else []) + (desc.rhs_termlist if rhs else []):
+            for factor in term.factors:
+                cols += [c for c in code_columns(factor.code) if c not in cols]
+    return cols
+
+
+def code_columns(code: str) -> list:
+    # bare names in a factor expression, excluding called functions (C, np.log, ...)
+    tree = ast.parse(code, mode="eval")
+    called = set()
+    for n in ast.walk(tree):
+        if isinstance(n, ast.Call):
+            func = n.func
+            while isinstance(func, ast.Attribute):
+                func = func.value
+            called.add(id(func))
+    names = [n.id for n in ast.walk(tree) if isinstance(n, ast.Name) and id(n) not in called]
+    return list(dict.fromkeys(names))
+
+
+def _resolve_columns(columns, formula, available: list) -> list:
+    if columns is None and formula is None:
+        return None
+    wanted = list(columns or [])
+    if formula is not None:
+        wanted += formula_columns(formula)
+    # absent columns (e.g. an optional metric) are skipped; callers check df.columns
+    return [c for c in dict.fromkeys(wanted) if c in available]
+
+
+def _apply_filters(df: pd.DataFrame, filters) -> pd.DataFrame:
+    if not filters:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for col, op, value in filters:
+        mask &= _OPS[op](df[col], value).fillna(False).to_numpy(dtype=bool)
+    return df.loc[mask].reset_index(drop=True)
+
+
+def save_csv(df: pd.DataFrame, path: str = IN_CSV) -> None:
+    # CSV export plus a dtype sidecar so the fallback path never infers types
+    df.to_csv(path, index=False)
+    save_csv_dtypes(df.dtypes, path)
+
+
+def save_csv_dtypes(dtypes: pd.Series, path: str = IN_CSV) -> None:
+    spec = {}
+    for c, t in dtypes.items():
+        if isinstance(t, pd.CategoricalDtype):
+            spec[c] = {"category": [str(x) for x in t.categories]}
+        else:
+            spec[c] = str(t)
+    with open(path + ".dtypes.json", "w") as f:
+        json.dump(spec, f, indent=1)
+
+
+def csv_dtypes(path: str = IN_CSV) -> dict:
+    sidecar = path + ".dtypes.json"
+    if not os.path.exists(sidecar):
+        return clean_dtypes()
+    with open(sidecar) as f:
+        spec = json.load(f)
+    return {c: pd.CategoricalDtype(t["category"]) if isinstance(t, dict) else t for c, t in spec.items()}
+
+
+def load_clean(
+    columns: list = None,
+    formula=None,
+    filters: list = None,
+    memory_map: bool = False,
+    parquet: str = IN_PARQUET,
+    csv: str = IN_CSV,
+) -> pd.DataFrame:
+    # filters: [(column, op, value), ...] ANDed together, e.g. [("device_cat", "==", "CRT")]
+    if os.path.exists(parquet):
+        available = pq.read_schema(parquet).names
+        cols = _resolve_columns(columns, formula, available)
+        table = pq.read_table(parquet, columns=cols, filters=filters or None, memory_map=memory_map)
+        return table.to_pandas()
+
+    dtypes = csv_dtypes(csv)
+    available = list(pd.read_csv(csv, nrows=0).columns)
+    cols = _resolve_columns(columns, formula, available)
+    filter_cols = [f[0] for f in filters or []]
+    usecols = None if cols is None else list(dict.fromkeys(cols + filter_cols))
+    dates = [c for c, t in dtypes.items() if str(t).startswith("datetime64") and (usecols is None or c in usecols)]
+    dtypes = {c: t for c, t in dtypes.items() if c not in dates}
+    df = pd.read_csv(csv, usecols=usecols, dtype=dtypes, parse_dates=dates)
+    df = _apply_filters(df, filters)
+    return df if cols is None else df[cols]
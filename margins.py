@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from counterfactual import Counterfactual, delta_se, design_info
+from loader import code_columns, formula_columns
+
+# plan 3.2c: analytic average marginal effects from the formula's design info
+# (derivatives for continuous variables, contrasts for binary/categorical ones,
+# interactions included, delta-method SEs from the fitted covariance or the
+# one passed in, e.g. glm.logit_cov(res, "HC3"))
+
+# same layout as statsmodels' get_margeff().summary_frame()
+COLUMNS = ["dy/dx", "Std. Err.", "z", "Pr(>|z|)", "Conf. Int. Low", "Cont. Int. Hi."]
+
+# relative step for the derivative of transformed terms (exact for linear ones)
+STEP = 1e-5
+
+
+def variable_kind(res, data: pd.DataFrame, var: str):
+    # ("categorical", levels) | ("binary", [0, 1]) | ("continuous", None)
+    di = design_info(res)
+    for factor, info in di.factor_infos.items():
+        if info.type == "categorical" and var in code_columns(factor.code):
+            return "categorical", list(info.categories)
+    values = pd.unique(data[var].dropna())
+    if len(values) <= 2 and set(np.asarray(values, dtype=float)) <= {0.0, 1.0}:
+        return "binary", [0.0, 1.0]
+    return "continuous", None
+
+
+def _continuous(cf: Counterfactual, var: str):
+    x = cf.data[[var]].astype(float)
+    h = STEP * (1 + x[var].abs().to_numpy())
+    D = (cf.grid_columns(x + h[:, None]) - cf.grid_columns(x - h[:, None])) / (2 * h[:, None])
+    DR = D * cf.R
+    eta = cf.exog @ cf.params
+    slope = DR @ cf.params[cf.var_idx]
+    mu1 = cf.link.inverse_deriv(eta)
+    mu2 = cf.link.inverse_deriv2(eta)
+    n = len(eta)
+    grad = (mu2 * slope) @ cf.exog / n
+    grad[cf.var_idx] += mu1 @ DR / n
+    return np.array([np.mean(mu1 * slope)]), grad[None, :], [var]
+
+
+def _discrete(cf: Counterfactual, var: str, levels: list, categorical: bool):
+    mean, grad = cf.mean_and_grad(pd.DataFrame({var: levels}))
+    names = [f"{var}[T.{lv}]" for lv in levels[1:]] if categorical else [var]
+    return mean[1:] - mean[0], grad[1:] - grad[0], names
+
+
+def average_marginal_effects(res, data: pd.DataFrame, variables: list = None, alpha: float = 0.05, cov: np.ndarray = None) -> pd.DataFrame:
+    # data: the estimation frame (e.g. fit_glm's `used`); variables default to
+    # every right-hand-side variable of the model formula
+    if variables is None:
+        variables = formula_columns(res.model.formula, lhs=False)
+    effects, grads, names = [], [], []
+    for var in variables:
+        kind, levels = variable_kind(res, data, var)
+        cf = Counterfactual(res, data, [var])
+        if kind == "continuous":
+            eff, grad, labels = _continuous(cf, var)
+        else:
+            eff, grad, labels = _discrete(cf, var, levels, kind == "categorical")
+        effects.append(eff)
+        grads.append(grad)
+        names += labels
+    effects = np.concatenate(effects)
+    se = delta_se(np.vstack(grads), np.asarray(res.cov_params() if cov is None else cov))
+    z = effects / se
+    crit = stats.norm.ppf(1 - alpha / 2)
+    table = np.column_stack([effects, se, z, 2 * stats.norm.sf(np.abs(z)), effects - crit * se, effects + crit * se])
+    return pd.DataFrame(table, index=names, columns=COLUMNS)
@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import stats
+
+from glm import batched_solve, gram, irls_logit
+from grid import run_grid
+from loader import formula_columns
+
+# plan 3.3b: g-formula mediation on cached design matrices (point estimates,
+# bootstrap replicates as batched weighted fits, quasi-Bayesian simulation)
+
+QUANTITIES = ["ACME", "ADE", "Total", "PropMediated"]
+CONTRASTS = [("ICD", "PPM"), ("CRT", "PPM")]
+ALL_CONTRASTS = [("ICD", "PPM"), ("CRT", "PPM"), ("CRT", "ICD")]
+BLOCK = 64
+JACKKNIFE_GROUPS = 200
+SIM_CHUNK = 256
+
+# per-process memo {spec: (frame, design)} so grid workers build each design
+# once; the frame is kept and matched by identity, since the id of a freed
+# frame (e.g. an earlier imputation) can be reused by the next one
+_DESIGNS = {}
+
+
+def _expit(eta: np.ndarray) -> np.ndarray:
+    return 0.5 * (1 + np.tanh(0.5 * eta))
+
+
+def _set(frame: pd.DataFrame, col: str, value) -> pd.DataFrame:
+    # frame with one column set to a constant, keeping a categorical dtype
+    out = frame.copy(deep=False)
+    if isinstance(frame[col].dtype, pd.CategoricalDtype):
+        out[col] = pd.Categorical.from_codes(np.full(len(frame), frame[col].cat.categories.get_loc(value)), dtype=frame[col].dtype)
+    else:
+        out[col] = value
+    return out
+
+
+class MediationDesign:
+    # Design matrices for the mediator (OLS) and outcome (logit) models, built
+    # once over every row of the frame. Rows incomplete for a model are filled
+    # with an observed value and carried with zero weight, so the samples match
+    # the per-model complete cases of a plain statsmodels fit:
+    #   mediator fit: mediator, outcome and mediator covariates observed
+    #   outcome fit:  mediator, outcome and outcome covariates observed
+    #   averaging:    both covariate sets observed
+    # Counterfactual outcome rows are affine in the mediator, X(a, m) = X0_a + m D_a.
+
+    def __init__(self, df: pd.DataFrame, mediator: str, outcome: str, m_formula: str, y_formula: str, device_col: str = "device_cat", contrasts: list = CONTRASTS):
+        m_cols = formula_columns(m_formula, lhs=False)
+        y_cols = [c for c in formula_columns(y_formula, lhs=False) if c != mediator]
+        cols = list(dict.fromkeys([mediator, outcome, device_col] + m_cols + y_cols))
+        frame = df[cols]
+        cm = frame[m_cols].notna().all(axis=1).to_numpy()
+        cy = frame[y_cols].notna().all(axis=1).to_numpy()
+        obs = frame[[mediator, outcome]].notna().all(axis=1).to_numpy()
+        self.fit_m = (obs & cm).astype(float)
+        self.fit_y = (obs & cy).astype(float)
+        self.pop = (cm & cy).astype(float)
+
+        filled = frame.copy()
+        for c in cols:
+            if filled[c].isna().any():
+                filled[c] = filled[c].fillna(filled[c].dropna().iloc[0])
+        self.m = filled[mediator].to_numpy(dtype=float)
+        self.y = filled[outcome].to_numpy(dtype=float)
+
+        m_rhs = m_formula.split("~", 1)[1]
+        y_rhs = y_formula.split("~", 1)[1]
+        Xm = patsy.dmatrix(m_rhs, filled, return_type="dataframe")
+        Xy = patsy.dmatrix(y_rhs, filled, return_type="dataframe")
+        self.m_names, self.y_names = list(Xm.columns), list(Xy.columns)
+        self.Xm = Xm.to_numpy(dtype=float)
+        self.Xy = Xy.to_numpy(dtype=float)
+
+        devices = list(dict.fromkeys(d for pair in contrasts for d in pair))
+        self.contrasts = list(contrasts)
+        self.Xm_a, self.Xy0_a, self.Dy_a = {}, {}, {}
+        for a in devices:
+            fa = _set(filled, device_col, a)
+            self.Xm_a[a] = np.asarray(patsy.build_design_matrices([Xm.design_info], fa)[0])
+            X0, X1, X2 = (np.asarray(patsy.build_design_matrices([Xy.design_info], _set(fa, mediator, v))[0]) for v in (0.0, 1.0, 2.0))
+            if not np.allclose(X2 - X0, 2 * (X1 - X0)):
+                raise NotImplementedError(f"{mediator} does not enter the outcome model linearly")
+            self.Xy0_a[a], self.Dy_a[a] = X0, X1 - X0
+        self._point = None
+
+    @property
+    def n(self) -> int:
+        return len(self.y)
+
+    def fit(self, W: np.ndarray, start: np.ndarray = None) -> tuple:
+        # mediator OLS and outcome logit for every column of the n x K
+        # frequency-weight matrix W -> (pm x K, py x K)
+        wm = W * self.fit_m[:, None]
+        Bm = batched_solve(gram(wm, self.Xm), (self.Xm.T @ (wm * self.m[:, None])).T).T
+        K = W.shape[1]
+        start = None if start is None else np.repeat(np.reshape(start, (-1, 1)), K, axis=1)
+        By, _, _ = irls_logit(self.Xy, np.repeat(self.y[:, None], K, axis=1), start=start, weights=W * self.fit_y[:, None])
+        return Bm, By
+
+    def effects(self, Bm: np.ndarray, By: np.ndarray, W: np.ndarray) -> np.ndarray:
+        # (n_contrasts, 4 quantities, K) g-formula effects for K coefficient
+        # columns, averaged over the population rows with weights W (n x K, or
+        # n x 1 shared by every column)
+        wp = W * self.pop[:, None]
+        wp = wp / wp.sum(axis=0)
+        out = np.empty((len(self.contrasts), len(QUANTITIES), By.shape[1]))
+        for i, (a1, a0) in enumerate(self.contrasts):
+            m1 = self.Xm_a[a1] @ Bm
+            m0 = self.Xm_a[a0] @ Bm
+            base1, slope1 = self.Xy0_a[a1] @ By, self.Dy_a[a1] @ By
+            base0, slope0 = self.Xy0_a[a0] @ By, self.Dy_a[a0] @ By
+            y11 = _expit(base1 + m1 * slope1)
+            y10 = _expit(base1 + m0 * slope1)
+            y00 = _expit(base0 + m0 * slope0)
+            acme = (wp * (y11 - y10)).sum(axis=0)
+            ade = (wp * (y10 - y00)).sum(axis=0)
+            total = (wp * (y11 - y00)).sum(axis=0)
+            out[i] = [acme, ade, total, np.where(total != 0, acme / np.where(total != 0, total, 1), np.nan)]
+        return out
+
+    def point(self) -> tuple:
+        # full-sample effects and the outcome params (warm start for replicates)
+        if self._point is None:
+            W = np.ones((self.n, 1))
+            Bm, By = self.fit(W)
+            self._point = self.effects(Bm, By, W)[..., 0], By[:, 0]
+        return self._point
+
+
+def design(df: pd.DataFrame, spec: dict) -> MediationDesign:
+    key = repr(sorted(spec.items()))
+    entry = _DESIGNS.get(key)
+    if entry is None or entry[0] is not df:
+        _DESIGNS.clear()
+        entry = _DESIGNS[key] = (df, MediationDesign(df, **spec))
+    return entry[1]
+
+
+def bootstrap_block(df: pd.DataFrame, cell: tuple) -> np.ndarray:
+    # one block of replicates with its own RNG stream: cell = (spec, seed, k)
+    # -> (n_contrasts, 4, k)
+    spec, seed, k = cell
+    d = design(df, spec)
+    rng = np.random.default_rng(seed)
+    W = rng.multinomial(d.n, np.full(d.n, 1.0 / d.n), size=k).T.astype(float)
+    _, start = d.point()
+    Bm, By = d.fit(W, start=start)
+    return d.effects(Bm, By, W)
+
+
+def jackknife(d: MediationDesign, groups: int = JACKKNIFE_GROUPS, seed: int = 0, start: np.ndarray = None) -> np.ndarray:
+    # delete-a-group jackknife (leave-one-out when n <= groups), batched like
+    # the bootstrap; -> (n_contrasts, 4, G)
+    G = min(groups, d.n)
+    labels = np.random.default_rng(seed).permutation(d.n) % G
+    out = []
+    for lo in range(0, G, BLOCK):
+        g = np.arange(lo, min(lo + BLOCK, G))
+        W = (labels[:, None] != g[None, :]).astype(float)
+        Bm, By = d.fit(W, start=start)
+        out.append(d.effects(Bm, By, W))
+    return np.concatenate(out, axis=-1)
+
+
+def bootstrap(df: pd.DataFrame, spec: dict, n_boot: int, seed: int = 0, workers: int = None, alpha: float = 0.05) -> pd.DataFrame:
+    # n_boot row-resampling replicates in blocks over the grid runner; block b
+    # draws from SeedSequence(seed).spawn(...)[b], so results do not depend on
+    # the worker count
+    d = design(df, spec)
+    theta, start = d.point()
+    sizes = [min(BLOCK, n_boot - lo) for lo in range(0, n_boot, BLOCK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    cells = [(spec, s, k) for s, k in zip(seeds, sizes)]
+    boot = []
+    for (_, _, k), out, err in run_grid(df, cells, bootstrap_block, workers=workers):
+        if err is not None:
+            print(f"Bootstrap block of {k} replicates failed: {err}")
+            continue
+        boot.append(out)
+    if not boot:
+        raise RuntimeError(f"All {len(sizes)} bootstrap blocks failed; 0 of {n_boot} replicates ran")
+    boot = np.concatenate(boot, axis=-1)
+    if boot.shape[-1] < n_boot:
+        print(f"Bootstrap ran {boot.shape[-1]} of {n_boot} replicates")
+    jack = jackknife(d, seed=seed, start=start)
+    return bootstrap_frame(d, theta, boot, jack, alpha)
+
+
+def simulate(d: MediationDesign, Bm: np.ndarray, cov_m: np.ndarray, By: np.ndarray, cov_y: np.ndarray, n_sims: int, seed: int = 0, chunksize: int = SIM_CHUNK) -> np.ndarray:
+    # quasi-Bayesian draws: mediator and outcome coefficients from independent
+    # normals around the fits, effects for chunksize draws at a time so the
+    # n x chunksize prediction matrices stay bounded -> (n_contrasts, 4, n_sims);
+    # one stream per model so the draws do not depend on chunksize
+    rng_m, rng_y = (np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(2))
+    Lm = np.linalg.cholesky(cov_m + 1e-12 * np.eye(len(Bm)))
+    Ly = np.linalg.cholesky(cov_y + 1e-12 * np.eye(len(By)))
+    W = np.ones((d.n, 1))
+    out = []
+    for lo in range(0, n_sims, chunksize):
+        k = min(chunksize, n_sims - lo)
+        Bm_s = Bm[:, None] + Lm @ rng_m.standard_normal((k, len(Bm))).T
+        By_s = By[:, None] + Ly @ rng_y.standard_normal((k, len(By))).T
+        out.append(d.effects(Bm_s, By_s, W))
+    return np.concatenate(out, axis=-1)
+
+
+def percentile_ci(boot: np.ndarray, alpha: float = 0.05) -> tuple:
+    return np.nanquantile(boot, alpha / 2, axis=-1), np.nanquantile(boot, 1 - alpha / 2, axis=-1)
+
+
+def bca_ci(boot: np.ndarray, theta: np.ndarray, jack: np.ndarray, alpha: float = 0.05) -> tuple:
+    # bias-corrected and accelerated intervals; bias from the share of
+    # replicates below the estimate, acceleration from the jackknife skewness
+    valid = np.isfinite(boot)
+    below = ((boot < theta[..., None]) & valid).sum(axis=-1) + 0.5 * ((boot == theta[..., None]) & valid).sum(axis=-1)
+    z0 = stats.norm.ppf(np.clip(below / valid.sum(axis=-1), 1e-10, 1 - 1e-10))
+    dev = np.nanmean(jack, axis=-1, keepdims=True) - jack
+    acc = np.nansum(dev ** 3, axis=-1) / (6 * np.nansum(dev ** 2, axis=-1) ** 1.5)
+    bounds = []
+    for q in (alpha / 2, 1 - alpha / 2):
+        zq = stats.norm.ppf(q)
+        adj = stats.norm.cdf(z0 + (z0 + zq) / (1 - acc * (z0 + zq)))
+        flat = [np.nanquantile(b, a) if np.isfinite(a) else np.nan for b, a in zip(boot.reshape(-1, boot.shape[-1]), adj.ravel())]
+        bounds.append(np.reshape(flat, theta.shape))
+    return tuple(bounds)
+
+
+def effects_frame(d: MediationDesign, theta: np.ndarray) -> pd.DataFrame:
+    rows = []
+    for i, (a1, a0) in enumerate(d.contrasts):
+        rows.append({"contrast": f"{a1} vs {a0}", **dict(zip(QUANTITIES, theta[i]))})
+    return pd.DataFrame(rows)
+
+
+def draws_frame(d: MediationDesign, theta: np.ndarray, draws: np.ndarray, bounds: dict, count: str) -> pd.DataFrame:
+    # long table: contrast x quantity with the draws' SD, interval bounds
+    # ({column: (n_contrasts, 4) array}) and the number of finite draws
+    se = np.nanstd(draws, axis=-1, ddof=1)
+    rows = []
+    for i, (a1, a0) in enumerate(d.contrasts):
+        for j, q in enumerate(QUANTITIES):
+            rows.append({
+                "contrast": f"{a1} vs {a0}", "quantity": q, "estimate": theta[i, j], "se": se[i, j],
+                **{c: b[i, j] for c, b in bounds.items()}, count: int(np.isfinite(draws[i, j]).sum()),
+            })
+    return pd.DataFrame(rows)
+
+
+def bootstrap_frame(d: MediationDesign, theta: np.ndarray, boot: np.ndarray, jack: np.ndarray, alpha: float = 0.05) -> pd.DataFrame:
+    pct_lo, pct_hi = percentile_ci(boot, alpha)
+    bca_lo, bca_hi = bca_ci(boot, theta, jack, alpha)
+    bounds = {"pct_low": pct_lo, "pct_high": pct_hi, "bca_low": bca_lo, "bca_high": bca_hi}
+    return draws_frame(d, theta, boot, bounds, "n_boot")
+
+
+def simulation_frame(d: MediationDesign, theta: np.ndarray, sims: np.ndarray, alpha: float = 0.05) -> pd.DataFrame:
+    lo, hi = percentile_ci(sims, alpha)
+    return draws_frame(d, theta, sims, {"ci_low": lo, "ci_high": hi}, "n_sims")
@@ -0,0 +1,192 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import pandas as pd
+import statsmodels.formula.api as smf
+
+from counterfactual import design_info
+
+# plan 6.5: on-disk memo of fitted models keyed by (formula, family, cov_type, frame)
+CACHE_DIR = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/.model_cache"
+MAX_AGE_DAYS = 30
+MAX_MB = 2048
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    # content hash of the projected modeling frame (values, column names, dtypes)
+    h = hashlib.sha256()
+    h.update(json.dumps([[c, str(t)] for c, t in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def family_name(family) -> str:
+    return f"{type(family).__name__}({type(family.link).__name__})"
+
+
+def cache_key(formula: str, family: str, cov_type: str, frame: pd.DataFrame) -> str:
+    h = hashlib.sha256()
+    for part in (formula, family, cov_type, frame_digest(frame)):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _paths(key: str, cache_dir: str) -> tuple:
+    return os.path.join(cache_dir, key + ".pkl"), os.path.join(cache_dir, key + ".json")
+
+
+def get(key: str, cache_dir: str = CACHE_DIR):
+    path, meta_path = _paths(key, cache_dir)
+    try:
+        with open(path, "rb") as f:
+            obj = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    # mtime of the sidecar doubles as last-used time for eviction
+    try:
+        os.utime(meta_path)
+    except FileNotFoundError:
+        pass
+    return obj
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    # write-then-rename so concurrent grid workers never see a partial entry
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def put(key: str, obj, meta: dict, cache_dir: str = CACHE_DIR) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    path, meta_path = _paths(key, cache_dir)
+    _atomic_write(path, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    _atomic_write(meta_path, json.dumps(dict(meta, created=time.time()), indent=1).encode())
+    evict(cache_dir)
+
+
+def memoize(formula: str, family: str, cov_type: str, frame: pd.DataFrame, fit, cache_dir: str = CACHE_DIR, keep=None):
+    # fit() -> picklable result; served from cache_dir when the key matches.
+    # keep(result) -> False leaves a result uncached (e.g. a fit cut short by
+    # its time budget)
+    if cache_dir is None:
+        return fit()
+    key = cache_key(formula, family, cov_type, frame)
+    obj = get(key, cache_dir)
+    if obj is None:
+        obj = fit()
+        if keep is None or keep(obj):
+            put(key, obj, {"formula": formula, "family": family, "cov_type": cov_type, "n_rows": len(frame)}, cache_dir)
+    return obj
+
+
+def glm_fit(formula: str, frame: pd.DataFrame, family, cov_type: str = "HC3", cache_dir: str = CACHE_DIR, maxiter: int = 100):
+    # statsmodels GLM whose coefficients are memoized. The cache stores params,
+    # covariance and prediction metadata (formula, term names, factor levels);
+    # a hit rebuilds the full results object at the cached params with
+    # maxiter=0, so margins/predict work as on a fresh fit without IRLS; a
+    # miss returns the fresh fit itself.
+    # res.n_iter carries the IRLS iterations of the original fit.
+    model = smf.glm(formula, data=frame, family=family)
+    fresh = []
+
+    def fit():
+        res = model.fit(cov_type=cov_type, maxiter=maxiter)
+        fresh.append(res)
+        levels = {f.name(): [str(c) for c in info.categories] for f, info in design_info(res).factor_infos.items() if info.type == "categorical"}
+        return {
+            "params": res.params,
+            "cov": res.cov_params(),
+            "nobs": res.nobs,
+            "n_iter": res.fit_history.get("iteration"),
+            "converged": res.converged,
+            "formula": formula,
+            "levels": levels,
+        }
+
+    label = cov_type if maxiter == 100 else f"{cov_type}:maxiter={maxiter}"
+    entry = memoize(formula, family_name(family), label, frame, fit, cache_dir)
+    if fresh:
+        res = fresh[0]
+    else:
+        res = model.fit(start_params=entry["params"].to_numpy(), maxiter=0, cov_type=cov_type)
+        res.converged = entry["converged"]
+    res.n_iter = entry["n_iter"]
+    return res
+
+
+def entries(cache_dir: str = CACHE_DIR) -> pd.DataFrame:
+    rows = []
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            path, meta_path = _paths(key, cache_dir)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                size = os.path.getsize(path) + os.path.getsize(meta_path)
+                last_used = os.path.getmtime(meta_path)
+            except (OSError, ValueError):
+                continue
+            rows.append({"key": key, **meta, "bytes": size, "last_used": last_used})
+    cols = ["key", "formula", "family", "cov_type", "n_rows", "bytes", "created", "last_used"]
+    return pd.DataFrame(rows, columns=cols).sort_values("last_used", ascending=False, ignore_index=True)
+
+
+def remove(key: str, cache_dir: str = CACHE_DIR) -> None:
+    for path in _paths(key, cache_dir):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def evict(cache_dir: str = CACHE_DIR, max_age_days: float = MAX_AGE_DAYS, max_mb: float = MAX_MB) -> int:
+    # drop entries unused for max_age_days, then least recently used ones
+    # until the cache fits in max_mb
+    table = entries(cache_dir)
+    stale = table["last_used"] < time.time() - max_age_days * 86400
+    over = table["bytes"].cumsum() > max_mb * 2**20
+    drop = table.loc[stale | over, "key"]
+    for key in drop:
+        remove(key, cache_dir)
+    return len(drop)
+
+
+def clear(cache_dir: str = CACHE_DIR) -> int:
+    table = entries(cache_dir)
+    for key in table["key"]:
+        remove(key, cache_dir)
+    return len(table)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="inspect or prune the fitted-model cache")
+    ap.add_argument("command", choices=["list", "clear", "evict"])
+    ap.add_argument("--cache-dir", default=CACHE_DIR)
+    ap.add_argument("--max-age-days", type=float, default=MAX_AGE_DAYS)
+    ap.add_argument("--max-mb", type=float, default=MAX_MB)
+    args = ap.parse_args()
+    if args.command == "list":
+        table = entries(args.cache_dir)
+        for c in ("created", "last_used"):
+            table[c] = pd.to_datetime(table[c], unit="s").dt.strftime("%Y-%m-%d %H:%M")
+        with pd.option_context("display.max_colwidth", 80, "display.width", 200):
+            print(table.to_string(index=False) if len(table) else "cache is empty")
+        print(f"{len(table)} entries, {table['bytes'].sum() / 2**20:.1f} MB")
+    elif args.command == "clear":
+        print(f"removed {clear(args.cache_dir)} entries")
+    else:
+        print(f"evicted {evict(args.cache_dir, args.max_age_days, args.max_mb)} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from loader import formula_columns
+
+# plan 3.0: lean modeling frames (formula columns only, complete cases per variable set)
+
+
+class ModelFrames:
+    # complete-case masks are memoized per right-hand-side variable set, so
+    # outcomes that share a specification reuse one pass over the covariates
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._masks = {}
+
+    def mask(self, cols: list) -> np.ndarray:
+        key = tuple(sorted(set(cols)))
+        if key not in self._masks:
+            self._masks[key] = self.df[list(key)].notna().all(axis=1).to_numpy()
+        return self._masks[key]
+
+    def get(self, formula: str, extra: list = None) -> pd.DataFrame:
+        y_cols = formula_columns(formula, rhs=False)
+        x_cols = formula_columns(formula, lhs=False) + list(extra or [])
+        cols = list(dict.fromkeys(y_cols + x_cols))
+        keep = self.mask(x_cols) & self.df[y_cols].notna().all(axis=1).to_numpy()
+        return self.df.loc[keep, cols]
+
+
+def model_frame(df: pd.DataFrame, formula: str, extra: list = None) -> pd.DataFrame:
+    return ModelFrames(df).get(formula, extra)
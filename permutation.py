@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import patsy
+
+from glm import irls_logit
+from grid import run_grid
+from loader import formula_columns
+from modeling import ModelFrames
+
+# plan 3.4b: randomization p-values for device contrasts. One null fit per
+# outcome (covariates only); each permutation of the group labels is scored
+# against the null residuals, so nothing is refitted.
+
+BLOCK = 256
+
+# per-process memo {spec: (frame, null fit)} so grid workers build each null
+# fit once; keyed on the frame object itself, not its reusable id
+_TESTS = {}
+
+
+def _expit(eta: np.ndarray) -> np.ndarray:
+    return 0.5 * (1 + np.tanh(0.5 * eta))
+
+
+class ScoreTest:
+    # Score statistics for a group label (default device_cat vs PPM) on
+    # several binary outcomes sharing one covariate specification. With null
+    # residuals r = y - mu0 the score for group g is U_g = sum_{i in g} r_i;
+    # per contrast the statistic is the difference in mean residual,
+    # U_a / n_a - U_ref / n_ref, and the omnibus statistic is sum_g U_g^2 / n_g.
+    # Labels are permuted within strata (e.g. pre_dx_cat) over rows complete on
+    # the covariates and the label.
+
+    def __init__(self, df: pd.DataFrame, outcomes: list, rhs: str, label_col: str = "device_cat", strata_col: str = None, reference: str = "PPM"):
+        rhs = rhs.split("~", 1)[1] if "~" in rhs else rhs
+        x_cols = formula_columns("~" + rhs)
+        keep = ModelFrames(df).mask(x_cols + [label_col])
+        cols = list(dict.fromkeys(x_cols + list(outcomes) + [label_col] + ([strata_col] if strata_col else [])))
+        frame = df.loc[keep, cols]
+        X = patsy.dmatrix(rhs, frame[x_cols], return_type="dataframe", NA_action="raise").to_numpy(dtype=float)
+        Y = frame[outcomes]
+        self.mask = Y.notna().to_numpy()
+        Yv = Y.to_numpy(dtype=float, na_value=0.0)
+        params, _, self.converged = irls_logit(X, Yv, self.mask)
+        self.resid = np.where(self.mask, Yv - _expit(X @ params), 0.0)
+
+        levels = [str(v) for v in pd.unique(frame[label_col])]
+        self.levels = [reference] + sorted(v for v in levels if v != reference)
+        self.labels = pd.Categorical(frame[label_col].astype(str), categories=self.levels).codes
+        strata = pd.factorize(frame[strata_col], use_na_sentinel=False)[0] if strata_col else np.zeros(len(frame), dtype=int)
+        self.strata = strata
+        self.order = np.argsort(strata, kind="stable")
+        self.outcomes = list(outcomes)
+
+    @property
+    def n(self) -> int:
+        return len(self.labels)
+
+    @property
+    def names(self) -> list:
+        return [f"{a} vs {self.levels[0]}" for a in self.levels[1:]] + ["global"]
+
+    def statistics(self, labels: np.ndarray) -> np.ndarray:
+        # labels: (B, n) group codes -> (n_contrasts + 1, K, B)
+        labels = np.atleast_2d(labels)
+        M = self.mask.astype(float)
+        U, N = [], []
+        for g in range(len(self.levels)):
+            D = (labels == g).astype(float)
+            U.append(D @ self.resid)
+            N.append(D @ M)
+        U, N = np.array(U), np.array(N)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = U / N
+            omnibus = np.nansum(U ** 2 / N, axis=0)
+        out = [mean[g] - mean[0] for g in range(1, len(self.levels))] + [omnibus]
+        return np.array(out).transpose(0, 2, 1)
+
+    def permute(self, rng: np.random.Generator, k: int) -> np.ndarray:
+        # k label vectors, each a random permutation within every stratum:
+        # sorting random keys offset by stratum keeps rows inside their stratum
+        src = np.argsort(self.strata[None, :] + rng.random((k, self.n)), axis=1)
+        labels = np.empty((k, self.n), dtype=self.labels.dtype)
+        labels[:, self.order] = self.labels[src]
+        return labels
+
+
+def score_test(df: pd.DataFrame, spec: dict) -> ScoreTest:
+    key = repr(sorted(spec.items()))
+    entry = _TESTS.get(key)
+    if entry is None or entry[0] is not df:
+        _TESTS.clear()
+        entry = _TESTS[key] = (df, ScoreTest(df, **spec))
+    return entry[1]
+
+
+def permutation_block(df: pd.DataFrame, cell: tuple) -> np.ndarray:
+    # one block of permutations with its own RNG stream: cell = (spec, seed, k)
+    spec, seed, k = cell
+    test = score_test(df, spec)
+    return test.statistics(test.permute(np.random.default_rng(seed), k))
+
+
+def permutation_test(df: pd.DataFrame, spec: dict, n_perm: int, seed: int = 0, workers: int = None) -> pd.DataFrame:
+    # spec: ScoreTest arguments (outcomes, rhs, label_col, strata_col,
+    # reference). Two-sided p-values for the contrasts, upper-tail for the
+    # omnibus, with the +1 correction; identical for any worker count.
+    test = score_test(df, spec)
+    observed = test.statistics(test.labels[None, :])[..., 0]
+    sizes = [min(BLOCK, n_perm - lo) for lo in range(0, n_perm, BLOCK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    perms = []
+    for (_, _, k), out, err in run_grid(df, [(spec, s, k) for s, k in zip(seeds, sizes)], permutation_block, workers=workers):
+        if err is not None:
+            print(f"Permutation block of {k} failed: {err}")
+            continue
+        perms.append(out)
+    if not perms:
+        raise RuntimeError(f"All {len(sizes)} permutation blocks failed; 0 of {n_perm} permutations ran")
+    perms = np.concatenate(perms, axis=-1)
+    if perms.shape[-1] < n_perm:
+        print(f"Permutation test ran {perms.shape[-1]} of {n_perm} permutations")
+    n_contrasts = len(test.levels) - 1
+    extreme = np.empty(observed.shape)
+    extreme[:n_contrasts] = (np.abs(perms[:n_contrasts]) >= np.abs(observed[:n_contrasts, :, None]) - 1e-12).sum(axis=-1)
+    extreme[n_contrasts:] = (perms[n_contrasts:] >= observed[n_contrasts:, :, None] - 1e-12).sum(axis=-1)
+    valid = np.isfinite(perms).sum(axis=-1)
+    rows = []
+    for i, name in enumerate(test.names):
+        for k, outcome in enumerate(test.outcomes):
+            rows.append({
+                "outcome": outcome, "contrast": name, "statistic": observed[i, k],
+                "p_perm": (1 + extreme[i, k]) / (1 + valid[i, k]), "n_perm": int(valid[i, k]),
+                "converged": bool(test.converged[k]),
+            })
+    return pd.DataFrame(rows)
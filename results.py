@@ -0,0 +1,166 @@
+import argparse
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+# plan 6.6: one indexed results store (SQLite) for every analysis script;
+# per-model CSVs remain available as an optional export
+RESULTS_DB = "/home/sunx/data/aiiih/projects/sunx/projects/CIED/results.sqlite"
+
+# long format: one row per estimate; kind is coef | margin | dose_response |
+# dose_curve | mediation | ...; unused key columns stay NULL
+KEY_COLUMNS = ["script", "kind", "variant", "outcome", "metric", "device_cat", "contrast", "term"]
+VALUE_COLUMNS = ["estimate", "se", "z", "p", "ci_low", "ci_high", "q", "value"]
+COLUMNS = ["run_id"] + KEY_COLUMNS + VALUE_COLUMNS
+
+INDEXES = {
+    "ix_term": ["term", "kind"],
+    "ix_outcome": ["outcome"],
+    "ix_metric": ["metric"],
+    "ix_device": ["device_cat"],
+    "ix_script": ["script", "kind"],
+}
+
+# one row per fitted specification (batched fits: per outcome) with its
+# convergence diagnostics; rows whose status is not "ok" form the quarantine.
+# separating lists the 0/1 design columns that perfectly predict the outcome
+DIAG_KEY_COLUMNS = ["script", "variant", "outcome", "metric", "device_cat", "status", "detail", "separating"]
+DIAG_VALUE_COLUMNS = ["n_iter", "converged", "max_grad", "cond", "max_abs_eta", "seconds"]
+DIAG_COLUMNS = ["run_id"] + DIAG_KEY_COLUMNS + DIAG_VALUE_COLUMNS
+
+# statsmodels summary2().tables[1] and get_margeff().summary_frame() layouts
+_SUMMARY_NAMES = {
+    "Coef.": "estimate", "Std.Err.": "se", "z": "z", "P>|z|": "p", "[0.025": "ci_low", "0.975]": "ci_high",
+    "dy/dx": "estimate", "Std. Err.": "se", "Pr(>|z|)": "p", "Conf. Int. Low": "ci_low", "Cont. Int. Hi.": "ci_high",
+}
+
+
+def connect(db: str = RESULTS_DB) -> sqlite3.Connection:
+    con = sqlite3.connect(db)
+    cols = ", ".join(f"{c} TEXT" if c in KEY_COLUMNS else f"{c} REAL" for c in COLUMNS)
+    con.execute(f"CREATE TABLE IF NOT EXISTS estimates ({cols})")
+    for name, cols in INDEXES.items():
+        con.execute(f"CREATE INDEX IF NOT EXISTS {name} ON estimates ({', '.join(cols)})")
+    cols = ", ".join(f"{c} TEXT" if c in DIAG_KEY_COLUMNS else f"{c} REAL" for c in DIAG_COLUMNS)
+    con.execute(f"CREATE TABLE IF NOT EXISTS diagnostics ({cols})")
+    have = {row[1] for row in con.execute("PRAGMA table_info(diagnostics)")}
+    for c in DIAG_COLUMNS:
+        if c not in have:
+            con.execute(f"ALTER TABLE diagnostics ADD COLUMN {c} {'TEXT' if c in DIAG_KEY_COLUMNS else 'REAL'}")
+    con.execute("CREATE VIEW IF NOT EXISTS quarantine AS SELECT * FROM diagnostics WHERE status != 'ok'")
+    return con
+
+
+def summary_rows(table: pd.DataFrame, kind: str, **keys) -> pd.DataFrame:
+    # statsmodels-style coefficient / margins table -> store rows
+    out = table.rename(columns=_SUMMARY_NAMES)
+    out = out[[c for c in VALUE_COLUMNS if c in out.columns]]
+    out.insert(0, "term", table.index.astype(str))
+    return out.reset_index(drop=True).assign(kind=kind, **keys)
+
+
+def dose_rows(grid: pd.DataFrame, kind: str = "dose_response", **keys) -> pd.DataFrame:
+    # counterfactual grid (device_cat, [q], value, mean_prob, se, lower, upper)
+    out = grid.rename(columns={"mean_prob": "estimate", "lower": "ci_low", "upper": "ci_high"})
+    out = out.drop(columns=[c for c in ("metric", "outcome") if c in out.columns and c in keys])
+    return out.assign(kind=kind, **keys)
+
+
+def _insert(table: str, frame: pd.DataFrame, columns: list, key_columns: list, script: str, db: str, replace: bool) -> int:
+    frame = frame.assign(script=script, run_id=time.time()).reindex(columns=columns)
+    frame = frame.astype({c: "object" for c in key_columns})
+    for c in key_columns:
+        frame[c] = frame[c].where(frame[c].isna(), frame[c].astype(str))
+    os.makedirs(os.path.dirname(db) or ".", exist_ok=True)
+    con = connect(db)
+    try:
+        with con:
+            if replace:
+                con.execute(f"DELETE FROM {table} WHERE script = ?", (script,))
+            con.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None),
+            )
+    finally:
+        con.close()
+    return len(frame)
+
+
+def write(rows, script: str, db: str = RESULTS_DB, replace: bool = True) -> int:
+    # bulk insert in one transaction; by default a script's earlier rows are
+    # replaced so the store holds the latest run of every script
+    frame = pd.concat(rows, ignore_index=True) if isinstance(rows, list) else rows
+    return _insert("estimates", frame, COLUMNS, KEY_COLUMNS, script, db, replace)
+
+
+def write_diagnostics(rows, script: str, db: str = RESULTS_DB, replace: bool = True) -> int:
+    # fit diagnostics (e.g. BatchLogit.iterations() plus key columns, or
+    # quarantine_row records); same replace semantics as write
+    if isinstance(rows, list):
+        if not rows:
+            return 0
+        rows = pd.concat(rows, ignore_index=True)
+    frame = rows
+    return _insert("diagnostics", frame, DIAG_COLUMNS, DIAG_KEY_COLUMNS, script, db, replace)
+
+
+def quarantine_row(status: str, detail: str = "", **keys) -> pd.DataFrame:
+    # a specification that produced no estimates (status as in glm.FIT_STATUSES)
+    return pd.DataFrame([{"status": status, "detail": detail, **keys}])
+
+
+def quarantine(db: str = RESULTS_DB, script: str = None) -> pd.DataFrame:
+    # failed specifications of the latest run of each script
+    con = connect(db)
+    try:
+        where, params = (" WHERE script = ?", [script]) if script else ("", [])
+        return pd.read_sql_query(f"SELECT * FROM quarantine{where}", con, params=params)
+    finally:
+        con.close()
+
+
+def query(db: str = RESULTS_DB, **filters) -> pd.DataFrame:
+    # equality filters on key columns; a list/tuple value means IN, e.g.
+    # query(kind="coef", term="artifact_burden", script=["03_models_main", "06_sensitivity"])
+    clauses, params = [], []
+    for col, value in filters.items():
+        if col not in KEY_COLUMNS:
+            raise KeyError(f"unknown filter column {col!r}")
+        if isinstance(value, (list, tuple)):
+            clauses.append(f"{col} IN ({', '.join('?' * len(value))})")
+            params += list(value)
+        else:
+            clauses.append(f"{col} = ?")
+            params.append(value)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    con = connect(db)
+    try:
+        return pd.read_sql_query(f"SELECT * FROM estimates{where}", con, params=params)
+    finally:
+        con.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="query the analysis results store")
+    ap.add_argument("--db", default=RESULTS_DB)
+    for col in KEY_COLUMNS:
+        ap.add_argument(f"--{col.replace('_', '-')}", dest=col, action="append", help=f"filter on {col} (repeatable)")
+    ap.add_argument("--csv", default=None, help="write the selection to this CSV instead of printing it")
+    ap.add_argument("--quarantine", action="store_true", help="list the failed specifications instead (--script filters)")
+    args = ap.parse_args()
+    if args.quarantine:
+        out = quarantine(args.db, args.script[0] if args.script else None)
+    else:
+        filters = {c: v[0] if len(v) == 1 else v for c in KEY_COLUMNS if (v := getattr(args, c))}
+        out = query(args.db, **filters)
+    if args.csv:
+        out.to_csv(args.csv, index=False)
+    else:
+        with pd.option_context("display.width", 200, "display.max_rows", 200):
+            print(out.drop(columns=["run_id"]).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+# plan 1.5: NaN-aware aggregation across a column group (one pass over a 2-D block,
+# no per-row Python calls). Inputs are a DataFrame + column list or a 2-D array.
+
+
+def _block(data, cols: list = None) -> tuple:
+    if isinstance(data, pd.DataFrame):
+        frame = data[cols] if cols is not None else data
+        index = frame.index
+        if all(isinstance(t, np.dtype) and t.kind in "iub" for t in frame.dtypes):
+            return frame.to_numpy(), index
+        return frame.to_numpy(dtype=float, na_value=np.nan), index
+    return np.asarray(data), None
+
+
+def _wrap(values: np.ndarray, index) -> pd.Series:
+    return values if index is None else pd.Series(values, index=index)
+
+
+def row_count(data, cols: list = None):
+    x, index = _block(data, cols)
+    n = x.shape[1] - np.isnan(x).sum(axis=1) if x.dtype.kind == "f" else np.full(len(x), x.shape[1])
+    return _wrap(n.astype(np.int64), index)
+
+
+def row_sum(data, cols: list = None, min_count: int = 0):
+    x, index = _block(data, cols)
+    if x.dtype.kind != "f":
+        out = x.sum(axis=1, dtype=np.int64)
+        if min_count > x.shape[1]:
+            out = np.full(len(x), np.nan)
+        return _wrap(out, index)
+    mask = ~np.isnan(x)
+    out = np.where(mask, x, 0.0).sum(axis=1)
+    if min_count > 0:
+        out[mask.sum(axis=1) < min_count] = np.nan
+    return _wrap(out, index)
+
+
+def row_mean(data, cols: list = None):
+    x, index = _block(data, cols)
+    x = x.astype(float, copy=False)
+    mask = ~np.isnan(x)
+    n = mask.sum(axis=1)
+    total = np.where(mask, x, 0.0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(n > 0, total / n, np.nan)
+    return _wrap(out, index)
+
+
+def row_max(data, cols: list = None):
+    x, index = _block(data, cols)
+    if x.shape[1] == 0:
+        return _wrap(np.full(len(x), np.nan), index)
+    # fmax ignores NaN unless the whole row is missing
+    out = np.fmax.reduce(x, axis=1) if x.dtype.kind == "f" else x.max(axis=1)
+    return _wrap(out, index)
@@ -0,0 +1,87 @@
+import pandas as pd
+
+from segments import SEQUENCES, WALLS
+
+# plan 6.1: explicit output schema for the clean dataset (derived columns only;
+# raw workbook columns keep their ingest types)
+
+# category order is fixed (alphabetical, as patsy sorted the former object
+# columns) so C(device_cat) keeps CRT as the reference level across runs
+DEVICE_CATEGORIES = ["CRT", "ICD", "PPM"]
+MANUFACTURER_CATEGORIES = ["Bio", "Boston", "MDT", "Other", "StJude"]
+DX_CATEGORIES = ["hcm", "infiltrative", "ischemia", "myopericarditis", "other", "other_cmp", "valvular", "vt"]
+
+CATEGORIES = {
+    "device_cat": DEVICE_CATEGORIES,
+    "manufacturer_name": MANUFACTURER_CATEGORIES,
+    "pre_dx_name": DX_CATEGORIES,
+    "post_dx_name": DX_CATEGORIES,
+}
+
+FLAG_COLUMNS = [
+    "sex_male",
+    "hf", "htn", "cad", "mi", "vt_vf", "vfib", "vt", "afib", "ckd",
+    "is_CRT", "indication_missing", "mr_conditional",
+    "left_chest", "right_chest", "leadless", "subQ", "left_vs_other", "left_vs_other_coarse",
+    "manufacturer_other",
+    "atrial_lead", "ventricular_lead", "lv_lead", "subq_lead", "has_LV", "has_SQ",
+    "rotation",
+    "cause_IPG", "cause_lead", "cause_both",
+    "has_TFE", "has_CINE", "has_VIAB",
+    "NonDiagnostic", "AddInfo", "Confirmed", "MgmtChange", "dx_change",
+]
+FLAG_COLUMNS += [f"severe_art_{s}" for s in SEQUENCES]
+FLAG_COLUMNS += [f"{w}_severe_{s}" for s in SEQUENCES for w in WALLS]
+FLAG_COLUMNS += [f"lv_{w}_clean_{s}" for s in SEQUENCES for w in WALLS]
+FLAG_COLUMNS += [f"lv_{w}_clean" for w in WALLS]
+
+# small bounded counts/scores
+INT8_COLUMNS = FLAG_COLUMNS + ["n_leads", "lv_visibility_score", "UtilityScore"]
+
+# recorded measurements and small integer codes (exact in float32); derived
+# model covariates such as artifact_burden and norm_dist_* stay float64
+FLOAT32_COLUMNS = [
+    "age", "height_cm", "weight_kg", "bmi",
+    "pre_dx_cat", "post_dx_cat", "device_type_code",
+    "icd_indication_code", "ppm_indication_code", "position_body_code", "manufacturer_code",
+    "dist_card_sil_mm", "dist_lv_apex_mm", "widest_chest_mm",
+] + [f"ratio_{s}" for s in SEQUENCES]
+
+# Table 1 patient/device characteristics; also the IPW balance variables
+TABLE1_COLS = [
+    "age",
+    "sex_male",
+    "bmi",
+    "hf",
+    "htn",
+    "cad",
+    "mi",
+    "afib",
+    "ckd",
+    "mr_conditional",
+    "n_leads",
+    "left_vs_other",
+    "manufacturer_other",
+    "norm_dist_card_sil",
+    "norm_dist_LV_apex",
+    "rotation",
+    "has_TFE",
+    "has_CINE",
+    "has_VIAB",
+    "artifact_burden",
+    "lv_visibility_score",
+]
+
+
+def clean_dtypes() -> dict:
+    dtypes = {c: "int8" for c in INT8_COLUMNS}
+    dtypes.update({c: "float32" for c in FLOAT32_COLUMNS})
+    dtypes.update({c: pd.CategoricalDtype(cats) for c, cats in CATEGORIES.items()})
+    return dtypes
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    for c, dtype in clean_dtypes().items():
+        if c in df.columns:
+            df[c] = df[c].astype(dtype)
+    return df
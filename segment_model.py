@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import sparse
+
+from glm import MAXITER, TOL, gram, summary_table
+from modeling import ModelFrames
+from loader import formula_columns
+from segments import MISSING, SEGMENTS, SEQUENCES, SEVERE_GRADE
+
+# plan 3.6: segment-level logistic model (P(grade >= 3) by segment, sequence
+# and patient covariates), clustered on patient. The long design is never
+# materialized: each block of patients is read from the (patients x sequence x
+# segment) grade tensor, its graded cells are located by index arithmetic and
+# turned into a CSR block [patient covariates | segment one-hot | sequence
+# one-hot]. IRLS and the cluster sandwich accumulate p x p state over blocks.
+# With an independence working correlation this is the GEE estimator.
+
+CHUNK_PATIENTS = 2048
+
+
+def _onehot(codes: np.ndarray, n_levels: int) -> sparse.csr_matrix:
+    # treatment coding: level 0 is the reference and gets no column
+    rows = np.flatnonzero(codes > 0)
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, codes[rows] - 1)), shape=(len(codes), n_levels - 1))
+
+
+def _expit(eta: np.ndarray) -> np.ndarray:
+    return 0.5 * (1 + np.tanh(0.5 * eta))
+
+
+class SegmentDesign:
+    # grades: (patients x sequence x segment) int8 tensor (a memmap is read one
+    # block at a time); patients: frame aligned with its first axis; rhs:
+    # patient-level covariates, e.g. "C(device_cat) + norm_dist_LV_apex"
+
+    def __init__(self, grades: np.ndarray, patients: pd.DataFrame, rhs: str, threshold: int = SEVERE_GRADE, chunk_patients: int = CHUNK_PATIENTS):
+        if len(grades) != len(patients):
+            raise ValueError(f"segment tensor has {len(grades)} patients, frame has {len(patients)}")
+        rhs = rhs.split("~", 1)[1] if "~" in rhs else rhs
+        x_cols = formula_columns("~" + rhs)
+        keep = ModelFrames(patients).mask(x_cols)
+        Z = patsy.dmatrix(rhs, patients.loc[keep, x_cols], return_type="dataframe", NA_action="raise")
+        self.grades = grades
+        self.patient_idx = np.flatnonzero(keep)
+        self.Z = Z.to_numpy(dtype=float)
+        self.names = list(Z.columns) + [f"segment[T.{s}]" for s in SEGMENTS[1:]] + [f"sequence[T.{q}]" for q in SEQUENCES[1:]]
+        self.threshold = threshold
+        self.chunk_patients = chunk_patients
+
+    @property
+    def p(self) -> int:
+        return len(self.names)
+
+    def chunks(self):
+        # (X csr, y, cluster codes) per block of patients; cluster codes index
+        # the kept patients, so a block never splits a cluster
+        Q, S = len(SEQUENCES), len(SEGMENTS)
+        for lo in range(0, len(self.patient_idx), self.chunk_patients):
+            block = self.patient_idx[lo:lo + self.chunk_patients]
+            g = np.asarray(self.grades[block]).reshape(-1)
+            cells = np.flatnonzero(g != MISSING)
+            pat, seq, seg = cells // (Q * S), (cells // S) % Q, cells % S
+            X = sparse.hstack([sparse.csr_matrix(self.Z[lo + pat]), _onehot(seg, S), _onehot(seq, Q)], format="csr")
+            yield X, (g[cells] >= self.threshold).astype(float), lo + pat
+
+
+def fit_segment_logit(d: SegmentDesign, maxiter: int = MAXITER, tol: float = TOL) -> dict:
+    # IRLS over the blocks from params = 0 (stops once the deviance of the
+    # current params changes by <= tol), then the
+    # patient-clustered sandwich with the G/(G-1) * (n-1)/(n-p) correction
+    # glm.robust_cov applies for cov_type="cluster"
+    p = d.p
+    params = np.zeros(p)
+    dev = np.inf
+    converged = False
+    n_iter = 0
+    for n_iter in range(1, maxiter + 1):
+        A, b, new_dev = np.zeros((p, p)), np.zeros(p), 0.0
+        for X, y, _ in d.chunks():
+            eta = X @ params
+            mu = _expit(eta)
+            var = mu * (1 - mu)
+            z = eta + (y - mu) / np.where(var > 0, var, 1.0)
+            A += gram(var[:, None], X)[0]
+            b += X.T @ (var * z)
+            mu = np.clip(mu, 1e-300, 1 - 1e-16)
+            new_dev += -2 * np.where(y > 0, np.log(mu), np.log1p(-mu)).sum()
+        converged = abs(new_dev - dev) <= tol
+        dev = new_dev
+        if converged:
+            break
+        params = np.linalg.solve(A, b)
+
+    A = np.zeros((p, p))
+    scores = np.zeros((len(d.patient_idx), p))
+    seen = np.zeros(len(d.patient_idx), dtype=bool)
+    nobs = 0
+    for X, y, groups in d.chunks():
+        mu = _expit(X @ params)
+        A += gram((mu * (1 - mu))[:, None], X)[0]
+        onehot = sparse.csr_matrix((np.ones(len(y)), (groups, np.arange(len(y)))), shape=(len(scores), len(y)))
+        scores += (onehot @ X.multiply((y - mu)[:, None])).toarray()
+        seen[groups] = True
+        nobs += len(y)
+    G = int(seen.sum())
+    bread = np.linalg.inv(A)
+    meat = scores.T @ scores * (G / (G - 1) * (nobs - 1) / (nobs - p))
+    cov = bread @ meat @ bread
+    return {
+        "params": pd.Series(params, index=d.names),
+        "cov": pd.DataFrame(cov, index=d.names, columns=d.names),
+        "nobs": nobs,
+        "n_clusters": G,
+        "n_iter": n_iter,
+        "converged": converged,
+    }
+
+
+def segment_summary(fit: dict, alpha: float = 0.05) -> pd.DataFrame:
+    return summary_table(fit["params"], fit["cov"].to_numpy(), alpha)
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+# plan 1.4b: segment grades as one (patients x sequence x segment) int8 tensor
+SEQUENCES = ("TFE", "CINE", "VIAB")
+SEQ_SUFFIX = {"TFE": "", "CINE": ".1", "VIAB": ".2"}
+# AHA order; the workbook has no apical cap, so LV is 16 segments, then RV
+LV_SEGMENTS = (
+    "B_Anterior", "B_Anteroseptal", "B_Inferoseptal", "B_Inferior", "B_Inferolateral", "B_Anterolateral",
+    "M_Anterior", "M_Anteroseptal", "M_Inferoseptal", "M_Inferior", "M_Inferolateral", "M_Anterolateral",
+    "A_Anterior", "A_Septal", "A_Inferior", "A_Lateral",
+)
+RV_SEGMENTS = ("RV_Base", "RV_Mid", "RV_Apex")
+SEGMENTS = LV_SEGMENTS + RV_SEGMENTS
+WALLS = {
+    "lateral": ("B_Anterolateral", "B_Inferolateral", "M_Anterolateral", "M_Inferolateral", "A_Lateral"),
+    "septal": ("B_Inferoseptal", "B_Anteroseptal", "M_Inferoseptal", "M_Anteroseptal", "A_Septal"),
+    "anterior": ("B_Anterior", "M_Anterior", "A_Anterior"),
+    "inferior": ("B_Inferior", "M_Inferior", "A_Inferior"),
+}
+MISSING = -1
+SEVERE_GRADE = 3
+
+
+def segment_column(seq: str, segment: str) -> str:
+    return f"{segment}{SEQ_SUFFIX[seq]}"
+
+
+def wall_masks() -> np.ndarray:
+    # (wall x segment) bool, rows in WALLS order
+    mask = np.zeros((len(WALLS), len(SEGMENTS)), dtype=bool)
+    for w, segs in enumerate(WALLS.values()):
+        mask[w, [SEGMENTS.index(s) for s in segs]] = True
+    return mask
+
+
+def lv_mask() -> np.ndarray:
+    return np.array([s in LV_SEGMENTS for s in SEGMENTS])
+
+
+def segment_tensor(df: pd.DataFrame) -> np.ndarray:
+    # each wide column is parsed exactly once; ungraded/unparseable -> MISSING.
+    # Grades are floored and clipped to int8, which keeps every ">= grade" test intact.
+    grades = np.full((len(df), len(SEQUENCES), len(SEGMENTS)), MISSING, dtype=np.int8)
+    for q, seq in enumerate(SEQUENCES):
+        for s, segment in enumerate(SEGMENTS):
+            col = segment_column(seq, segment)
+            if col not in df.columns:
+                continue
+            v = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            ok = ~np.isnan(v)
+            grades[ok, q, s] = np.clip(np.floor(v[ok]), 0, np.iinfo(np.int8).max)
+    return grades
+
+
+def sequence_mask(grades: np.ndarray) -> np.ndarray:
+    # (patients x sequence) True where at least one segment was graded
+    return (grades != MISSING).any(axis=2)
+
+
+def wall_severe(grades: np.ndarray, threshold: int = SEVERE_GRADE) -> np.ndarray:
+    # (patients x sequence x wall): any segment of the wall graded >= threshold
+    severe = grades >= threshold
+    return (severe[:, :, None, :] & wall_masks()[None, None, :, :]).any(axis=3)
+
+
+def save_segment_tensor(path: str, grades: np.ndarray) -> None:
+    np.save(path, grades)
+    with open(_meta_path(path), "w") as f:
+        json.dump(_meta(), f, indent=2)
+
+
+def open_segment_tensor(path: str, n_rows: int) -> np.ndarray:
+    # writable memmap for block-wise filling (streaming ingest)
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.int8, shape=(n_rows, len(SEQUENCES), len(SEGMENTS)))
+    out[:] = MISSING
+    with open(_meta_path(path), "w") as f:
+        json.dump(_meta(), f, indent=2)
+    return out
+
+
+def load_segment_tensor(path: str, mmap: bool = True) -> tuple:
+    grades = np.load(path, mmap_mode="r" if mmap else None)
+    with open(_meta_path(path)) as f:
+        meta = json.load(f)
+    return grades, meta
+
+
+def _meta_path(path: str) -> str:
+    return path[:-4] + ".json" if path.endswith(".npy") else path + ".json"
+
+
+def _meta() -> dict:
+    return {
+        "axes": ["patient", "sequence", "segment"],
+        "sequences": list(SEQUENCES),
+        "segments": list(SEGMENTS),
+        "walls": {w: list(segs) for w, segs in WALLS.items()},
+        "missing": MISSING,
+    }
@@ -0,0 +1,83 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the analysis modules are flat top-level files; scripts (01_data_prep, ...)
+# are imported by name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from segments import SEGMENTS  # noqa: E402
+
+
+def script(name: str):
+    return importlib.import_module(name)
+
+
+def raw_sheet(n: int, seed: int = 0) -> pd.DataFrame:
+    # synthetic workbook in the source layout, with the mixed cell types
+    # (1 / "yes" / "n/a" / None) the coercions have to handle
+    prep = script("01_data_prep")
+    rng = np.random.default_rng(seed)
+    d = {}
+    d["Age"] = rng.integers(20, 90, n).astype(float)
+    d["Sex (1-M)"] = rng.choice([1, 0, "1", "yes", None], n)
+    d["Height cm"] = rng.normal(170, 10, n)
+    d["Weight Kg"] = rng.normal(80, 15, n)
+    d["BMI"] = rng.normal(27, 4, n)
+    for c in ["HF (1=Y)", "HTN (1=Y)", "CAD", "MI (Y=1)", "VT/VF", "Vfib (1=Y)", "VT (1=Y)", "Afib (1=Y)", "CKD (1=Y)"]:
+        d[c] = rng.choice([0, 1, "Yes", "no ", "Y", None], n)
+    d[prep.PRE_DX_COL] = rng.choice([1, 2, 3, 4, 5, 6, 7, 8, None], n)
+    d[prep.POST_DX_COL] = rng.choice([1, 2, 3, 4, 5, 6, 7, 8, None], n)
+    d["MR_indication_simplified (1=infiltrative,2=valvulopathy,3=HOCM,4=myopericarditis,5=ischemia,6=other unexplained CMP,7=Othe, 8= VT)\n\n*changed to mached pre/post)"] = rng.choice([1, 2, 3, 5, 8], n)
+    d["Type of Device (ICD =1 PPM = 2 CRT = 3)"] = rng.choice([1, 2, 3], n, p=[0.45, 0.4, 0.15])
+    d["ICD indication (Primary prevention = 1, secodary prevention =2)"] = rng.choice([1, 2, None], n)
+    d["PPM indications (CHB = 1, SND = 2, Other = 3)"] = rng.choice([1, 2, 3, None], n)
+    d["MR Conditional "] = rng.choice([0, 1, "yes"], n)
+    d["Position in body (left chest = 1, right chest = 2, leadless = 3, 4=subC)"] = rng.choice([1, 2, 3, 4], n, p=[0.8, 0.1, 0.05, 0.05])
+    d["Position (L chest=1, other=2)"] = rng.choice([1, 2], n)
+    d["Manufacturer (1=Boston,2=MDT,3=Bio,4=StJude,5=other)"] = rng.choice([1, 2, 3, 4, 5], n)
+    for c in ["Atrial Lead Yes/No", "Ventricular lead Yes/No", "LV lead Yes/No"]:
+        d[c] = rng.choice(["Yes", "No", "yes", 1, 0], n)
+    d["SubQ lead - (0=no,1=yes,3=other (leadless)"] = rng.choice([0, 1, 3], n)
+    d["Rotation. 0 = normal, 1 rotated."] = rng.choice([0, 1], n)
+    for c in ["PPM to RV Lead", "PPM to LV Lead", "PPM to subQ (can to subQ lead)", "Lat view- Inf edge of PPM to RV lead tip",
+              "Lat view- Inf edge of PPM to LV lead tip", "Lat view- Inf edge of PPM to SubQ lead tip"]:
+        d[c] = rng.normal(100, 20, n)
+    d["CXR- PPM to cardiac silhouette - shortest (mm)"] = np.where(rng.random(n) < 0.1, np.nan, rng.normal(40, 10, n))
+    d["PPM to LV Apex"] = rng.normal(120, 25, n)
+    d["Widest Chest Transverse Diameter"] = np.where(rng.random(n) < 0.02, 0, rng.normal(300, 20, n))
+    sequences = {"": "TFE (exact sequence listed)", ".1": "CINE_SSFP (exact sequence listed)", ".2": "VIAB (exact sequence listed)"}
+    for sfx, name in sequences.items():
+        avail = rng.random(n) < 0.8
+        d[name] = np.where(avail, "seqX", None)
+        d[f"Any artefact (grade 3 or above){sfx}"] = np.where(avail, rng.choice([0, 1], n), np.nan)
+        d[f"Artefact ratio (biventricular){sfx}"] = np.where(avail, rng.random(n), np.nan)
+        for s in SEGMENTS:
+            g = rng.choice([0, 1, 2, 3, 4], n, p=[0.5, 0.2, 0.1, 0.1, 0.1]).astype(object)
+            g[~avail] = None
+            g[rng.random(n) < 0.02] = "n/a"
+            d[s + sfx] = g
+        d[f"Cause of Artifact (1=IPG, 2=Lead, 3=Both, 0=None){sfx}"] = rng.choice([0, 1, 2, 3], n)
+    d["RV Artefact cause (Lead alone=1, lead and device=2, neither=3,IPG=4)"] = rng.choice([1, 2, 3, 4], n)
+    d["RV Artefact cause (Lead alone=1, lead and device=2, neither=3, IPG=4)"] = rng.choice([1, 2, 3, 4], n)
+    d["RV Artefact cause (Lead alone=1, lead and device=2, neither=3, IPG=4).1"] = rng.choice([1, 2, 3, 4], n)
+    d["Breathing artifact (No=0, Yes=1)"] = rng.choice([0, 1], n)
+    d["Non-diagnostic"] = rng.choice([0, 1, "no"], n, p=[0.8, 0.1, 0.1])
+    d["Did the patients' suspected diagnosis change post MR"] = rng.choice([0, 1], n)
+    d["Did MRI provide additional information to the existing diagnosis? (ie quantity of iron, location of scar, etc) "] = rng.choice(["Yes", "No", 1, 0], n)
+    d[" Was the pre-MRI (tentative) diagnosis confirmed?"] = rng.choice(["Yes", "No"], n)
+    d["Was patient management altered as a result of the scan data?"] = rng.choice([1, 0, "yes", "no"], n)
+    return pd.DataFrame(d)
+
+
+@pytest.fixture(scope="session")
+def workbook(tmp_path_factory):
+    # the synthetic sheet as an .xlsx, and as pd.read_excel parses it
+    path = tmp_path_factory.mktemp("src") / "src.xlsx"
+    raw_sheet(240).to_excel(path, index=False)
+    return str(path), pd.read_excel(path, engine="openpyxl")
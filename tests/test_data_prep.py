@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from conftest import script
+from ingest import arrow_frame
+from schema import apply_schema
+
+prep = script("01_data_prep")
+
+
+def full_build(df: pd.DataFrame) -> tuple:
+    grades = prep.segment_tensor(df)
+    return prep.build_features(df.copy(), grades=grades), grades
+
+
+def incremental(df: pd.DataFrame, tmp_path, full: bool = False) -> tuple:
+    cache, segs = str(tmp_path / "features.parquet"), str(tmp_path / "segments.npy")
+    out, grades, stats = prep.build_features_incremental(df.copy(), cache, segs, full=full)
+    prep.save_segment_tensor(segs, grades)
+    return out, grades, stats
+
+
+def test_incremental_cold_matches_full_build(workbook, tmp_path):
+    _, df = workbook
+    out, grades, stats = incremental(df, tmp_path, full=True)
+    expected, expected_grades = full_build(df)
+    pd.testing.assert_frame_equal(out, expected)
+    np.testing.assert_array_equal(grades, expected_grades)
+    assert stats["full_rebuild"] and stats["recomputed"] == len(df)
+
+
+def test_incremental_update_matches_full_build(workbook, tmp_path):
+    _, df = workbook
+    incremental(df, tmp_path, full=True)
+    # reorder, drop 5 rows, edit 3, append 2 duplicates of cached rows
+    new = df.iloc[::-1].iloc[5:].reset_index(drop=True)
+    new.loc[:2, "Age"] = new.loc[:2, "Age"] + 1
+    new = pd.concat([new, new.iloc[[10, 11]]], ignore_index=True)
+    out, grades, stats = incremental(new, tmp_path)
+    expected, expected_grades = full_build(new)
+    pd.testing.assert_frame_equal(out, expected)
+    np.testing.assert_array_equal(grades, expected_grades)
+    assert {k: stats[k] for k in ("added", "changed", "removed", "recomputed")} == {"added": 0, "changed": 3, "removed": 5, "recomputed": 3}
+    assert stats["unchanged"] == len(new) - 3
+
+
+def test_incremental_reorder_recomputes_nothing(workbook, tmp_path):
+    _, df = workbook
+    incremental(df, tmp_path, full=True)
+    out, _, stats = incremental(df.sample(frac=1, random_state=1).reset_index(drop=True), tmp_path)
+    assert stats["recomputed"] == 0 and stats["unchanged"] == len(df)
+    pd.testing.assert_frame_equal(out, full_build(out[df.columns])[0])
+
+
+def test_streaming_matches_eager(workbook, tmp_path):
+    path, df = workbook
+    out_parquet, segs = str(tmp_path / "clean.parquet"), str(tmp_path / "segments.npy")
+    prep.build_features_streaming(path, str(tmp_path / "dataset"), str(tmp_path / "clean.csv"), segs, chunksize=70, out_parquet=out_parquet)
+    expected, expected_grades = full_build(df)
+    eager = arrow_frame(apply_schema(expected)).to_pandas()
+    pd.testing.assert_frame_equal(pq.read_table(out_parquet).to_pandas(), eager)
+    np.testing.assert_array_equal(np.load(segs), expected_grades)
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+
+from conftest import script
+from glm import SEPARATION_ETA, fit_logit_batch, fit_status, logit_cov, result_diagnostics, separating_terms
+from model_cache import glm_fit
+
+RHS = "x + C(g)"
+# statsmodels warns (overflow, PerfectSeparationWarning) on the separated outcomes
+separated = pytest.mark.filterwarnings("ignore::RuntimeWarning", "ignore::statsmodels.tools.sm_exceptions.PerfectSeparationWarning")
+
+
+@pytest.fixture
+def frame():
+    # y is a regular outcome; "complete" is separated by x, "quasi" is all 0
+    # in level c of g
+    rng = np.random.default_rng(5)
+    n = 600
+    df = pd.DataFrame({"x": rng.normal(size=n), "g": rng.choice(["a", "b", "c"], n)})
+    df["y"] = (rng.random(n) < 1 / (1 + np.exp(-0.5 * df["x"]))).astype(float)
+    df["complete"] = (df["x"] > 0).astype(float)
+    df["quasi"] = np.where(df["g"] == "c", 0.0, (rng.random(n) < 0.5).astype(float))
+    return df
+
+
+def test_fit_status_rules():
+    status = fit_status(
+        converged=[True, True, True, False, False],
+        max_abs_eta=[2.0, SEPARATION_ETA + 1, 3.0, SEPARATION_ETA + 1, 2.0],
+        separating=["", "", "C(g)[T.c]", "", ""],
+    )
+    assert list(status) == ["ok", "separation", "separation", "separation", "nonconverged"]
+    assert list(fit_status([False], [2.0], timed_out=True)) == ["timeout"]
+
+
+def test_separating_terms(frame):
+    assert separating_terms(f"y ~ {RHS}", frame) == ""
+    assert separating_terms(f"quasi ~ {RHS}", frame) == "C(g)[T.c]"
+    assert separating_terms(f"y ~ {RHS}", frame.assign(y=1.0)) == "constant outcome (1)"
+
+
+@separated
+@pytest.mark.parametrize("outcome", ["complete", "quasi"])
+def test_separated_fit_is_not_ok(frame, outcome):
+    # statsmodels path (03 / 06 complete case) and batched path (05 / 06)
+    # agree: separated, converged or not
+    res = glm_fit(f"{outcome} ~ {RHS}", frame, sm.families.Binomial(), cache_dir=None)
+    diag = result_diagnostics(res, separating=separating_terms(f"{outcome} ~ {RHS}", frame))
+    batch = fit_logit_batch(frame, ["y", outcome], RHS)
+    assert diag["status"] == "separation"
+    assert batch.status(outcome) == "separation"
+    assert batch.ok() == ["y"]
+
+
+def test_regular_fit_is_ok_on_both_paths(frame):
+    res = glm_fit(f"y ~ {RHS}", frame, sm.families.Binomial(), cache_dir=None)
+    assert result_diagnostics(res, separating=separating_terms(f"y ~ {RHS}", frame))["status"] == "ok"
+    batch = fit_logit_batch(frame, ["y"], RHS, cov_type="HC3")
+    np.testing.assert_allclose(batch.params["y"].to_numpy(), res.params.to_numpy(), atol=1e-8)
+    np.testing.assert_allclose(batch.cov["y"], logit_cov(res, "HC3"), rtol=1e-6)
+
+
+@separated
+def test_main_model_cell_quarantines_separation(frame, monkeypatch):
+    # 03's fit_cell returns diagnostics only, no estimates, for a separated cell
+    m03 = script("03_models_main")
+    monkeypatch.setattr(m03, "build_formula", lambda y, artifact_metric=None: f"{y} ~ {RHS}")
+    for outcome in ("complete", "quasi"):
+        out = m03.fit_cell(frame, (outcome, "x"))
+        assert out["diagnostics"]["status"] == "separation"
+        assert "coefs" not in out
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+
+import model_cache
+from glm import logit_cov
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(3)
+    n = 400
+    df = pd.DataFrame({"x": rng.normal(size=n), "g": rng.choice(["a", "b", "c"], n)})
+    eta = 0.5 * df["x"] + df["g"].map({"a": 0.0, "b": 0.7, "c": -0.4})
+    df["y"] = (rng.random(n) < 1 / (1 + np.exp(-eta))).astype(int)
+    return df
+
+
+def fit_calls(monkeypatch) -> list:
+    # maxiter of every statsmodels GLM.fit
+    calls = []
+    orig = sm.GLM.fit
+
+    def spy(self, *args, **kwargs):
+        calls.append(kwargs.get("maxiter"))
+        return orig(self, *args, **kwargs)
+
+    monkeypatch.setattr(sm.GLM, "fit", spy)
+    return calls
+
+
+def test_glm_fit_hit_matches_fresh_fit(frame, tmp_path, monkeypatch):
+    calls = fit_calls(monkeypatch)
+    args = ("y ~ x + C(g)", frame, sm.families.Binomial())
+    fresh = model_cache.glm_fit(*args, cache_dir=None)
+    miss = model_cache.glm_fit(*args, cache_dir=str(tmp_path))
+    # a miss returns the fit that ran, without a maxiter=0 rebuild
+    assert calls == [100, 100]
+    hit = model_cache.glm_fit(*args, cache_dir=str(tmp_path))
+    assert calls == [100, 100, 0]
+
+    for res in (miss, hit):
+        pd.testing.assert_series_equal(res.params, fresh.params)
+        pd.testing.assert_frame_equal(res.cov_params(), fresh.cov_params())
+        np.testing.assert_allclose(logit_cov(res), logit_cov(fresh), rtol=1e-12)
+        np.testing.assert_allclose(res.predict(frame.iloc[:20]), fresh.predict(frame.iloc[:20]), rtol=1e-12)
+        assert res.converged == fresh.converged and res.n_iter == fresh.n_iter
+
+
+def test_glm_fit_key_tracks_frame_content(frame, tmp_path, monkeypatch):
+    calls = fit_calls(monkeypatch)
+    args = ("y ~ x + C(g)", sm.families.Binomial())
+    model_cache.glm_fit(args[0], frame, args[1], cache_dir=str(tmp_path))
+    changed = frame.assign(x=frame["x"] + 1.0)
+    res = model_cache.glm_fit(args[0], changed, args[1], cache_dir=str(tmp_path))
+    assert calls == [100, 100]
+    np.testing.assert_allclose(res.params, model_cache.glm_fit(args[0], changed, args[1], cache_dir=None).params)